@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module calibrating the x-axis (pixel -> Raman shift) from the
+observed peaks of gases (H2, HD, D2) or liquids with accurately known
+positions, for example column 1 of compute_spectra or
+compute_series_para/perp.
+
+The peaks of all frames are located at once : local maxima standing
+above the local minimum by more than snr times the noise of the frame,
+with a sub-pixel position from the gaussian (3-point, log-parabola)
+interpolation. With the present axis, every peak is matched to the
+nearest reference line after removing a common offset (the most
+frequent difference). The present axis is corrected with polynomials of
+increasing degree, matching with a decreasing tolerance, and the
+polynomial pixel -> wavenumber (degree 3 by default) is finally fitted
+to the matched lines. All frames are fitted together (batched normal
+equations), with rejection of outliers.
+
+An accurate axis matters for C0 (see gen_C0, computed from the spacing
+of the axis) and for the band positions used in the C2 fits. After the
+calibration, C0 should be regenerated with the new axis."""
+
+import numpy as np
+from scipy.ndimage import minimum_filter1d
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# reference_lines(line_lists, resolution=1.0, min_fraction=0.001)
+#    Positions of the reference lines from stick spectra, with lines
+#    closer than resolution merged
+
+# find_peaks(spectra, snr=10.0, half_width=10)
+#    Sub-pixel positions and heights of the peaks, (n_frames, n_max)
+
+# calibrate_axis(spectra, references, axis, degree=3, tolerance=2.0,
+#                search=30.0, ...)
+#    Fitted axis of every frame, (n_pixels, n_frames), with the matches
+#    and the residuals
+
+# ------------------------------------------------------
+
+# lines kept after clipping : |residual| < clip * robust rms
+clip = 4.0
+
+# ------------------------------------------------------
+
+
+def reference_lines(line_lists, resolution=1.0, min_fraction=0.001,
+                    position_column=1, intensity_column=2):
+    '''Reference positions from stick spectra
+
+    line_lists   = list of 2D arrays (lines in rows), as returned by
+                   compute_spectra (J | position | intensity)
+    resolution   = lines closer than this are merged (intensity
+                   weighted mean position), as they are not resolved
+    min_fraction = lines weaker than min_fraction of the strongest line
+                   (after merging) are not kept
+
+    returns => positions (sorted) '''
+
+    lines = np.vstack([np.asarray(s, dtype=np.float64) for s in line_lists])
+    pos = lines[:, position_column]
+    inten = lines[:, intensity_column]
+    order = np.argsort(pos)
+    pos, inten = pos[order], inten[order]
+
+    # groups of lines closer than resolution
+    group = np.concatenate(([0], np.cumsum(np.diff(pos) > resolution)))
+    total = np.bincount(group, weights=inten)
+    merged = np.bincount(group, weights=inten * pos) / total
+    return merged[total >= min_fraction * np.amax(total)]
+
+# ------------------------------------------------------
+
+
+def find_peaks(spectra, snr=10.0, half_width=10):
+    '''Peaks of all frames, located at once
+
+    spectra    = spectrum (n_pixels) or frames (n_pixels, n_frames)
+    snr        = minimum height of a peak above the local minimum (within
+                 half_width pixels), in units of the noise of the frame
+                 (from the median absolute difference of neighbouring
+                 pixels)
+    half_width = half-width (pixels) of the window for the local minimum
+
+    returns => (pixels, heights), arrays (n_frames, n_max), nan padded,
+               pixels are sub-pixel positions sorted in each frame '''
+
+    y = np.asarray(spectra, dtype=np.float64)
+    if y.ndim == 1:
+        y = y[:, None]
+
+    noise = np.median(np.abs(np.diff(y, axis=0)), axis=0) / 0.9539
+    base = minimum_filter1d(y, 2 * half_width + 1, axis=0, mode='nearest')
+
+    left, mid, right = y[:-2], y[1:-1], y[2:]
+    peak = (mid > left) & (mid >= right) & \
+        (mid - base[1:-1] > snr * noise)
+
+    # gaussian interpolation (parabola of the log) on positive points,
+    # otherwise parabola
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lg = np.log(np.clip(np.stack((left, mid, right)) - base[1:-1],
+                            1e-300, None))
+        den_log = lg[0] - 2.0 * lg[1] + lg[2]
+        den = left - 2.0 * mid + right
+        delta = np.where(den_log < 0, 0.5 * (lg[0] - lg[2]) / den_log,
+                         0.5 * (left - right) / den)
+    delta = np.clip(np.nan_to_num(delta), -0.5, 0.5)
+
+    frame, pixel = np.nonzero(peak.T)
+    counts = np.bincount(frame, minlength=y.shape[1])
+    n_max = max(int(counts.max()) if counts.size else 0, 1)
+    slot = np.arange(frame.shape[0]) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+
+    pixels = np.full((y.shape[1], n_max), np.nan)
+    heights = np.full((y.shape[1], n_max), np.nan)
+    pixels[frame, slot] = pixel + 1 + delta[pixel, frame]
+    heights[frame, slot] = mid[pixel, frame] - base[pixel + 1, frame]
+    return pixels, heights
+
+# ------------------------------------------------------
+
+
+def _match(peaks, references, tolerance):
+    '''Mutual nearest matches of the peak positions (n_frames, n_max, in
+    wavenumbers) with the references, within tolerance
+
+    returns => index of the matched peak for every reference,
+               (n_frames, n_ref), -1 when not matched '''
+
+    dist = np.abs(peaks[:, :, None] - references[None, None, :])
+    dist = np.where(np.isnan(dist), np.inf, dist)
+    best_peak = np.argmin(dist, axis=1)                 # (F, R)
+    best_ref = np.argmin(dist, axis=2)                  # (F, M)
+    d = np.amin(dist, axis=1)
+    mutual = np.take_along_axis(best_ref, best_peak, axis=1) == \
+        np.arange(references.shape[0])[None, :]
+    return np.where(mutual & (d <= tolerance), best_peak, -1)
+
+
+def _offset(peaks, references, tolerance, search):
+    '''Offset of the present axis of every frame : the most frequent
+    difference reference - peak within search (histogram with bins of
+    tolerance / 2, summed over 3 bins), refined by the median of the
+    differences close to it
+
+    returns => offset (n_frames) '''
+
+    n_frames = peaks.shape[0]
+    diff = (references[None, None, :] - peaks[:, :, None]).reshape(
+        n_frames, -1)
+    width = 0.5 * tolerance
+    n_bins = int(np.ceil(2 * search / width)) + 1
+    b = np.floor((diff + search) / width)
+    use = (np.abs(diff) <= search) & ~np.isnan(diff)
+    frame = np.broadcast_to(np.arange(n_frames)[:, None], diff.shape)
+    hist = np.bincount((frame[use] * n_bins + b[use].astype(np.int64)),
+                       minlength=n_frames * n_bins).reshape(n_frames, n_bins)
+    hist = hist + np.pad(hist, ((0, 0), (1, 0)))[:, :-1] + \
+        np.pad(hist, ((0, 0), (0, 1)))[:, 1:]
+    guess = (np.argmax(hist, axis=1) + 0.5) * width - search
+
+    close = np.abs(diff - guess[:, None]) <= tolerance
+    with np.errstate(all='ignore'):
+        offset = np.nanmedian(np.where(close, diff, np.nan), axis=1)
+    return np.where(np.isnan(offset), guess, offset)
+
+
+def _polyval(u, coefs):
+    '''Polynomials of every frame, coefs (n_frames, degree + 1), at u
+    (n_frames, m) or (m) (Horner scheme)
+
+    returns => (n_frames, m) '''
+
+    out = np.broadcast_to(coefs[:, -1:], (coefs.shape[0],) +
+                          np.shape(u)[-1:]).copy()
+    for k in range(coefs.shape[1] - 2, -1, -1):
+        out *= u
+        out += coefs[:, k:k + 1]
+    return out
+
+
+def _matched(u_peaks, pixels, current, references, tolerance):
+    '''Matches of the peaks (at current wavenumbers) with the references
+
+    returns => (u, pixels) of the peak matched to every reference, nan
+               when not matched, and the index of the peak '''
+
+    match = _match(current, references, tolerance)
+    u = np.take_along_axis(u_peaks, np.maximum(match, 0), axis=1)
+    matched = np.take_along_axis(pixels, np.maximum(match, 0), axis=1)
+    u[match < 0] = np.nan
+    matched[match < 0] = np.nan
+    return u, matched, match
+
+
+def _robust_fit(u, target, degree, tolerance):
+    '''Polynomial fits of all frames, refitted without the lines whose
+    residual is above clip times the robust rms of the frame
+
+    returns => (coefs, residuals, weights) '''
+
+    weight = (~np.isnan(u)).astype(np.float64)
+    for _ in range(2):
+        coefs = _fit(u, target, weight, degree)
+        res = _polyval(np.nan_to_num(u), coefs) - target
+        res[weight == 0] = np.nan
+        with np.errstate(all='ignore'):
+            robust = 1.4826 * np.nanmedian(np.abs(res), axis=1)
+        robust = np.maximum(np.nan_to_num(robust), 1e-6 * tolerance)
+        weight[np.abs(np.nan_to_num(res, nan=np.inf))
+               > clip * robust[:, None]] = 0.0
+    res[weight == 0] = np.nan
+    return coefs, res, weight
+
+
+def _fit(u, target, weight, degree):
+    '''Weighted polynomial fits of all frames (batched normal equations)
+
+    u, target, weight = (n_frames, n_ref)
+
+    returns => coefs (n_frames, degree + 1), in powers of u '''
+
+    V = u[:, :, None] ** np.arange(degree + 1)
+    V = np.where(np.isnan(V), 0.0, V)
+    t = np.nan_to_num(target)
+    Vw = V * weight[:, :, None]
+    hess = np.einsum('fmp,fmq->fpq', Vw, V)
+    rhs = np.einsum('fmp,fm->fp', Vw, t)
+    return (np.linalg.pinv(hess) @ rhs[:, :, None])[:, :, 0]
+
+# ------------------------------------------------------
+
+
+def calibrate_axis(spectra, references, axis, degree=3, tolerance=2.0,
+                   search=30.0, snr=10.0, half_width=10, iterations=3,
+                   pixels=None):
+    '''Fit a polynomial pixel -> wavenumber to every frame
+
+    spectra    = spectrum (n_pixels) or frames (n_pixels, n_frames)
+    references = accurate positions of the lines (see reference_lines)
+    axis       = present (approximate) axis, (n_pixels), used for the
+                 first matching
+    degree     = degree of the polynomial
+    tolerance  = maximum distance (wavenumbers) of a matched peak from its
+                 reference, after removing the offset
+    search     = maximum offset of the present axis (wavenumbers)
+    snr, half_width = see find_peaks
+    iterations = number of corrections of the present axis (of degree 1,
+                 2, ... up to degree) before the final fit, the tolerance
+                 is halved at each, down to tolerance
+    pixels     = peak positions from find_peaks (optional, to reuse them)
+
+    returns => dict with
+                 axis      = fitted axis, (n_pixels) or
+                             (n_pixels, n_frames)
+                 coefs     = polynomial coefs in powers of
+                             u = 2 * pixel / (n_pixels - 1) - 1
+                 offset    = offset of the present axis, per frame
+                 matches   = sub-pixel position of every reference,
+                             (n_frames, n_ref), nan when not matched
+                 residuals = fitted - reference position (wavenumbers),
+                             nan for unmatched or rejected lines
+                 rms       = rms of the residuals, per frame
+                 n_lines   = number of lines used, per frame
+                 ok        = enough lines (> degree + 1) in the frame '''
+
+    y = np.asarray(spectra, dtype=np.float64)
+    single = y.ndim == 1
+    if single:
+        y = y[:, None]
+    axis = np.asarray(axis, dtype=np.float64)
+    references = np.sort(np.asarray(references, dtype=np.float64))
+    n_pix, n_frames = y.shape
+    if axis.shape[0] != n_pix:
+        raise ValueError('Dimension mismatch for axis ({0}) and spectra ({1})'
+                         .format(axis.shape[0], n_pix))
+
+    if pixels is None:
+        pixels = find_peaks(y, snr, half_width)[0]
+    idx = np.arange(n_pix)
+    peaks = np.interp(np.nan_to_num(pixels), idx, axis)
+    peaks[np.isnan(pixels)] = np.nan
+
+    offset = _offset(peaks, references, tolerance, search)
+    scale = 2.0 / max(n_pix - 1, 1)
+    u_peaks = pixels * scale - 1.0
+
+    # corrections of the present axis, of increasing degree, matched with
+    # a decreasing tolerance
+    current = peaks + offset[:, None]
+    for k in range(iterations):
+        tol = min(tolerance * 2.0**(iterations - 1 - k), search)
+        u, matched, match = _matched(u_peaks, pixels, current, references,
+                                     tol)
+        target = references[None, :] - np.take_along_axis(
+            peaks, np.maximum(match, 0), axis=1)
+        corr, res, weight = _robust_fit(u, target, min(degree, k + 1),
+                                        tolerance)
+        current = peaks + _polyval(u_peaks, corr)
+
+    # pixel -> wavenumber polynomial
+    u, matched, match = _matched(u_peaks, pixels, current, references,
+                                 tolerance)
+    coefs, res, weight = _robust_fit(u, np.broadcast_to(
+        references, u.shape), degree, tolerance)
+
+    n_lines = weight.sum(axis=1).astype(int)
+    ok = n_lines > degree + 1
+    with np.errstate(all='ignore'):
+        rms = np.sqrt(np.nanmean(res**2, axis=1))
+
+    fitted = _polyval(idx * scale - 1.0, coefs).T
+    fitted[:, ~ok] = np.nan
+    matched[weight == 0] = np.nan
+
+    out = {'axis': fitted, 'coefs': coefs, 'offset': offset,
+           'matches': matched, 'residuals': res, 'rms': rms,
+           'n_lines': n_lines, 'ok': ok}
+    if single:
+        out = {k: (v[:, 0] if k == 'axis' else v[0]) for k, v in out.items()}
+    return out
+
+# ------------------------------------------------------
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module extracting band areas, with their errors, from spectra, at
+the predicted band positions (for example column 1 of compute_spectra
+or compute_series_para/perp). The output has the format of the band
+area files used by the genC2 and T_determn modules (BA_H2_1,
+sample_BA_D2, ...) : one row per band, ( area | error ), in the order
+of the given positions.
+
+The bands are grouped into segments : bands closer than twice the
+window share a segment. For every segment, all bands and a polynomial
+baseline (Legendre, of the given degree, on the segment) are fitted
+together. The free parameters are the areas, the baseline coefs, a
+shift of every band position (within max_shift) and the shape of the
+profile (widths, and eta for the pseudo-Voigt) shared by the bands of
+the segment.
+
+All spectra are fitted at once. The initial areas and baseline are
+obtained from one linear least squares solution for all spectra. They
+are then refined with Levenberg-Marquardt iterations applied to the
+block of spectra, using analytical derivatives of the profiles. The
+errors of the areas are obtained from the covariance at the optimum,
+scaled by the reduced chi-square when the errors of the points are not
+given."""
+
+import numpy as np
+from numpy.polynomial import legendre
+from scipy.special import wofz
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# extract_band_areas(xaxis, spectra, positions, profile='pseudo_voigt',
+#                    fwhm=2.0, fwhm_lorentz=None, eta=0.5, baseline=1,
+#                    window=None, fit_shape=True, fit_shift=True,
+#                    max_shift=None, errors=None, maxiter=100)
+#    Band areas ( area | error ), (n_bands, 2) or (n_spectra, n_bands, 2)
+
+# save_band_areas(result, filename, index=0)
+#    Band areas of one spectrum as text file, as read by the genC2 modules
+
+# profile_values(profile, x, x0, shape)
+#    Profile of unit area, with the derivatives used in the fit
+
+# ------------------------------------------------------
+
+profiles = ('gaussian', 'lorentzian', 'pseudo_voigt', 'voigt')
+
+# spectra fitted at once (limits the memory used by the Jacobian)
+chunk = 64
+
+# widths may change by this factor from the initial values
+width_range = 5.0
+
+_ln2 = np.log(2.0)
+
+# ------------------------------------------------------
+
+
+def _initial_shape(profile, fwhm, fwhm_lorentz, eta):
+    '''Shape parameters, as fitted : log of the widths, and eta'''
+
+    if profile not in profiles:
+        raise ValueError('profile should be one of {0}'.format(profiles))
+    if profile in ('gaussian', 'lorentzian'):
+        return np.array([np.log(fwhm)])
+    if profile == 'pseudo_voigt':
+        return np.array([np.log(fwhm), float(eta)])
+    if fwhm_lorentz is None or fwhm_lorentz <= 0:
+        raise ValueError('fwhm_lorentz > 0 is required for the voigt profile')
+    return np.array([np.log(fwhm), np.log(fwhm_lorentz)])
+
+
+def _fwhm(profile, shape):
+    '''Approximate FWHM of the profile from the shape parameters'''
+
+    if profile == 'voigt':
+        fg, fl = np.exp(shape[..., 0]), np.exp(shape[..., 1])
+        return 0.5346 * fl + np.sqrt(0.2166 * fl**2 + fg**2)
+    return np.exp(shape[..., 0])
+
+# ------------------------------------------------------
+
+
+def profile_values(profile, x, x0, shape):
+    '''Profile of unit area at x for the bands at x0
+
+    profile = 'gaussian', 'lorentzian' (shape = log fwhm),
+              'pseudo_voigt' (shape = log fwhm, eta) or
+              'voigt' (shape = log gaussian fwhm, log lorentzian fwhm)
+    x       = points, (n_points)
+    x0      = band positions, (..., n_bands)
+    shape   = shape parameters, (..., n_shape)
+
+    returns => (values, d/dx0, d/dshape), arrays (..., n_points, n_bands)
+               and (..., n_points, n_bands, n_shape) '''
+
+    shape = np.asarray(shape, dtype=np.float64)
+    d = x[:, None] - np.asarray(x0)[..., None, :]
+    s = shape[..., None, None, :]
+
+    if profile == 'voigt':
+        fg = np.exp(s[..., 0])
+        fl = np.exp(s[..., 1])
+        sigma = fg / (2.0 * np.sqrt(2.0 * _ln2))
+        gamma = fl / 2.0
+        norm = 1.0 / (sigma * np.sqrt(2.0 * np.pi))
+        z = (d + 1j * gamma) / (sigma * np.sqrt(2.0))
+        w = wofz(z)
+        dw = -2.0 * z * w + 2j / np.sqrt(np.pi)
+        val = w.real * norm
+        dx0 = -(dw.real * norm) / (sigma * np.sqrt(2.0))
+        # log widths : sigma d/dsigma and gamma d/dgamma
+        dlog_fg = (dw * (-z)).real * norm - val
+        dlog_fl = (dw * 1j).real * norm * gamma / (sigma * np.sqrt(2.0))
+        return val, dx0, np.stack((dlog_fg, dlog_fl), axis=-1)
+
+    f = np.exp(s[..., 0])
+    q = (d / f)**2
+    gauss = np.sqrt(4.0 * _ln2 / np.pi) / f * np.exp(-4.0 * _ln2 * q)
+    lor = 2.0 / (np.pi * f) / (1.0 + 4.0 * q)
+    g_dx0 = gauss * 8.0 * _ln2 * d / f**2
+    l_dx0 = lor * 8.0 * d / f**2 / (1.0 + 4.0 * q)
+    g_dlog = gauss * (8.0 * _ln2 * q - 1.0)
+    l_dlog = lor * (8.0 * q / (1.0 + 4.0 * q) - 1.0)
+
+    if profile == 'gaussian':
+        return gauss, g_dx0, g_dlog[..., None]
+    if profile == 'lorentzian':
+        return lor, l_dx0, l_dlog[..., None]
+
+    eta = s[..., 1]
+    val = eta * lor + (1.0 - eta) * gauss
+    dx0 = eta * l_dx0 + (1.0 - eta) * g_dx0
+    dlog = eta * l_dlog + (1.0 - eta) * g_dlog
+    return val, dx0, np.stack((dlog, lor - gauss), axis=-1)
+
+# ------------------------------------------------------
+
+
+def _segments(positions, valid, window):
+    '''Groups of bands (indices) whose windows overlap'''
+
+    order = [i for i in np.argsort(positions) if valid[i]]
+    groups = []
+    for i in order:
+        if groups and positions[i] - positions[groups[-1][-1]] < 2 * window:
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    return [np.array(g) for g in groups]
+
+
+class _Segment:
+    '''Model of the points of one segment : bands and baseline
+
+    The parameters of a spectrum are ordered as
+        areas (K) | baseline coefs (B) | shifts (K, if fit_shift) |
+        shape (n_shape, if fit_shape) '''
+
+    def __init__(self, x, x0, profile, shape0, degree, fit_shape, fit_shift,
+                 max_shift):
+        self.x = x
+        self.x0 = x0
+        self.profile = profile
+        self.shape0 = shape0
+        self.fit_shape = fit_shape
+        self.fit_shift = fit_shift
+        self.max_shift = max_shift
+
+        u = 2.0 * (x - x.min()) / max(x.max() - x.min(), 1e-12) - 1.0
+        self.basis = legendre.legvander(u, degree) if degree >= 0 \
+            else np.zeros((x.shape[0], 0))
+
+        self.K = x0.shape[0]
+        self.B = self.basis.shape[1]
+        self.n_shift = self.K if fit_shift else 0
+        self.n_shape = shape0.shape[0] if fit_shape else 0
+        self.n_param = self.K + self.B + self.n_shift + self.n_shape
+
+    def split(self, theta):
+        '''(areas, coefs, positions, shape) from the parameters (S, P)'''
+
+        S = theta.shape[0]
+        areas = theta[:, :self.K]
+        coefs = theta[:, self.K:self.K + self.B]
+        i = self.K + self.B
+        pos = np.broadcast_to(self.x0, (S, self.K))
+        if self.fit_shift:
+            pos = pos + theta[:, i:i + self.K]
+            i += self.K
+        shape = theta[:, i:] if self.fit_shape else \
+            np.broadcast_to(self.shape0, (S, self.shape0.shape[0]))
+        return areas, coefs, pos, shape
+
+    def initial(self, y, w):
+        '''Areas and baseline at the initial shape and positions, from
+        one linear least squares solution for all spectra (y : n, S)'''
+
+        val = profile_values(self.profile, self.x, self.x0, self.shape0)[0]
+        design = np.hstack((val, self.basis))
+        if w.ndim == 1:
+            lin = np.linalg.lstsq(design * w[:, None], y * w[:, None],
+                                  rcond=None)[0].T
+        else:
+            # weights of every spectrum : normal equations, one batched solve
+            dw = design[None, :, :] * w.T[:, :, None]
+            hess = np.einsum('snp,snq->spq', dw, dw)
+            rhs = np.einsum('snp,sn->sp', dw, (y * w).T)
+            lin = (np.linalg.pinv(hess) @ rhs[:, :, None])[:, :, 0]
+        theta = np.zeros((y.shape[1], self.n_param))
+        theta[:, :self.K + self.B] = lin
+        if self.fit_shape:
+            theta[:, self.K + self.B + self.n_shift:] = self.shape0
+        return theta
+
+    def model(self, theta, jacobian=True):
+        '''Model (S, n) and Jacobian (S, n, P)'''
+
+        areas, coefs, pos, shape = self.split(theta)
+        val, dx0, dshape = profile_values(self.profile, self.x, pos, shape)
+        model = np.einsum('snk,sk->sn', val, areas) + coefs @ self.basis.T
+        if not jacobian:
+            return model, None
+
+        parts = [val, np.broadcast_to(self.basis, (theta.shape[0],)
+                                      + self.basis.shape)]
+        if self.fit_shift:
+            parts.append(dx0 * areas[:, None, :])
+        if self.fit_shape:
+            parts.append(np.einsum('snkm,sk->snm', dshape, areas))
+        return model, np.concatenate(parts, axis=2)
+
+    def clip(self, theta):
+        '''Keep the shifts within max_shift and the shape in its range'''
+
+        i = self.K + self.B
+        if self.fit_shift:
+            np.clip(theta[:, i:i + self.K], -self.max_shift, self.max_shift,
+                    out=theta[:, i:i + self.K])
+            i += self.K
+        if self.fit_shape:
+            lo = self.shape0 - np.log(width_range)
+            hi = self.shape0 + np.log(width_range)
+            if self.profile == 'pseudo_voigt':
+                lo[1], hi[1] = 0.0, 1.0
+            np.clip(theta[:, i:], lo, hi, out=theta[:, i:])
+        return theta
+
+# ------------------------------------------------------
+
+
+def _levenberg_marquardt(seg, theta, y, w, maxiter, tol):
+    '''Batched Levenberg-Marquardt for the spectra of a chunk
+
+    y, w = points and weights (S, n)
+
+    returns => (theta, chi-square, converged, Hessian J^T W J) '''
+
+    S = theta.shape[0]
+    lam = np.full(S, 1e-3)
+    done = np.zeros(S, dtype=bool)
+    model, jac = seg.model(theta)
+    r = (y - model) * w
+    cost = np.einsum('sn,sn->s', r, r)
+    idx = np.arange(seg.n_param)
+
+    for _ in range(maxiter):
+        jw = jac * w[:, :, None]
+        hess = np.einsum('snp,snq->spq', jw, jw)
+        grad = np.einsum('snp,sn->sp', jw, r)
+
+        damped = hess.copy()
+        diag = hess[:, idx, idx]
+        floor = 1e-12 * np.amax(diag, axis=1, keepdims=True) + 1e-300
+        damped[:, idx, idx] = diag + lam[:, None] * np.maximum(diag, floor)
+        step = np.linalg.solve(damped, grad[:, :, None])[:, :, 0]
+
+        trial = seg.clip(theta + step)
+        t_model, _ = seg.model(trial, jacobian=False)
+        t_r = (y - t_model) * w
+        t_cost = np.einsum('sn,sn->s', t_r, t_r)
+
+        better = (t_cost < cost) & ~done
+        small = (cost - t_cost) <= tol * cost
+        done |= better & small
+        # no decrease with a large damping : at the optimum
+        done |= ~better & (lam > 1e10)
+
+        theta[better] = trial[better]
+        cost[better] = t_cost[better]
+        lam = np.where(better, lam / 3.0, lam * 3.0)
+        if np.all(done):
+            break
+        if np.any(better):
+            model, jac = seg.model(theta)
+            r = (y - model) * w
+
+    model, jac = seg.model(theta)
+    jw = jac * w[:, :, None]
+    hess = np.einsum('snp,snq->spq', jw, jw)
+    return theta, cost, done, hess
+
+# ------------------------------------------------------
+
+
+def extract_band_areas(xaxis, spectra, positions, profile='pseudo_voigt',
+                       fwhm=2.0, fwhm_lorentz=None, eta=0.5, baseline=1,
+                       window=None, fit_shape=True, fit_shift=True,
+                       max_shift=None, errors=None, maxiter=100, tol=1e-10):
+    '''Fit all bands and baselines of the spectra
+
+    xaxis        = x-axis (n_points), uniform or not
+    spectra      = spectrum (n_points) or block of spectra
+                   (n_points, n_spectra), one spectrum per column
+    positions    = predicted band positions (n_bands), for example
+                   column 1 of compute_spectra. Bands outside the x-axis
+                   are not fitted (nan in the output)
+    profile      = 'gaussian', 'lorentzian', 'pseudo_voigt' or 'voigt'
+    fwhm         = initial FWHM (gaussian part for the voigt)
+    fwhm_lorentz = initial lorentzian FWHM of the voigt
+    eta          = initial lorentzian fraction of the pseudo-voigt
+    baseline     = degree of the baseline polynomial of every segment
+                   (-1 for no baseline)
+    window       = points within window of a band are used (default :
+                   5 times the FWHM)
+    fit_shape    = fit the widths (and eta) of every segment
+    fit_shift    = fit the position of every band, within max_shift of
+                   the predicted one (default : max_shift = FWHM)
+    errors       = errors of the points, as spectra or (n_points).
+                   When not given, the errors of the areas are scaled by
+                   the reduced chi-square of the segment
+    maxiter      = maximum number of iterations
+
+    returns => dict with
+                 areas     = ( area | error ), (n_bands, 2) or
+                             (n_spectra, n_bands, 2)
+                 positions = fitted band positions
+                 fwhm      = fitted FWHM of the band profiles
+                 chi2      = chi-square of each segment,
+                             (n_spectra, n_segments)
+                 converged = (n_spectra, n_segments)
+                 segments  = list of the indices of the bands of every
+                             segment
+                 fit       = model of the spectra (as spectra) '''
+
+    xaxis = np.asarray(xaxis, dtype=np.float64)
+    spectra = np.asarray(spectra, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    single = spectra.ndim == 1
+    y_all = spectra[:, None] if single else spectra
+    if y_all.shape[0] != xaxis.shape[0]:
+        raise ValueError('Dimension mismatch for xaxis ({0}) and spectra ({1})'
+                         .format(xaxis.shape[0], y_all.shape[0]))
+    n_spectra = y_all.shape[1]
+
+    shape0 = _initial_shape(profile, fwhm, fwhm_lorentz, eta)
+    width = float(_fwhm(profile, shape0))
+    window = 5.0 * width if window is None else float(window)
+    max_shift = width if max_shift is None else float(max_shift)
+
+    if errors is None:
+        w_all = np.ones(xaxis.shape[0])
+    else:
+        errors = np.asarray(errors, dtype=np.float64)
+        w_all = 1.0 / (errors[:, None] if single else errors)
+
+    valid = (positions >= np.amin(xaxis)) & (positions <= np.amax(xaxis))
+    groups = _segments(positions, valid, window)
+
+    n_bands = positions.shape[0]
+    areas = np.full((n_spectra, n_bands, 2), np.nan)
+    fitted_pos = np.full((n_spectra, n_bands), np.nan)
+    fitted_fwhm = np.full((n_spectra, n_bands), np.nan)
+    chi2 = np.zeros((n_spectra, len(groups)))
+    converged = np.zeros((n_spectra, len(groups)), dtype=bool)
+    fit = np.full(y_all.shape, np.nan)
+
+    for g, bands in enumerate(groups):
+        x0 = positions[bands]
+        mask = (xaxis >= x0.min() - window) & (xaxis <= x0.max() + window)
+        seg = _Segment(xaxis[mask], x0, profile, shape0, baseline, fit_shape,
+                       fit_shift, max_shift)
+        y_seg = y_all[mask]
+        w_seg = w_all[mask]
+        dof = max(mask.sum() - seg.n_param, 1)
+
+        for start in range(0, n_spectra, chunk):
+            sl = slice(start, min(start + chunk, n_spectra))
+            y = y_seg[:, sl]
+            w = w_seg if w_seg.ndim == 1 else w_seg[:, sl]
+            theta = seg.initial(y, w)
+            w2 = np.broadcast_to(w.T if w.ndim == 2 else w, (y.shape[1],
+                                                             y.shape[0]))
+            theta, cost, done, hess = _levenberg_marquardt(
+                seg, seg.clip(theta), np.ascontiguousarray(y.T), w2, maxiter,
+                tol)
+
+            cov = np.linalg.pinv(hess)
+            var = np.diagonal(cov, axis1=1, axis2=2)[:, :seg.K]
+            if errors is None:
+                var = var * (cost / dof)[:, None]
+            a, _, pos, shape = seg.split(theta)
+            areas[sl, bands, 0] = a
+            areas[sl, bands, 1] = np.sqrt(var)
+            fitted_pos[sl, bands] = pos
+            fitted_fwhm[sl, bands] = _fwhm(profile, shape)[:, None]
+            chi2[sl, g] = cost
+            converged[sl, g] = done
+            fit[np.flatnonzero(mask), sl] = seg.model(theta, False)[0].T
+
+    if single:
+        areas, fitted_pos, fitted_fwhm = areas[0], fitted_pos[0], \
+            fitted_fwhm[0]
+        chi2, converged, fit = chi2[0], converged[0], fit[:, 0]
+    return {'areas': areas, 'positions': fitted_pos, 'fwhm': fitted_fwhm,
+            'chi2': chi2, 'converged': converged, 'segments': groups,
+            'fit': fit}
+
+# ------------------------------------------------------
+
+
+def save_band_areas(result, filename, index=0):
+    '''Save the band areas ( area | error ) of spectrum index as text
+    file, in the format read by the genC2 and T_determn modules (for
+    example BA_D2_1)
+
+    result = output of extract_band_areas '''
+
+    areas = result['areas']
+    if areas.ndim == 3:
+        areas = areas[index]
+    np.savetxt(filename, areas)
+
+# ------------------------------------------------------
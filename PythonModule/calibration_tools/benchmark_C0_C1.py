@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Throughput benchmarks for the C0/C1 correction (gen_C0_C1) and for
+the application of the correction to large numbers of spectra.
+
+Synthetic inputs are generated : frames of a broadband white-light lamp
+(black-body emission at the lamp temperature, with noise and drift of
+the intensity) on a non-uniform Raman shift axis, and cubes of spectra
+(rows) of configurable size. Timed are
+
+    gen_C0_C1  : C0/C1 from the stack of lamp frames (one fit)
+    C1_rows    : C1 fitted to every frame separately (as in gen_C1)
+    apply      : multiplication of every spectrum with the correction
+
+The C1_rows and apply benchmarks are run with each backend :
+
+    single     : arrays in memory, this process
+    process    : arrays in memory, chunks of rows sent to a pool of
+                 processes (ProcessPoolExecutor)
+    memmap     : arrays in .npy files on disk, memory mapped, the
+                 processes of the pool read and write their rows in the
+                 files (no copy of the data between processes, the size
+                 is not limited by the memory)
+
+Every benchmark runs in its own process. Reported are the wall time,
+the throughput (spectra/s and MB/s of input) and the peak memory, both
+as allocated by numpy in the main process (tracemalloc, after the
+inputs were generated, in one more run after the timed runs, which are
+not traced) and as maximum resident size of the main process and of
+the pool. The results are saved as a JSON baseline and compared
+as for benchmark_C2 (see benchmark_utils).
+
+    python benchmark_C0_C1.py run --spectra 200000 --points 1340
+    python benchmark_C0_C1.py run --backends single memmap --n-jobs 8
+    python benchmark_C0_C1.py compare benchmarks/C0_C1_v1.json benchmarks/C0_C1_v2.json """
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.optimize import curve_fit
+
+import benchmark_utils
+
+try:
+    import resource
+except ImportError:      # not available on Windows
+    resource = None
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# lamp_frames(n_frames, n_points=1340, laser_nm=532.2, T_lamp=2850.0, ...)
+#    Ramanshift axis and synthetic white-light frames (n_frames, n_points)
+
+# spectral_cube(n_spectra, n_points=1340, dtype=np.float64, filename=None)
+#    Synthetic spectra (n_spectra, n_points), in memory or in a .npy file
+
+# fit_C1_rows(Ramanshift, laser_nm, frames, norm_pnt, backend='single')
+#    C1 of every frame
+
+# apply_correction(cube, correction, backend='single', out=None)
+#    Corrected spectra, cube * correction
+
+# run(...) : run the benchmarks, returns dict of name -> result and the
+#           list of the benchmarks that failed
+
+# ------------------------------------------------------
+
+backends = ('single', 'process', 'memmap')
+
+# rows read at once from a memory mapped file
+chunk_rows = 4096
+
+# ------------------------------------------------------
+
+
+def _import_gen_correction():
+    '''gen_correction is in the directory determine_C0_C1_correction'''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'determine_C0_C1_correction')
+    if path not in sys.path:
+        sys.path.append(path)
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        import gen_correction
+    return gen_correction
+
+# ------------------------------------------------------
+#                  SYNTHETIC INPUTS
+# ------------------------------------------------------
+
+
+def raman_axis(n_points=1340, start=200.0, stop=4000.0):
+    '''Raman shift axis with a slowly changing spacing (as for a grating
+    spectrometer, linear in wavelength rather than in wavenumber)'''
+
+    u = np.linspace(0.0, 1.0, n_points)
+    return start + (stop - start) * (0.9 * u + 0.1 * u**2)
+
+
+def lamp_frames(n_frames, n_points=1340, laser_nm=532.2, T_lamp=2850.0,
+                noise=0.01, drift=0.05, seed=0):
+    '''Synthetic frames of a broadband white-light lamp : black-body
+    emission (photons per unit wavenumber) at T_lamp, each frame scaled
+    by 1 + drift * N(0, 1), with relative noise
+
+    returns => Ramanshift (n_points), frames (n_frames, n_points) '''
+
+    gen_correction = _import_gen_correction()
+    rng = np.random.default_rng(seed)
+    x = raman_axis(n_points)
+    emission = gen_correction.photons_per_unit_wavenum_abs(
+        1e7 / laser_nm - x, 1.0, T_lamp)
+    emission = emission / np.amax(emission)
+
+    scale = 1.0 + drift * rng.standard_normal((n_frames, 1))
+    frames = emission * scale
+    frames *= 1.0 + noise * rng.standard_normal(frames.shape)
+    return x, frames
+
+
+def spectral_cube(n_spectra, n_points=1340, dtype=np.float64,
+                  filename=None, seed=0):
+    '''Synthetic spectra (rows) : a few Lorentzian bands on a sloping
+    baseline, with noise. With filename, the cube is written in chunks
+    to a .npy file and returned memory mapped.
+
+    returns => array (n_spectra, n_points) '''
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, 1.0, n_points)
+    bands = np.zeros(n_points)
+    for center, width, height in ((0.2, 0.005, 1.0), (0.45, 0.01, 0.5),
+                                  (0.7, 0.004, 2.0)):
+        bands += height / (1.0 + ((x - center) / width)**2)
+    template = (0.2 + 0.1 * x + bands).astype(dtype)
+
+    if filename is None:
+        cube = np.empty((n_spectra, n_points), dtype=dtype)
+    else:
+        cube = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                         shape=(n_spectra, n_points))
+    for i in range(0, n_spectra, chunk_rows):
+        n = min(chunk_rows, n_spectra - i)
+        noise = rng.standard_normal((n, n_points), dtype=np.float32)
+        np.multiply(noise, 0.01, out=noise)
+        noise += 1.0
+        np.multiply(template, noise, out=cube[i:i + n], casting='unsafe')
+    if filename is not None:
+        cube.flush()
+    return cube
+
+# ------------------------------------------------------
+#                  C1 OF EVERY FRAME
+# ------------------------------------------------------
+
+
+def _C1_rows(abs_wavenumber, C0, frames):
+    '''C1 of every frame as in gen_C1 : normalized frame corrected with C0,
+    fitted with the black-body emission (without the plot)'''
+
+    gen_correction = _import_gen_correction()
+    model = gen_correction.photons_per_unit_wavenum_abs
+    out = np.empty(frames.shape, dtype=np.float64)
+    for i in range(frames.shape[0]):
+        wl = frames[i] / np.amax(frames[i]) * C0
+        popt, pcov = curve_fit(model, abs_wavenumber, wl,
+                               p0=np.array([1e-18, 2799]),
+                               bounds=([1e-28, 1e-8], [900., 9000.]))
+        out[i] = wl / model(abs_wavenumber, *popt)
+    return out
+
+
+def _C1_rows_file(abs_wavenumber, C0, source, target, start, stop):
+    '''C1 of the frames start:stop of the .npy file source, written into
+    the .npy file target'''
+
+    frames = np.load(source, mmap_mode='r')
+    out = np.load(target, mmap_mode='r+')
+    out[start:stop] = _C1_rows(abs_wavenumber, C0, frames[start:stop])
+    out.flush()
+
+
+def _ranges(n, n_tasks):
+    edges = np.linspace(0, n, n_tasks + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def fit_C1_rows(Ramanshift, laser_nm, frames, norm_pnt, backend='single',
+                n_jobs=None, out=None):
+    '''C1 of every frame (row of frames), instead of the C1 of the mean
+    frame as in gen_C0_C1
+
+    backend = 'single', 'process' or 'memmap'. For 'memmap', frames is
+              the name of a .npy file (or a memory mapped array of
+              one), and out the name of the .npy file of the result
+
+    returns => array (n_frames, n_points), memory mapped for 'memmap' '''
+
+    gen_correction = _import_gen_correction()
+    abs_wavenumber = 1e7 / laser_nm - Ramanshift
+    C0 = gen_correction.gen_C0(Ramanshift, norm_pnt)
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    if backend == 'single':
+        return _C1_rows(abs_wavenumber, C0, np.asarray(frames))
+
+    if backend == 'process':
+        frames = np.asarray(frames)
+        tasks = _ranges(frames.shape[0], 4 * n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            parts = pool.map(_C1_rows, [abs_wavenumber] * len(tasks),
+                             [C0] * len(tasks),
+                             [frames[a:b] for a, b in tasks])
+            return np.concatenate(list(parts))
+
+    if backend == 'memmap':
+        source = getattr(frames, 'filename', frames)
+        shape = np.load(source, mmap_mode='r').shape
+        result = np.lib.format.open_memmap(out, mode='w+', dtype=np.float64,
+                                           shape=shape)
+        del result
+        tasks = _ranges(shape[0], 4 * n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            list(pool.map(_C1_rows_file, [abs_wavenumber] * len(tasks),
+                          [C0] * len(tasks), [source] * len(tasks),
+                          [out] * len(tasks), [t[0] for t in tasks],
+                          [t[1] for t in tasks]))
+        return np.load(out, mmap_mode='r')
+
+    raise ValueError('backend should be one of {0}'.format(backends))
+
+# ------------------------------------------------------
+#                  APPLICATION OF THE CORRECTION
+# ------------------------------------------------------
+
+
+def _apply_rows(rows, correction):
+    return rows * correction
+
+
+def _apply_file(source, target, correction, start, stop):
+    '''correct the rows start:stop of the .npy file source into the .npy
+    file target, chunk_rows at a time'''
+
+    cube = np.load(source, mmap_mode='r')
+    out = np.load(target, mmap_mode='r+')
+    for i in range(start, stop, chunk_rows):
+        j = min(i + chunk_rows, stop)
+        np.multiply(cube[i:j], correction, out=out[i:j], casting='unsafe')
+    out.flush()
+
+
+def apply_correction(cube, correction, backend='single', n_jobs=None,
+                     out=None):
+    '''Corrected spectra, cube * correction (correction applied to every
+    row, for example the output of live_correction.compose_correction)
+
+    backend = 'single' : in this process, into out (preallocated array)
+                         when given
+              'process': chunks of rows corrected by a pool of processes
+              'memmap' : cube is the name of a .npy file (or a memory
+                         mapped array of one) and out the name of the
+                         .npy file of the result, rows are corrected in
+                         the files by a pool of processes
+
+    returns => corrected array (memory mapped for 'memmap') '''
+
+    correction = np.asarray(correction)
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    if backend == 'single':
+        cube = np.asarray(cube)
+        if out is None:
+            out = np.empty(cube.shape, dtype=cube.dtype)
+        np.multiply(cube, correction, out=out, casting='unsafe')
+        return out
+
+    if backend == 'process':
+        cube = np.asarray(cube)
+        tasks = _ranges(cube.shape[0], 4 * n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            parts = pool.map(_apply_rows, [cube[a:b] for a, b in tasks],
+                             [correction] * len(tasks))
+            return np.concatenate(list(parts))
+
+    if backend == 'memmap':
+        source = getattr(cube, 'filename', cube)
+        head = np.load(source, mmap_mode='r')
+        result = np.lib.format.open_memmap(out, mode='w+', dtype=head.dtype,
+                                           shape=head.shape)
+        del result
+        tasks = _ranges(head.shape[0], n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            list(pool.map(_apply_file, [source] * len(tasks),
+                          [out] * len(tasks), [correction] * len(tasks),
+                          [t[0] for t in tasks], [t[1] for t in tasks]))
+        return np.load(out, mmap_mode='r')
+
+    raise ValueError('backend should be one of {0}'.format(backends))
+
+# ------------------------------------------------------
+#                  BENCHMARKS
+# ------------------------------------------------------
+
+
+def _max_rss():
+    '''maximum resident size (bytes) of this process and of its
+    children (processes of the pool)'''
+
+    if resource is None:
+        return None, None
+    # kilobytes on Linux, bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+
+def _bench_one(name, options):
+    '''run one benchmark in this process, returns its result'''
+
+    kind, backend = (name.split('/') + [''])[:2]
+    directory = options['directory']
+    laser_nm = 532.2
+    n_points = options['points']
+    norm_pnt = n_points // 2
+    dtype = np.dtype(options['dtype'])
+    n_jobs = options['n_jobs']
+    files = []
+
+    gen_correction = _import_gen_correction()
+    import matplotlib.pyplot as plt
+
+    # inputs ----------
+    if kind in ('gen_C0_C1', 'C1_rows'):
+        x, frames = lamp_frames(options['frames'], n_points)
+        n_spectra = frames.shape[0]
+        nbytes = frames.nbytes
+        if backend == 'memmap':
+            source = os.path.join(directory, 'frames.npy')
+            np.save(source, frames)
+            files.append(source)
+            frames = source
+    else:
+        x = raman_axis(n_points)
+        correction = np.linspace(0.8, 1.2, n_points)
+        n_spectra = options['spectra']
+        nbytes = n_spectra * n_points * dtype.itemsize
+        if backend == 'memmap':
+            source = os.path.join(directory, 'cube.npy')
+            spectral_cube(n_spectra, n_points, dtype, filename=source)
+            files.append(source)
+            cube = source
+        else:
+            cube = spectral_cube(n_spectra, n_points, dtype)
+            out = np.empty_like(cube)
+    target = os.path.join(directory, 'out.npy')
+    files.append(target)
+
+    if kind == 'gen_C0_C1':
+        def func():
+            # gen_C0_C1 takes the frames as columns, and plots the fit
+            gen_correction.gen_C0_C1(x, laser_nm, frames.T, norm_pnt)
+            plt.close('all')
+    elif kind == 'C1_rows':
+        def func():
+            fit_C1_rows(x, laser_nm, frames, norm_pnt, backend, n_jobs,
+                        out=target)
+    elif kind == 'apply':
+        def func():
+            apply_correction(cube, correction, backend, n_jobs,
+                             out=target if backend == 'memmap' else
+                             (out if backend == 'single' else None))
+    else:
+        raise ValueError('Unknown benchmark {0}'.format(name))
+
+    # the timed runs are not traced (tracemalloc slows down the numpy
+    # allocations and the python code), the peak memory is that of one
+    # more traced run
+    try:
+        with open(os.devnull, 'w') as null, \
+                contextlib.redirect_stdout(null):
+            result = benchmark_utils.measure(func, repeat=options['repeat'],
+                                             min_time=0.0)
+            tracemalloc.start()
+            try:
+                func()
+                traced = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    finally:
+        for f in files:
+            if os.path.exists(f):
+                os.remove(f)
+
+    rss_self, rss_children = _max_rss()
+    result.update({'backend': backend or 'single',
+                   'n_spectra': n_spectra, 'n_points': n_points,
+                   'bytes': nbytes,
+                   'spectra_per_s': n_spectra / result['min'],
+                   'MB_per_s': nbytes / 1e6 / result['min'],
+                   'peak_memory': traced,
+                   'max_rss': rss_self, 'max_rss_pool': rss_children,
+                   'n_jobs': n_jobs if backend in ('process', 'memmap')
+                   else 1})
+    return result
+
+
+def run(kinds=('gen_C0_C1', 'C1_rows', 'apply'), backends_run=backends,
+        points=1340, frames=32, spectra=20000, dtype='float64', n_jobs=None,
+        repeat=3, directory=None, verbose=True):
+    '''Run the benchmarks, each in its own process
+
+    kinds     = benchmarks : 'gen_C0_C1', 'C1_rows', 'apply'
+    points    = points per spectrum
+    frames    = number of lamp frames (gen_C0_C1 and C1_rows)
+    spectra   = number of spectra (apply)
+    n_jobs    = processes of the pool (default : number of CPUs)
+    directory = directory of the memory mapped files (default : temp)
+
+    returns => (dict of name -> result (see benchmark_utils.measure, with
+               spectra_per_s, MB_per_s, peak_memory, max_rss, ...), list
+               of the benchmarks whose process failed) '''
+
+    names = []
+    for kind in kinds:
+        if kind == 'gen_C0_C1':
+            names.append('gen_C0_C1/single')
+        else:
+            names.extend('{0}/{1}'.format(kind, b) for b in backends_run)
+
+    results = {}
+    failed = []
+    env = dict(os.environ, MPLBACKEND='Agg')
+    with tempfile.TemporaryDirectory(prefix='benchmark_C0_C1_',
+                                     dir=directory) as work:
+        options = {'points': points, 'frames': frames, 'spectra': spectra,
+                   'dtype': dtype, 'n_jobs': n_jobs or os.cpu_count() or 1,
+                   'repeat': repeat, 'directory': work}
+        for name in names:
+            if verbose:
+                print('  {0} ...'.format(name), flush=True)
+            output = os.path.join(work, 'result.json')
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                   '_worker', name, json.dumps(options),
+                                   output], env=env)
+            if proc.returncode != 0:
+                print('  {0} failed (exit code {1})'.format(
+                    name, proc.returncode), file=sys.stderr)
+                failed.append(name)
+                continue
+            with open(output) as f:
+                results[name] = json.load(f)
+            os.remove(output)
+    return results, failed
+
+
+def results_table(results):
+    '''Results as text table'''
+
+    lines = ['{0:<22s} {1:>10s} {2:>12s} {3:>10s} {4:>11s} {5:>11s}'.format(
+        'benchmark', 'time(s)', 'spectra/s', 'MB/s', 'peak(MB)', 'rss(MB)')]
+    for name in sorted(results):
+        r = results[name]
+        rss = max(r['max_rss'] or 0, r['max_rss_pool'] or 0)
+        lines.append('{0:<22s} {1:>10.4f} {2:>12.1f} {3:>10.2f} {4:>11.1f} '
+                     '{5:>11.1f}'.format(name, r['min'], r['spectra_per_s'],
+                                         r['MB_per_s'],
+                                         r['peak_memory'] / 1e6, rss / 1e6))
+    return '\n'.join(lines)
+
+# ------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Throughput benchmarks of C0/C1 and of the correction')
+    sub = parser.add_subparsers(dest='command')
+
+    p_run = sub.add_parser('run', help='run the benchmarks, save baseline')
+    p_run.add_argument('--kinds', nargs='+',
+                       choices=('gen_C0_C1', 'C1_rows', 'apply'),
+                       default=('gen_C0_C1', 'C1_rows', 'apply'))
+    p_run.add_argument('--backends', nargs='+', choices=backends,
+                       default=backends)
+    p_run.add_argument('--points', type=int, default=1340)
+    p_run.add_argument('--frames', type=int, default=32)
+    p_run.add_argument('--spectra', type=int, default=20000)
+    p_run.add_argument('--dtype', choices=('float32', 'float64'),
+                       default='float64')
+    p_run.add_argument('--n-jobs', type=int)
+    p_run.add_argument('--repeat', type=int, default=3)
+    p_run.add_argument('--directory', help='directory of the memory mapped '
+                       'files (default : temporary directory)')
+    p_run.add_argument('--version', help='default : git describe')
+    p_run.add_argument('-o', '--output', help='default : '
+                       'benchmarks/C0_C1_<version>.json')
+    p_run.add_argument('--compare', metavar='BASELINE',
+                       help='compare with this baseline after the run')
+    p_run.add_argument('--threshold', type=float, default=0.1)
+
+    p_cmp = sub.add_parser('compare', help='compare two baselines')
+    p_cmp.add_argument('baseline')
+    p_cmp.add_argument('new')
+    p_cmp.add_argument('--threshold', type=float, default=0.1)
+
+    p_wrk = sub.add_parser('_worker')
+    p_wrk.add_argument('name')
+    p_wrk.add_argument('options')
+    p_wrk.add_argument('output')
+
+    args = parser.parse_args(argv)
+
+    if args.command == '_worker':
+        result = _bench_one(args.name, json.loads(args.options))
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    if args.command == 'compare':
+        return benchmark_utils.main_compare(args.baseline, args.new,
+                                            args.threshold)
+
+    if args.command == 'run':
+        results, failed = run(args.kinds, args.backends, args.points,
+                              args.frames, args.spectra, args.dtype,
+                              args.n_jobs, args.repeat, args.directory)
+        print()
+        print(results_table(results))
+        filename = benchmark_utils.save_baseline(
+            results, args.output, args.version, suite='C0_C1')
+        print('\nsaved as {0}'.format(filename))
+        status = 0
+        if args.compare:
+            print()
+            status = benchmark_utils.main_compare(args.compare, filename,
+                                                  args.threshold)
+        if failed:
+            print('\nfailed : {0}'.format(', '.join(failed)),
+                  file=sys.stderr)
+            status = 1
+        return status
+
+    parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the C2 fitting engines (determine_C2).
+
+For every scheme, the partition functions, the computed spectra, the
+residual of every degree and the complete run_fit_* of every degree are
+timed. The inputs are the band areas of the example directories (for
+the pure rotation, where the example has only D2 and O2, band areas of
+H2, HD and D2 are generated from the computed spectra). The scaling
+runs time the residual on synthetic bands, over the number of bands
+(kernel of the genC2 modules) and over the species and J range
+(batched residual of CalibrationProblem).
+
+Every scheme is run in its own process, in a temporary directory (the
+genC2 modules load their inputs from, and write their outputs to, the
+working directory at import). The results are saved as a versioned
+JSON baseline (see benchmark_utils), and two baselines are compared
+with the compare command.
+
+    python benchmark_C2.py run                    # all, save baseline
+    python benchmark_C2.py run --quick --schemes VR_para PR
+    python benchmark_C2.py compare benchmarks/C2_v1.json benchmarks/C2_v2.json
+    python benchmark_C2.py list """
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import importlib
+import contextlib
+import subprocess
+import numpy as np
+
+import benchmark_utils
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# run(schemes=None, quick=False, fits=True, scaling=True, ...)
+#    Run the benchmarks, returns dict of name -> timing and the list of
+#    the schemes that failed
+
+# (command line : run, compare and list, see above or --help)
+
+# ------------------------------------------------------
+
+_root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'determine_C2')
+
+_VR_dep = 'vibration_rotation_H2_HD_D2/T_dependent_analysis'
+_VR_TF = 'vibration_rotation_H2_HD_D2/T_independent_analysis'
+_PR_dep = 'rotationalRaman_H2_HD_D2/t_dependent'
+_PR_TF = 'rotationalRaman_H2_HD_D2/t_independent'
+_liq_aS = 'vibrationalRaman_liquids/antiStokes_Stokes_ratios'
+_liq_rel = 'vibrationalRaman_liquids/Using_relative_intensities'
+
+_files_para = {'BA_H2_1': 'example/BA_H2_1', 'BA_HD_1': 'example/BA_HD_1',
+               'BA_D2_1': 'example/BA_D2_1',
+               'Ramanshift_axis': 'example/Ramanshift_axis'}
+_files_perp = {'BA_H2_perp': 'example/BA_H2_perp',
+               'BA_HD_perp': 'example/BA_HD_perp',
+               'BA_D2_perp': 'example/BA_D2_perp',
+               'Ramanshift_axis': 'example/Ramanshift_axis'}
+_files_PR = {'DataO2_o1s1.txt': _PR_dep + '/Example/sample_O2_O1S1',
+             'DataO2_pR.txt': _PR_dep + '/Example/sample_O2_PR'}
+_liquids = ('CCl4', 'C6H6', 'C6H12')
+_files_liq_aS = dict({'model_' + m: 'example/BA_{0}.dat'.format(m)
+                      for m in _liquids},
+                     **{'Wavenumber_axis.dat': 'example/Wavenumber_axis.dat'})
+# the example of the relative intensities has no x-axis, that of the
+#  anti-Stokes/Stokes example is used
+_files_liq_rel = dict(
+    {'expt_bandarea_data/BA_{0}.txt'.format(m): 'example/BA_{0}.exp'.format(m)
+     for m in _liquids},
+    **{'reference_data/BA_ref_{0}.dat'.format(m):
+       'reference_data/BA_ref_{0}.dat'.format(m) for m in _liquids},
+    **{'expt_bandarea_data/Wavenumber_axis_pa.txt':
+       _liq_aS + '/example/Wavenumber_axis.dat'})
+
+# J range of the synthetic band areas for the pure rotation, as
+#  (aSJmax, SJmax) in genC2_PR_T_dep and genC2_PR_T_fixed
+_J_PR = {'H2': (5, 5), 'HD': (5, 5), 'D2': (7, 7)}
+
+_degrees = ('linear', 'quadratic', 'cubic', 'quartic', 'quintuple')
+
+# schemes :
+#   directory  = relative to determine_C2
+#   module     = genC2 module
+#   kind       = 'VR' (compute_series_para/perp), 'PR' (compute_spectra)
+#                or 'liquid' (band areas of liquids, no computed spectra)
+#   files      = inputs copied to the working directory, name : source
+#                (source relative to the directory of the scheme, or to
+#                determine_C2 when it starts with the name of a scheme
+#                directory)
+#   synthetic  = band areas generated from the computed spectra (PR)
+#   paired     = only the bands observed on both the anti-Stokes and the
+#                Stokes side are kept (gen_diff of genC2_antiStokes_Stokes
+#                requires pairs)
+#   degrees    = degrees of the run_fit_* functions
+#   suffix     = suffix of residual_* and run_fit_* ('_TF')
+#   init       = initial parameters, full vector of the highest degree
+#                (truncated for lower degrees), or None to use the
+#                param_<degree> of the module
+schemes = {
+    'VR_para': {'directory': _VR_dep, 'module': 'genC2_VR_T_dep_para',
+                'kind': 'VR', 'polarization': 'para', 'files': _files_para,
+                'degrees': _degrees, 'suffix': '', 'init': None},
+    'VR_perp': {'directory': _VR_dep, 'module': 'genC2_VR_T_dep_perp',
+                'kind': 'VR', 'polarization': 'perp', 'files': _files_perp,
+                'degrees': _degrees, 'suffix': '', 'init': None},
+    'VR_TF_para': {'directory': _VR_TF, 'module': 'genC2_VR_TF_parallel',
+                   'kind': 'VR', 'polarization': 'para',
+                   'files': _files_para, 'degrees': _degrees[:4],
+                   'suffix': '_TF', 'init': (-0.045, 0.0, 0.0, 0.0)},
+    'VR_TF_perp': {'directory': _VR_TF, 'module': 'genC2_VR_TF_perp',
+                   'kind': 'VR', 'polarization': 'perp',
+                   'files': _files_perp, 'degrees': _degrees[:4],
+                   'suffix': '_TF', 'init': (-0.045, 0.0, 0.0, 0.0)},
+    'PR': {'directory': _PR_dep, 'module': 'genC2_PR_T_dep', 'kind': 'PR',
+           'files': _files_PR, 'synthetic': True, 'degrees': _degrees[:3],
+           'suffix': '', 'init': (299.0, 0.1, 0.0, 0.0)},
+    'PR_TF': {'directory': _PR_TF, 'module': 'genC2_PR_T_fixed',
+              'kind': 'PR', 'files': _files_PR, 'synthetic': True,
+              'degrees': _degrees[:3], 'suffix': '_TF',
+              'init': (0.1, 0.0, 0.0)},
+    'liquid_aS_S': {'directory': _liq_aS, 'module': 'genC2_antiStokes_Stokes',
+                    'kind': 'liquid', 'files': _files_liq_aS,
+                    'paired': True, 'degrees': _degrees[:4], 'suffix': '',
+                    'init': None},
+    'liquid_rel': {'directory': _liq_rel, 'module': 'genC2_vib_intensities',
+                   'kind': 'liquid', 'files': _files_liq_rel,
+                   'degrees': _degrees[:4], 'suffix': '', 'init': None},
+}
+
+# synthetic scaling runs
+scaling_bands = (8, 16, 32, 64, 128, 256)
+scaling_species = (('D2',), ('D2', 'HD'), ('D2', 'HD', 'H2'))
+scaling_J = {'small': {'H2': (2, 2), 'HD': (2, 2, 1), 'D2': (2, 2, 1)},
+             'default': {'H2': (3, 4), 'HD': (3, 3, 2), 'D2': (4, 6, 3)},
+             'large': {'H2': (5, 6), 'HD': (4, 6, 3), 'D2': (4, 6, 3)}}
+scaling_batch = 64
+
+T_bench = 299.0
+
+# ------------------------------------------------------
+
+
+def _link_data(directory, work):
+    '''energy levels and matrix elements, loaded by the modules from
+    the working directory'''
+
+    for name in os.listdir(directory):
+        src = os.path.join(directory, name)
+        if not (os.path.isdir(src) and name.startswith('energy_levels')):
+            continue
+        try:
+            os.symlink(src, os.path.join(work, name))
+        except OSError:
+            shutil.copytree(src, os.path.join(work, name))
+
+
+def _synthetic_PR(work):
+    '''band areas ( area | error ) of H2, HD and D2 at T_bench, with a
+    linear sensitivity and 1 % noise, and the x-axis'''
+
+    import compute_spectra
+
+    rng = np.random.default_rng(0)
+    spectra = {'H2': compute_spectra.spectra_H2,
+               'HD': compute_spectra.spectra_HD,
+               'D2': compute_spectra.spectra_D2}
+    for name, func in spectra.items():
+        s = func(T_bench, *_J_PR[name])
+        area = s[:, 2] * (1.0 + 0.1 * s[:, 1] / 1e4)
+        area = area * (1.0 + 0.01 * rng.standard_normal(area.shape[0]))
+        np.savetxt(os.path.join(work, 'BA_{0}_1.txt'.format(name)),
+                   np.column_stack((area, 0.01 * area)))
+    np.savetxt(os.path.join(work, 'Wavenumber_axis_pa.txt'),
+               np.linspace(-1200, 1200, 500))
+
+
+def _paired_liquids(work):
+    '''keep the bands of the liquids observed on both sides, anti-Stokes
+    bands first (the examples also have unpaired Stokes bands)'''
+
+    for m in _liquids:
+        filename = os.path.join(work, 'model_' + m)
+        data = np.loadtxt(filename)
+        pos = np.abs(data[:, 0])
+        paired = np.array([np.any(np.isclose(pos[i], pos[data[:, 0] < 0]))
+                           and np.any(np.isclose(pos[i], pos[data[:, 0] > 0]))
+                           for i in range(data.shape[0])])
+        data = data[paired]
+        np.savetxt(filename, data[np.lexsort((pos[paired],
+                                              data[:, 0] > 0))])
+
+
+def _prepare(spec, work):
+    directory = os.path.join(_root, spec['directory'])
+    _link_data(directory, work)
+    for name, src in spec['files'].items():
+        if os.path.exists(os.path.join(directory, src)):
+            src = os.path.join(directory, src)
+        else:
+            src = os.path.join(_root, src)
+        target = os.path.join(work, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy(src, target)
+
+# ------------------------------------------------------
+
+
+def _init(spec, module, degree):
+    '''initial parameters of the fit and residual of degree (index)'''
+
+    if spec['init'] is None:
+        return np.array(getattr(module, 'param_' + spec['degrees'][degree]),
+                        dtype=np.float64)
+    n = degree + 2 if spec['suffix'] == '' else degree + 1
+    return np.array(spec['init'][:n], dtype=np.float64)
+
+
+def _bench_spectra(name, spec, module, options, results):
+    '''partition functions and computed spectra of H2, HD and D2'''
+
+    measure = options['measure']
+    import boltzmann_popln as bp
+    species = ('H2', 'HD', 'D2')
+
+    # partition functions
+    for sp in species:
+        func = getattr(bp, 'sumofstate_' + sp)
+        results['{0}/partition/{1}'.format(name, sp)] = \
+            benchmark_utils.measure(lambda: func(T_bench), **measure)
+
+    # computed spectra, as in the residual functions
+    if spec['kind'] == 'VR':
+        series = getattr(module, 'compute_series_' + spec['polarization'])
+        calls = {'H2': lambda: series.spectra_H2_c(
+                     T_bench, module.OJ_H2, module.QJ_H2, 1.0),
+                 'HD': lambda: series.spectra_HD(
+                     T_bench, module.OJ_HD, module.QJ_HD, module.SJ_HD, 1.0),
+                 'D2': lambda: series.spectra_D2(
+                     T_bench, module.OJ_D2, module.QJ_D2, module.SJ_D2, 1.0)}
+    else:
+        cs = module.compute_spectra
+        calls = {sp: (lambda f, J: lambda: f(T_bench, *J))(
+                     getattr(cs, 'spectra_' + sp),
+                     (getattr(module, sp + '_aSJmax'),
+                      getattr(module, sp + '_SJmax')))
+                 for sp in species}
+    for sp in species:
+        results['{0}/spectra/{1}'.format(name, sp)] = \
+            benchmark_utils.measure(calls[sp], **measure)
+
+
+def _bench_scheme(name, spec, module, options):
+    measure = options['measure']
+    results = {}
+
+    # the liquids have no computed spectra (known relative intensities)
+    if spec['kind'] != 'liquid':
+        _bench_spectra(name, spec, module, options, results)
+
+    # residual and fit of every degree
+    for i, degree in enumerate(spec['degrees']):
+        if options['degrees'] and degree not in options['degrees']:
+            continue
+        param = _init(spec, module, i)
+        residual = getattr(module, 'residual_' + degree + spec['suffix'])
+        results['{0}/residual/{1}'.format(name, degree)] = \
+            benchmark_utils.measure(lambda: residual(param), **measure)
+
+        if not options['fits']:
+            continue
+        if options['fit_degrees'] and degree not in options['fit_degrees']:
+            continue
+        run_fit = getattr(module, 'run_fit_' + degree + spec['suffix'])
+        timing, fun = benchmark_utils.single(lambda: run_fit(*param))
+        res = getattr(module, 'fit_results', {}).get(degree)
+        if res is not None:
+            timing['nfev'] = int(res.nfev)
+            timing['nit'] = int(res.nit)
+        if fun is not None:
+            timing['fun'] = float(fun)
+        results['{0}/fit/{1}'.format(name, degree)] = timing
+
+    return results
+
+# ------------------------------------------------------
+
+
+def _bench_scaling(options):
+    '''residual on synthetic bands, in the directory of genC2_VR_T_dep_para
+    (kernel of the module over the number of bands, CalibrationProblem
+    over the species and J range)'''
+
+    measure = options['measure']
+    results = {}
+    module = importlib.import_module('genC2_VR_T_dep_para')
+    import calibration_problem
+
+    # kernel of the residual for one species, as in residual_cubic
+    param = np.array(module.param_cubic, dtype=np.float64)
+    rng = np.random.default_rng(0)
+    for n in options['bands']:
+        computed = np.column_stack((np.arange(n, dtype=np.float64),
+                                    np.linspace(2700.0, 4200.0, n),
+                                    rng.uniform(0.1, 1.0, n)))
+        expt = np.column_stack((computed[:, 2]
+                                * rng.uniform(0.9, 1.1, n),
+                                0.01 * computed[:, 2]))
+
+        def kernel():
+            I = np.divide(module.gen_intensity_mat(expt, 0),
+                          module.gen_intensity_mat(computed, 2))
+            e = module.clean_mat(I) - module.gen_s_cubic(computed, param)
+            return np.sqrt(np.sum(np.square(module.clean_mat(e))))
+
+        results['scaling/bands/{0}'.format(n)] = \
+            benchmark_utils.measure(kernel, **measure)
+
+    # batched residual over the species and J range
+    for level, J in scaling_J.items():
+        for species in scaling_species:
+            data = {sp: calibration_problem.computed_spectra(
+                        sp, T_bench, J[sp])[:, 2] for sp in species}
+            problem = calibration_problem.CalibrationProblem(
+                data, 3, J=J, species=species)
+            n_bands = sum(problem.positions[sp].shape[0] for sp in species)
+            batch = np.tile(param, (scaling_batch, 1))
+            key = 'scaling/species/{0}/J_{1}'.format('_'.join(species), level)
+            single = benchmark_utils.measure(lambda: problem.residual(param),
+                                             **measure)
+            single['bands'] = n_bands
+            results[key] = single
+            batched = benchmark_utils.measure(lambda: problem.residual(batch),
+                                              **measure)
+            batched['bands'] = n_bands
+            batched['batch'] = scaling_batch
+            results[key + '/batch_{0}'.format(scaling_batch)] = batched
+    return results
+
+# ------------------------------------------------------
+
+
+def _worker(name, options, output):
+    '''run the benchmarks of one scheme (or 'scaling') in this process'''
+
+    spec = schemes['VR_para'] if name == 'scaling' else schemes[name]
+    directory = os.path.join(_root, spec['directory'])
+    sys.path.insert(0, directory)
+    cwd = os.getcwd()
+    work = tempfile.mkdtemp(prefix='benchmark_C2_')
+    try:
+        _prepare(spec, work)
+        os.chdir(work)
+        if spec.get('synthetic'):
+            _synthetic_PR(work)
+        if spec.get('paired'):
+            _paired_liquids(work)
+        # the modules print a lot on import and during the fits
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            if name == 'scaling':
+                results = _bench_scaling(options)
+            else:
+                module = importlib.import_module(spec['module'])
+                results = _bench_scheme(name, spec, module, options)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump(results, f)
+
+# ------------------------------------------------------
+
+
+def run(schemes_run=None, quick=False, fits=True, scaling=True,
+        degrees=None, repeat=None, min_time=None, verbose=True):
+    '''Run the benchmarks, every scheme in its own process
+
+    schemes_run = names of the schemes (default : all, see schemes)
+    quick       = fewer repeats, fits of linear and quadratic only and
+                  fewer sizes in the scaling runs
+    fits        = include the complete run_fit_* (the longest part)
+    scaling     = include the synthetic scaling runs
+    degrees     = only these degrees ('linear', 'cubic', ...)
+
+    returns => (dict of name -> timing (see benchmark_utils.measure),
+               list of the schemes whose process failed) '''
+
+    names = list(schemes_run or schemes)
+    if scaling:
+        names.append('scaling')
+    options = {'measure': {'repeat': repeat or (3 if quick else 7),
+                           'min_time': min_time or (0.02 if quick else 0.1)},
+               'fits': fits,
+               'degrees': list(degrees or []),
+               'fit_degrees': ['linear', 'quadratic'] if quick else [],
+               'bands': list(scaling_bands[:4] if quick else scaling_bands)}
+
+    env = dict(os.environ, MPLBACKEND='Agg')
+    env.pop('C2_TIMINGS', None)
+    results = {}
+    failed = []
+    for name in names:
+        if name != 'scaling' and name not in schemes:
+            raise ValueError('Unknown scheme {0}, available : {1}'.format(
+                name, ', '.join(schemes)))
+        if verbose:
+            print('  {0} ...'.format(name), flush=True)
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                   '_worker', name, json.dumps(options),
+                                   output], env=env)
+            if proc.returncode != 0:
+                print('  {0} failed (exit code {1})'.format(
+                    name, proc.returncode), file=sys.stderr)
+                failed.append(name)
+                continue
+            with open(output) as f:
+                results.update(json.load(f))
+        finally:
+            os.remove(output)
+    return results, failed
+
+# ------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the C2 fitting engines')
+    sub = parser.add_subparsers(dest='command')
+
+    p_run = sub.add_parser('run', help='run the benchmarks, save baseline')
+    p_run.add_argument('--schemes', nargs='+', choices=sorted(schemes))
+    p_run.add_argument('--degrees', nargs='+', choices=_degrees)
+    p_run.add_argument('--quick', action='store_true')
+    p_run.add_argument('--no-fits', action='store_true')
+    p_run.add_argument('--no-scaling', action='store_true')
+    p_run.add_argument('--repeat', type=int)
+    p_run.add_argument('--min-time', type=float)
+    p_run.add_argument('--version', help='default : git describe')
+    p_run.add_argument('-o', '--output', help='default : '
+                       'benchmarks/C2_<version>.json')
+    p_run.add_argument('--compare', metavar='BASELINE',
+                       help='compare with this baseline after the run')
+    p_run.add_argument('--threshold', type=float, default=0.1)
+
+    p_cmp = sub.add_parser('compare', help='compare two baselines')
+    p_cmp.add_argument('baseline')
+    p_cmp.add_argument('new')
+    p_cmp.add_argument('--threshold', type=float, default=0.1,
+                       help='relative change reported (default 0.1)')
+
+    sub.add_parser('list', help='list the schemes')
+
+    p_wrk = sub.add_parser('_worker')
+    p_wrk.add_argument('name')
+    p_wrk.add_argument('options')
+    p_wrk.add_argument('output')
+
+    args = parser.parse_args(argv)
+
+    if args.command == '_worker':
+        _worker(args.name, json.loads(args.options), args.output)
+        return 0
+
+    if args.command == 'list':
+        for name, spec in schemes.items():
+            print('{0:<12s} {1}/{2}.py  ({3})'.format(
+                name, spec['directory'], spec['module'],
+                ', '.join(spec['degrees'])))
+        print('{0:<12s} synthetic bands and species'.format('scaling'))
+        return 0
+
+    if args.command == 'compare':
+        return benchmark_utils.main_compare(args.baseline, args.new,
+                                            args.threshold)
+
+    if args.command == 'run':
+        results, failed = run(args.schemes, args.quick, not args.no_fits,
+                              not args.no_scaling, args.degrees, args.repeat,
+                              args.min_time)
+        print()
+        print(benchmark_utils.results_table(results))
+        filename = benchmark_utils.save_baseline(
+            results, args.output, args.version, suite='C2')
+        print('\nsaved as {0}'.format(filename))
+        status = 0
+        if args.compare:
+            print()
+            status = benchmark_utils.main_compare(args.compare, filename,
+                                                  args.threshold)
+        if failed:
+            print('\nfailed : {0}'.format(', '.join(failed)),
+                  file=sys.stderr)
+            status = 1
+        return status
+
+    parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module with the common parts of the benchmarks (benchmark_C2 and
+benchmark_C0_C1) : timing of a function, the description of the
+machine, and the JSON baselines with their comparison.
+
+A baseline is a JSON file holding the version it was obtained with
+(by default, the output of git describe), the machine and the versions
+of python, numpy and scipy, and one entry per benchmark with the time
+per call (min, median, mean, stdev in seconds). Two baselines are
+compared using the minimum time of the benchmarks present in both (the
+least affected by other processes)."""
+
+import os
+import sys
+import json
+import timeit
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# measure(func, repeat=5, min_time=0.1)
+#    Time per call of func() : dict with number, repeat, min, median,
+#    mean, stdev (seconds)
+
+# save_baseline(results, filename=None, version=None, directory=...)
+#    Write the results as a versioned JSON baseline
+
+# compare(baseline, new, threshold=0.1)
+#    Ratio of the minimum times, with the regressions and speedups
+
+# compare_table(rows)
+#    Comparison as text table
+
+# ------------------------------------------------------
+
+# version of the layout of the JSON file
+baseline_format = 1
+
+# default directory of the baselines
+baseline_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'benchmarks')
+
+# ------------------------------------------------------
+
+
+def measure(func, repeat=5, min_time=0.1):
+    '''Time per call of func(). The number of calls per sample is
+    doubled until a sample takes at least min_time seconds.
+
+    returns => dict of number (calls per sample), repeat, min, median,
+               mean and stdev of the time per call (seconds) '''
+
+    timer = timeit.default_timer
+    number = 1
+    while True:
+        start = timer()
+        for _ in range(number):
+            func()
+        elapsed = timer() - start
+        if elapsed >= min_time or number >= 2**20:
+            break
+        # aim for min_time in the next sample
+        number = max(2 * number,
+                     int(number * min_time / max(elapsed, 1e-9)) + 1)
+
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = timer()
+        for _ in range(number):
+            func()
+        samples.append((timer() - start) / number)
+    samples = np.array(samples)
+
+    return {'number': number, 'repeat': repeat,
+            'min': float(np.amin(samples)),
+            'median': float(np.median(samples)),
+            'mean': float(np.mean(samples)),
+            'stdev': float(np.std(samples))}
+
+# ------------------------------------------------------
+
+
+def single(func):
+    '''Time of a single call of func() (for example, a complete fit)
+
+    returns => (dict as for measure, output of func) '''
+
+    start = timeit.default_timer()
+    out = func()
+    elapsed = timeit.default_timer() - start
+    return ({'number': 1, 'repeat': 1, 'min': elapsed, 'median': elapsed,
+             'mean': elapsed, 'stdev': 0.0}, out)
+
+# ------------------------------------------------------
+
+
+def git_version():
+    '''Version of the working tree (git describe), or 'unversioned' '''
+
+    try:
+        out = subprocess.run(['git', 'describe', '--always', '--dirty'],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             universal_newlines=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return 'unversioned'
+    return out.stdout.strip() or 'unversioned'
+
+
+def machine():
+    '''Description of the machine and of the versions of the packages'''
+
+    import scipy
+    return {'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__}
+
+# ------------------------------------------------------
+
+
+def save_baseline(results, filename=None, version=None, directory=None,
+                  suite=''):
+    '''Write the results (dict of name -> dict from measure) as JSON
+
+    filename  = default : <directory>/<suite>_<version>.json
+    version   = default : git_version()
+    directory = default : baseline_dir
+
+    returns => filename '''
+
+    version = version or git_version()
+    if filename is None:
+        directory = directory or baseline_dir
+        os.makedirs(directory, exist_ok=True)
+        name = '{0}_{1}.json'.format(suite, version) if suite else \
+            '{0}.json'.format(version)
+        filename = os.path.join(directory, name)
+
+    out = {'format': baseline_format,
+           'suite': suite,
+           'version': version,
+           'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+           'argv': sys.argv,
+           'machine': machine(),
+           'results': results}
+
+    # replace the file atomically
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(out, f, indent=1, sort_keys=True)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return filename
+
+
+def load_baseline(filename):
+    '''Read a baseline written by save_baseline'''
+
+    with open(filename) as f:
+        out = json.load(f)
+    if out.get('format') != baseline_format:
+        raise ValueError('{0} : format {1} of baseline is not supported'
+                         .format(filename, out.get('format')))
+    return out
+
+# ------------------------------------------------------
+
+
+def compare(baseline, new, threshold=0.1, key='min'):
+    '''Compare the benchmarks present in both baselines (dicts from
+    load_baseline). A benchmark is a regression when new/baseline time
+    is above 1 + threshold, and a speedup when below 1 - threshold.
+
+    returns => list of dict with name, baseline, new (seconds), ratio and
+               status ('regression', 'speedup' or 'same'), and the names
+               present in only one of the baselines '''
+
+    old_res = baseline['results']
+    new_res = new['results']
+    rows = []
+    for name in sorted(set(old_res) & set(new_res)):
+        t_old = old_res[name][key]
+        t_new = new_res[name][key]
+        ratio = t_new / t_old if t_old > 0 else float('inf')
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'speedup'
+        else:
+            status = 'same'
+        rows.append({'name': name, 'baseline': t_old, 'new': t_new,
+                     'ratio': ratio, 'status': status})
+    only_old = sorted(set(old_res) - set(new_res))
+    only_new = sorted(set(new_res) - set(old_res))
+    return rows, only_old, only_new
+
+
+def compare_table(rows):
+    '''Comparison (rows from compare) as text table'''
+
+    lines = ['{0:<52s} {1:>12s} {2:>12s} {3:>7s}  {4}'.format(
+        'benchmark', 'baseline(ms)', 'new(ms)', 'ratio', 'status')]
+    for row in rows:
+        lines.append('{0:<52s} {1:>12.4f} {2:>12.4f} {3:>7.3f}  {4}'.format(
+            row['name'], 1e3 * row['baseline'], 1e3 * row['new'],
+            row['ratio'], '' if row['status'] == 'same' else row['status']))
+    return '\n'.join(lines)
+
+
+def results_table(results):
+    '''Results (dict of name -> dict from measure) as text table'''
+
+    lines = ['{0:<52s} {1:>10s} {2:>11s} {3:>10s} {4:>9s}'.format(
+        'benchmark', 'min(ms)', 'median(ms)', 'stdev(ms)', 'calls')]
+    for name in sorted(results):
+        r = results[name]
+        lines.append('{0:<52s} {1:>10.4f} {2:>11.4f} {3:>10.4f} {4:>9d}'
+                     .format(name, 1e3 * r['min'], 1e3 * r['median'],
+                             1e3 * r['stdev'], r['number'] * r['repeat']))
+    return '\n'.join(lines)
+
+# ------------------------------------------------------
+
+
+def main_compare(baseline_file, new_file, threshold=0.1):
+    '''Print the comparison of two baseline files
+
+    returns => 1 when a benchmark has a regression or is missing from
+               the new baseline, otherwise 0 '''
+
+    baseline = load_baseline(baseline_file)
+    new = load_baseline(new_file)
+    rows, only_old, only_new = compare(baseline, new, threshold)
+
+    print('baseline : {0} ({1}, {2})'.format(
+        baseline_file, baseline['version'], baseline['created']))
+    print('new      : {0} ({1}, {2})'.format(
+        new_file, new['version'], new['created']))
+    for k in ('platform', 'processor', 'cpu_count', 'numpy', 'scipy'):
+        if baseline['machine'].get(k) != new['machine'].get(k):
+            print('  warning : {0} differs, {1} and {2}'.format(
+                k, baseline['machine'].get(k), new['machine'].get(k)))
+    print()
+    print(compare_table(rows))
+    for label, names in (('baseline', only_old), ('new', only_new)):
+        if names:
+            print('\n{0} benchmarks only in {1} : {2}{3}'.format(
+                len(names), label, ', '.join(names[:10]),
+                ', ...' if len(names) > 10 else ''))
+
+    n_reg = sum(row['status'] == 'regression' for row in rows)
+    n_fast = sum(row['status'] == 'speedup' for row in rows)
+    print('\n{0} regressions, {1} speedups (threshold {2:.0%})'.format(
+        n_reg, n_fast, threshold))
+    if only_old:
+        print('{0} benchmarks of the baseline are missing'.format(
+            len(only_old)))
+    return 1 if n_reg or only_old else 0
+
+# ------------------------------------------------------
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module implementing a local calibration store (SQLite database).
+
+Every C0/C1/C2 result is recorded with its coefs, temperature, residual,
+fingerprint of the inputs and the tags for instrument, grating, laser
+wavelength and date. The compact correction model (see
+correction_model.py) is kept along with the record. Indexed queries
+give the latest valid calibration for a configuration and the
+calibrations within a time range."""
+
+import json
+import sqlite3
+from datetime import datetime, timezone
+from datetime import date as date_type
+import numpy as np
+
+from correction_model import CorrectionModel
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# CalibrationStore(filename='calibrations.sqlite')
+#    add(kind, instrument, ...)              : record a result, returns id
+#    latest(instrument, grating, laser_nm, kind='C2')
+#                                            : latest valid calibration
+#    scan(start, end, instrument=None, ...)  : records within time range
+#    find(fingerprint)                       : records with same inputs
+#    invalidate(record_id)
+#    load_model(record)                      : CorrectionModel of record
+
+# ------------------------------------------------------
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS calibration (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind        TEXT NOT NULL,
+    instrument  TEXT NOT NULL,
+    grating     TEXT NOT NULL DEFAULT '',
+    laser_nm    REAL,
+    date        TEXT NOT NULL,
+    scheme      TEXT,
+    degree      INTEGER,
+    temperature REAL,
+    coefs       TEXT,
+    residual    REAL,
+    fingerprint TEXT,
+    valid       INTEGER NOT NULL DEFAULT 1,
+    model       BLOB,
+    extra       TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_calibration_config
+    ON calibration (instrument, grating, kind, valid, date, laser_nm);
+CREATE INDEX IF NOT EXISTS idx_calibration_date
+    ON calibration (date);
+CREATE INDEX IF NOT EXISTS idx_calibration_fingerprint
+    ON calibration (fingerprint);
+'''
+
+_columns = ('id', 'kind', 'instrument', 'grating', 'laser_nm', 'date',
+            'scheme', 'degree', 'temperature', 'coefs', 'residual',
+            'fingerprint', 'valid', 'extra')
+
+# tolerance for matching the laser wavelength, nm
+laser_tolerance = 0.05
+
+# ------------------------------------------------------
+
+
+def _iso_date(date):
+    '''date as ISO 8601 string (UTC), for datetime, date, ISO 8601 string
+    or None (now). Strings are parsed with datetime.fromisoformat, with
+    or without time, offset or 'Z' suffix, and written in the same form
+    as datetimes, so that all dates compare correctly in the queries.
+    Naive dates and times are taken as UTC.'''
+
+    if date is None:
+        date = datetime.now(timezone.utc)
+    elif isinstance(date, str):
+        text = date.strip()
+        if text.endswith(('Z', 'z')):
+            # 'Z' is accepted by fromisoformat only from python 3.11
+            text = text[:-1] + '+00:00'
+        try:
+            date = datetime.fromisoformat(text)
+        except ValueError:
+            raise ValueError('date should be in ISO 8601 format, not '
+                             '{0!r}'.format(date)) from None
+    elif isinstance(date, date_type) and not isinstance(date, datetime):
+        date = datetime(date.year, date.month, date.day)
+
+    if not isinstance(date, datetime):
+        raise TypeError('date should be a datetime, a date or an ISO 8601 '
+                        'string, not {0}'.format(type(date)))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+# ------------------------------------------------------
+
+
+def _to_record(row):
+    record = dict(zip(_columns, row))
+    record['coefs'] = None if record['coefs'] is None \
+        else np.array(json.loads(record['coefs']))
+    record['extra'] = {} if record['extra'] is None \
+        else json.loads(record['extra'])
+    record['valid'] = bool(record['valid'])
+    return record
+
+# ------------------------------------------------------
+
+
+class CalibrationStore:
+    '''Local store of the calibration results
+
+    filename = path of the SQLite database (created if needed) '''
+
+    def __init__(self, filename='calibrations.sqlite'):
+        self.filename = filename
+        self._con = sqlite3.connect(filename)
+        self._con.execute('PRAGMA journal_mode=WAL')
+        self._con.executescript(_schema)
+        self._con.commit()
+
+    def close(self):
+        self._con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ty, val, tb):
+        self.close()
+        return False
+
+    # --------------------------------------------------
+
+    def add(self, kind, instrument, grating='', laser_nm=None, date=None,
+            scheme=None, model=None, degree=None, temperature=None,
+            coefs=None, residual=None, fingerprint=None, valid=True,
+            extra=None):
+        '''Record a calibration result
+
+        kind        = 'C0_C1', 'C2' or 'combined'
+        instrument, grating, laser_nm = tags of the configuration
+        date        = datetime or ISO string (default : now, UTC)
+        scheme      = name of the scheme, for example 'genC2_VR_T_dep_para'
+        model       = CorrectionModel (optional). Degree, temperature and
+                      coefs are taken from the model when not given
+        residual    = value of the residual at the optimum
+        fingerprint = hash of the inputs (see pipeline_cache.input_hash)
+        extra       = dict, any other metadata (JSON compatible)
+
+        returns => id of the new record '''
+
+        blob = None
+        if model is not None:
+            blob = sqlite3.Binary(model.to_bytes())
+            degree = model.degree if degree is None else degree
+            temperature = model.temperature if temperature is None \
+                else temperature
+            coefs = model.coefs if coefs is None else coefs
+
+        coefs_json = None if coefs is None else \
+            json.dumps([float(c) for c in np.ravel(coefs)])
+
+        cur = self._con.execute(
+            'INSERT INTO calibration (kind, instrument, grating, laser_nm, '
+            'date, scheme, degree, temperature, coefs, residual, '
+            'fingerprint, valid, model, extra) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (kind, instrument, str(grating),
+             None if laser_nm is None else float(laser_nm),
+             _iso_date(date), scheme,
+             None if degree is None else int(degree),
+             None if temperature is None else float(temperature),
+             coefs_json, None if residual is None else float(residual),
+             fingerprint, int(bool(valid)), blob,
+             json.dumps(extra or {})))
+        self._con.commit()
+        return cur.lastrowid
+
+    # --------------------------------------------------
+
+    def _select(self, where, args, order='date DESC', limit=None):
+        sql = 'SELECT {0} FROM calibration WHERE {1} ORDER BY {2}'.format(
+            ', '.join(_columns), where, order)
+        if limit is not None:
+            sql = sql + ' LIMIT {0:d}'.format(limit)
+        return [_to_record(row) for row in self._con.execute(sql, args)]
+
+    # --------------------------------------------------
+
+    def latest(self, instrument, grating='', laser_nm=None, kind='C2',
+               before=None):
+        '''Latest valid calibration for the configuration
+
+        before = datetime or ISO string, when given the latest calibration
+                 recorded before this date is returned
+
+        returns => record (dict), or None '''
+
+        where = 'instrument = ? AND grating = ? AND kind = ? AND valid = 1'
+        args = [instrument, str(grating), kind]
+        if laser_nm is not None:
+            where = where + ' AND laser_nm BETWEEN ? AND ?'
+            args = args + [laser_nm - laser_tolerance,
+                           laser_nm + laser_tolerance]
+        if before is not None:
+            where = where + ' AND date < ?'
+            args.append(_iso_date(before))
+
+        found = self._select(where, args, limit=1)
+        return found[0] if found else None
+
+    # --------------------------------------------------
+
+    def scan(self, start=None, end=None, instrument=None, kind=None,
+             valid_only=True):
+        '''Calibrations recorded in the time range [start, end), oldest
+        first. All arguments are optional.
+
+        returns => list of records (dict) '''
+
+        clauses = []
+        args = []
+        if start is not None:
+            clauses.append('date >= ?')
+            args.append(_iso_date(start))
+        if end is not None:
+            clauses.append('date < ?')
+            args.append(_iso_date(end))
+        if instrument is not None:
+            clauses.append('instrument = ?')
+            args.append(instrument)
+        if kind is not None:
+            clauses.append('kind = ?')
+            args.append(kind)
+        if valid_only:
+            clauses.append('valid = 1')
+
+        where = ' AND '.join(clauses) if clauses else '1'
+        return self._select(where, args, order='date ASC')
+
+    # --------------------------------------------------
+
+    def get(self, record_id):
+        '''record with the given id, or None'''
+        found = self._select('id = ?', [record_id])
+        return found[0] if found else None
+
+    def find(self, fingerprint):
+        '''valid records with the given fingerprint of inputs,
+        latest first'''
+        return self._select('fingerprint = ? AND valid = 1', [fingerprint])
+
+    # --------------------------------------------------
+
+    def invalidate(self, record_id):
+        '''mark a record as not valid (it is kept in the store)'''
+        self._con.execute('UPDATE calibration SET valid = 0 WHERE id = ?',
+                          (record_id,))
+        self._con.commit()
+
+    # --------------------------------------------------
+
+    def load_model(self, record):
+        '''CorrectionModel stored with the record (record or id),
+        None if no model was stored'''
+
+        record_id = record['id'] if isinstance(record, dict) else record
+        row = self._con.execute('SELECT model FROM calibration WHERE id = ?',
+                                (record_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return CorrectionModel.from_bytes(bytes(row[0]))
+
+# ------------------------------------------------------
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module describing a compact, serializable model of the intensity
+correction.
+
+Instead of the full-length text arrays (correction_*.txt and
+intensity_correction.txt) the model keeps the optimized coefficients of
+the C2 polynomial (with their scale factors and the center used for the
+x-axis), the temperature, the C0 and C1 vectors and some metadata. The
+correction is evaluated lazily on any requested x-axis, evaluations are
+cached using a fingerprint of the axis."""
+
+import io
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from numpy.polynomial import chebyshev, legendre
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# CorrectionModel(coefs, scales, scenter=0.0, temperature=None, ...)
+#    C2(x)          : C2 correction curve on the x-axis
+#    C0_C1(x)       : C0/C1 correction interpolated on the x-axis
+#    correction(x)  : multiplicative correction C0/(C1*C2) on the x-axis
+#    save(filename) / CorrectionModel.load(filename)
+
+# CorrectionModel.from_files(c2_file=None, c0_c1_file=None)
+#    Build the model from the npz files written by run_fit_* and
+#    gen_C0_C1 (correction_<degree>_model.npz, intensity_correction.npz)
+
+# axis_fingerprint(x)
+#    Hash of an axis, used as key for caching
+
+# ------------------------------------------------------
+
+format_version = 1
+
+# orthogonal bases of the C2 polynomial, evaluated on the domain mapped
+# to [-1, 1]
+_orthogonal = {'chebyshev': chebyshev.chebval,
+               'legendre': legendre.legval}
+
+# number of cached evaluations kept per model
+cache_size = 16
+
+# ------------------------------------------------------
+
+
+def axis_fingerprint(x):
+    '''Returns a short hex string identifying the given axis
+    (shape and values)'''
+
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    h = hashlib.sha1(str(x.shape).encode())
+    h.update(x.tobytes())
+    return h.hexdigest()[:20]
+
+# ------------------------------------------------------
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+# ------------------------------------------------------
+
+
+class CorrectionModel:
+    '''Compact model of the intensity correction
+
+    coefs       = coefficients of the C2 polynomial, c1 to cn
+                  (as optimized, that is before scaling)
+    scales      = scale factors for each coef (scale1 to scalen)
+    scenter     = center of the x-axis used in the fit (0 when x-axis
+                  is not shifted)
+    temperature = optimized temperature, K (optional)
+    basis       = 'monomial' (1 + sum (c_k/scale_k) * (x-scenter)**k )
+                  'chebyshev', 'legendre' (1 + sum c_k * (t_k(u)-t_k(u_ref))
+                  with u, u_ref = x, scenter mapped from domain to [-1, 1],
+                  scales are not used)
+    domain      = (min, max) of the x-axis mapped to [-1, 1], required for
+                  the chebyshev and legendre bases
+    axis        = x-axis on which C0 and C1 are defined (optional)
+    C0, C1      = C0 and C1 vectors defined on axis (optional)
+    metadata    = dict, for example instrument, grating, laser, date '''
+
+    def __init__(self, coefs=(), scales=(), scenter=0.0, temperature=None,
+                 basis='monomial', axis=None, C0=None, C1=None,
+                 metadata=None, domain=None):
+
+        self.coefs = np.asarray(coefs, dtype=np.float64).ravel()
+        self.scales = np.asarray(scales, dtype=np.float64).ravel()
+        if self.scales.shape[0] != self.coefs.shape[0]:
+            raise ValueError('Number of scales ({0}) does not match the '
+                             'number of coefs ({1})'.format(
+                                 self.scales.shape[0], self.coefs.shape[0]))
+        self.degree = self.coefs.shape[0]
+        self.scenter = float(scenter)
+        self.temperature = temperature
+        self.basis = basis
+        if basis != 'monomial' and basis not in _orthogonal:
+            raise ValueError('Unknown basis : {0}'.format(basis))
+        if basis in _orthogonal and domain is None:
+            raise ValueError('domain is required for the {0} basis'
+                             .format(basis))
+        self.domain = None if domain is None else \
+            tuple(float(v) for v in np.ravel(domain))
+
+        self.axis = None if axis is None else \
+            np.asarray(axis, dtype=np.float64).ravel()
+        self.C0 = None if C0 is None else \
+            np.asarray(C0, dtype=np.float64).ravel()
+        self.C1 = None if C1 is None else \
+            np.asarray(C1, dtype=np.float64).ravel()
+
+        for name in ('C0', 'C1'):
+            vec = getattr(self, name)
+            if vec is not None and (self.axis is None
+                                    or vec.shape != self.axis.shape):
+                raise ValueError('{0} requires an axis of the same length'
+                                 .format(name))
+
+        self.metadata = dict(metadata or {})
+        self._cache = OrderedDict()
+
+    # --------------------------------------------------
+
+    @classmethod
+    def from_fit(cls, param, scales, scenter=0.0, **kwargs):
+        '''Build the model from the parameter vector of a fit,
+        param = [T, c1, c2, ...] (that is res.x from run_fit_*)'''
+
+        param = np.asarray(param, dtype=np.float64).ravel()
+        return cls(coefs=param[1:], scales=np.asarray(scales)[:param.shape[0]-1],
+                   scenter=scenter, temperature=float(param[0]), **kwargs)
+
+    # --------------------------------------------------
+
+    @classmethod
+    def from_files(cls, c2_file=None, c0_c1_file=None, metadata=None):
+        '''Build the model from the compact files written by
+        run_fit_* (correction_<degree>_model.npz) and by
+        gen_C0_C1 (intensity_correction.npz)'''
+
+        kwargs = {'metadata': dict(metadata or {})}
+
+        if c2_file is not None:
+            with np.load(c2_file) as data:
+                kwargs['coefs'] = data['coefs']
+                kwargs['scales'] = data['scales']
+                kwargs['scenter'] = float(data['scenter'])
+                if 'temperature' in data.files:
+                    kwargs['temperature'] = float(data['temperature'])
+                if 'basis' in data.files:
+                    kwargs['basis'] = str(data['basis'])
+                if 'domain' in data.files:
+                    kwargs['domain'] = data['domain']
+                if 'residual' in data.files:
+                    kwargs['metadata'].setdefault('residual',
+                                                  float(data['residual']))
+
+        if c0_c1_file is not None:
+            with np.load(c0_c1_file) as data:
+                kwargs['axis'] = data['Ramanshift']
+                kwargs['C0'] = data['C0']
+                kwargs['C1'] = data['C1']
+                if 'laser_nm' in data.files:
+                    kwargs['metadata'].setdefault('laser_nm',
+                                                  float(data['laser_nm']))
+
+        return cls(**kwargs)
+
+    # --------------------------------------------------
+    # Evaluation
+    # --------------------------------------------------
+
+    def _cached(self, kind, x, func):
+        '''Evaluate func(x) once per (kind, axis), keeping at most
+        cache_size results'''
+
+        key = (kind, axis_fingerprint(x))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        out = _read_only(func(np.asarray(x, dtype=np.float64)))
+        self._cache[key] = out
+        while len(self._cache) > cache_size:
+            self._cache.popitem(last=False)
+        return out
+
+    def clear_cache(self):
+        '''remove all cached evaluations'''
+        self._cache.clear()
+
+    # --------------------------------------------------
+
+    def _eval_C2(self, x):
+        if self.basis in _orthogonal:
+            a, b = self.domain
+            val = _orthogonal[self.basis]
+            c = np.concatenate(([0.0], self.coefs))
+            u = (2.0 * x - (a + b)) / (b - a)
+            u_ref = (2.0 * self.scenter - (a + b)) / (b - a)
+            return 1.0 + val(u, c) - val(u_ref, c)
+
+        xs = x - self.scenter
+        out = np.ones_like(xs)
+        # Horner scheme on the scaled coefs
+        if self.degree > 0:
+            k = self.coefs / self.scales
+            acc = np.full_like(xs, k[-1])
+            for c in k[-2::-1]:
+                acc = acc * xs + c
+            out = out + acc * xs
+        return out
+
+    def C2(self, x):
+        '''C2 correction curve on the x-axis x (cached)'''
+        return self._cached('C2', x, self._eval_C2)
+
+    # --------------------------------------------------
+
+    def _interp(self, x, vec):
+        if self.axis[0] > self.axis[-1]:
+            return np.interp(x, self.axis[::-1], vec[::-1],
+                             left=np.nan, right=np.nan)
+        return np.interp(x, self.axis, vec, left=np.nan, right=np.nan)
+
+    def C0_C1(self, x):
+        '''C0/C1 correction interpolated on the x-axis x (cached),
+        nan outside the axis where C0 and C1 are known'''
+
+        if self.C0 is None or self.C1 is None:
+            raise ValueError('C0 and C1 are not available in this model')
+        return self._cached('C0_C1', x,
+                            lambda x: self._interp(x, self.C0 / self.C1))
+
+    # --------------------------------------------------
+
+    def correction(self, x):
+        '''Multiplicative correction C0/(C1*C2) on the x-axis x (cached).
+        When C0 and C1 are not part of the model, 1/C2 is returned.'''
+
+        if self.C0 is None or self.C1 is None:
+            return self._cached('corr', x, lambda x: 1.0 / self._eval_C2(x))
+        return self._cached('corr', x, lambda x: np.asarray(self.C0_C1(x))
+                            / self.C2(x))
+
+    # --------------------------------------------------
+    # Serialization
+    # --------------------------------------------------
+
+    def to_dict(self):
+        '''JSON compatible representation of the model'''
+
+        def vec(v):
+            return None if v is None else v.tolist()
+
+        return {'format_version': format_version,
+                'coefs': vec(self.coefs), 'scales': vec(self.scales),
+                'scenter': self.scenter, 'degree': self.degree,
+                'temperature': self.temperature, 'basis': self.basis,
+                'domain': None if self.domain is None else list(self.domain),
+                'axis': vec(self.axis), 'C0': vec(self.C0), 'C1': vec(self.C1),
+                'metadata': self.metadata}
+
+    @classmethod
+    def from_dict(cls, record):
+        '''Build the model from the output of to_dict()'''
+        return cls(coefs=record['coefs'], scales=record['scales'],
+                   scenter=record['scenter'],
+                   temperature=record.get('temperature'),
+                   basis=record.get('basis', 'monomial'),
+                   domain=record.get('domain'),
+                   axis=record.get('axis'), C0=record.get('C0'),
+                   C1=record.get('C1'), metadata=record.get('metadata'))
+
+    # --------------------------------------------------
+
+    def _arrays(self):
+        header = {'format_version': format_version, 'scenter': self.scenter,
+                  'temperature': self.temperature, 'basis': self.basis,
+                  'domain': None if self.domain is None else list(self.domain),
+                  'metadata': self.metadata}
+        arrays = {'header': np.array(json.dumps(header)),
+                  'coefs': self.coefs, 'scales': self.scales}
+        for name in ('axis', 'C0', 'C1'):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        return arrays
+
+    @classmethod
+    def _from_arrays(cls, data):
+        header = json.loads(str(data['header']))
+        kwargs = {name: data[name] for name in ('axis', 'C0', 'C1')
+                  if name in data.files}
+        return cls(coefs=data['coefs'], scales=data['scales'],
+                   scenter=header['scenter'],
+                   temperature=header['temperature'], basis=header['basis'],
+                   domain=header.get('domain'),
+                   metadata=header['metadata'], **kwargs)
+
+    # --------------------------------------------------
+
+    def save(self, filename):
+        '''Save the model as compressed binary file (npz)'''
+        np.savez_compressed(filename, **self._arrays())
+
+    @classmethod
+    def load(cls, filename):
+        '''Load the model saved using save()'''
+        with np.load(filename) as data:
+            return cls._from_arrays(data)
+
+    # --------------------------------------------------
+
+    def to_bytes(self):
+        '''Model as bytes (compressed npz), for example to be kept in
+        a database'''
+        buf = io.BytesIO()
+        np.savez_compressed(buf, **self._arrays())
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        '''Model from the output of to_bytes()'''
+        with np.load(io.BytesIO(blob)) as data:
+            return cls._from_arrays(data)
+
+    # --------------------------------------------------
+
+    def __repr__(self):
+        return 'CorrectionModel(degree={0}, T={1}, basis={2}, C0/C1={3})'\
+            .format(self.degree, self.temperature, self.basis,
+                    self.C0 is not None)
+
+# ------------------------------------------------------
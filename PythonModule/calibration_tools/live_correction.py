@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for applying the intensity correction to spectra arriving
+frame by frame from the acquisition software (live monitoring).
+
+The multiplicative correction  C0 / (C1 C2)  is composed once for the
+current x-axis and kept in memory. Frames are corrected into a
+preallocated ring buffer, so no new array is created per frame."""
+
+import threading
+import numpy as np
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# compose_correction(C0_C1, C2=None)
+#    Returns the multiplicative correction C0/(C1*C2) as 1D array
+
+# LiveCorrector(C0_C1, C2=None, n_buffer=64)
+#    push(frame)            : correct a frame, returns corrected view
+#    swap_correction(C0_C1, C2=None) : replace the correction atomically
+#    latest(n=1)            : last n corrected frames (oldest first)
+
+# ------------------------------------------------------
+
+
+def compose_correction(C0_C1, C2=None):
+    '''Compose the multiplicative correction applied to the Raman spectrum
+
+    C0_C1 = vector, output of gen_C0_C1 (that is, C0/C1)
+    C2    = vector, C2 correction curve from run_fit_* (for example,
+            loaded from correction_quadratic.txt), optional
+
+    returns => C0 / (C1 * C2) as 1D float64 array '''
+
+    corr = np.array(C0_C1, dtype=np.float64).ravel()
+
+    if C2 is not None:
+        C2 = np.asarray(C2, dtype=np.float64).ravel()
+        if C2.shape[0] != corr.shape[0]:
+            raise ValueError('Dimension mismatch for C0/C1 ({0}) and C2 ({1})'
+                             .format(corr.shape[0], C2.shape[0]))
+        np.divide(corr, C2, out=corr)
+
+    return corr
+
+# ------------------------------------------------------
+
+
+class LiveCorrector:
+    '''Long-lived object holding the composed correction for the present
+    x-axis, and a ring buffer of corrected frames.
+
+    C0_C1    = vector, output of gen_C0_C1
+    C2       = vector, C2 correction curve (optional)
+    n_buffer = number of corrected frames kept in the ring buffer
+
+    Example:
+        live = LiveCorrector(corr_C0C1, np.loadtxt('correction_cubic.txt',
+                                                   skiprows=1))
+        for frame in acquisition:
+            corrected = live.push(frame)
+    '''
+
+    def __init__(self, C0_C1, C2=None, n_buffer=64):
+        correction = compose_correction(C0_C1, C2)
+
+        self.n_points = correction.shape[0]
+        self.n_buffer = int(n_buffer)
+
+        self._correction = correction
+        self._version = 0
+
+        # preallocated storage
+        self._buffer = np.zeros((self.n_buffer, self.n_points))
+        self._slot_version = np.full(self.n_buffer, -1, dtype=np.int64)
+        self._count = 0
+
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------
+
+    @property
+    def correction(self):
+        '''the correction vector presently applied (read only view)'''
+        view = self._correction.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def version(self):
+        '''incremented every time a new correction is swapped in'''
+        return self._version
+
+    @property
+    def count(self):
+        '''total number of frames corrected so far'''
+        return self._count
+
+    # --------------------------------------------------
+
+    def swap_correction(self, C0_C1, C2=None):
+        '''Replace the correction, for example when a recalibration has
+        finished. The new vector is composed first and then swapped in
+        with a single reference assignment, so each frame is corrected
+        either fully with the old or fully with the new correction.
+
+        returns => new version number '''
+
+        correction = compose_correction(C0_C1, C2)
+        if correction.shape[0] != self.n_points:
+            raise ValueError('New correction has {0} points, expected {1}'
+                             .format(correction.shape[0], self.n_points))
+
+        with self._lock:
+            self._correction = correction
+            self._version = self._version + 1
+        return self._version
+
+    # --------------------------------------------------
+
+    def push(self, frame):
+        '''Correct one frame (1D, same length as the x-axis) into the
+        next slot of the ring buffer.
+
+        returns => corrected frame, a view into the ring buffer which is
+                   overwritten after n_buffer further frames '''
+
+        with self._lock:
+            slot = self._count % self.n_buffer
+            self._count = self._count + 1
+            correction = self._correction
+            self._slot_version[slot] = self._version
+            out = self._buffer[slot]
+            np.multiply(frame, correction, out=out)
+        return out
+
+    # --------------------------------------------------
+
+    def slot_version(self, index=-1):
+        '''version of the correction applied to a buffered frame,
+        index as in latest(), -1 being the most recent frame'''
+        slot = (self._count + index) % self.n_buffer
+        return int(self._slot_version[slot])
+
+    # --------------------------------------------------
+
+    def latest(self, n=1):
+        '''returns => copy of the last n corrected frames as 2D array,
+                      oldest first'''
+
+        with self._lock:
+            n = min(n, self._count, self.n_buffer)
+            index = (np.arange(self._count - n, self._count)) % self.n_buffer
+            return self._buffer[index]
+
+# ------------------------------------------------------
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module implementing a content-addressed on-disk cache for the stages
+of the calibration pipeline ( C0/C1 -> C2 ).
+
+Each stage is keyed by a hash of all of its inputs (arrays, x-axis,
+laser wavelength, normalization point, mask, J indices, degree, norm,
+solver options, ...). The outputs of a stage are stored in a local
+cache directory, so a stage is recomputed only when its inputs have
+changed. When the cache grows beyond the set size, least recently used
+entries are removed."""
+
+import os
+import sys
+import hashlib
+import zipfile
+import tempfile
+import contextlib
+import functools
+import numpy as np
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# input_hash(*args, **kwargs)
+#    Hash of any combination of arrays, scalars, strings, lists, dicts
+#    and functions (name and bytecode)
+
+# StageCache(directory='calibration_cache', max_bytes=512*1024**2)
+#    run(name, func, inputs, version='', depends=())
+#        cached call of func(**inputs)
+
+# run_pipeline(cache, Ramanshift, laser_nm, wl_spectra, norm_pnt,
+#              mask=None, fit_C2=None, C2_inputs=None)
+#    Run C0/C1 (gen_C0_C1) followed by the C2 fit, using the cache
+
+# stage_C2_VR(dataH2, dataHD, dataD2, degree, param_init, ...)
+#    C2 fit of genC2_VR_T_dep_para/perp (CalibrationProblem), usable as
+#    fit_C2 of run_pipeline
+
+# ------------------------------------------------------
+
+
+def _update(h, obj):
+    '''Feed obj into the hash object h, in a canonical form'''
+
+    if isinstance(obj, np.ndarray) or isinstance(obj, np.generic):
+        arr = np.ascontiguousarray(obj)
+        h.update(b'nd' + str(arr.dtype).encode() + str(arr.shape).encode())
+        h.update(arr.tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'dict%d' % len(obj))
+        for key in sorted(obj, key=str):
+            _update(h, str(key))
+            _update(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'seq%d' % len(obj))
+        for item in obj:
+            _update(h, item)
+    elif obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        h.update(type(obj).__name__.encode() + repr(obj).encode())
+    elif isinstance(obj, functools.partial):
+        h.update(b'partial')
+        _update(h, obj.func)
+        _update(h, list(obj.args))
+        _update(h, dict(obj.keywords))
+    elif callable(obj):
+        h.update(b'fn' + '{0}.{1}'.format(
+            getattr(obj, '__module__', ''),
+            getattr(obj, '__qualname__', repr(obj))).encode())
+        code = getattr(obj, '__code__', None)
+        if code is None:
+            code = getattr(getattr(obj, '__func__', None), '__code__', None)
+        if code is not None:
+            _update_code(h, code)
+        # default arguments of simple types change the result as well
+        defaults = getattr(obj, '__defaults__', None) or ()
+        for value in defaults:
+            if value is None or isinstance(value, (bool, int, float, str)):
+                _update(h, value)
+    else:
+        raise TypeError('Cannot hash input of type {0}'.format(type(obj)))
+
+
+def _update_code(h, code):
+    '''Feed the bytecode, constants and names of a code object (and of
+    the functions defined in it) into the hash object h. Functions called
+    by it are not included, see the version of StageCache.run'''
+
+    h.update(b'code' + code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _update_code(h, const)
+        elif isinstance(const, frozenset):
+            # the order of a frozenset depends on the hash seed
+            h.update(repr(sorted(repr(c) for c in const)).encode())
+        else:
+            h.update(repr(const).encode())
+
+# ------------------------------------------------------
+
+
+def input_hash(*args, **kwargs):
+    '''Returns the hex sha256 hash identifying the given inputs'''
+
+    h = hashlib.sha256()
+    _update(h, list(args))
+    _update(h, kwargs)
+    return h.hexdigest()
+
+# ------------------------------------------------------
+
+
+class StageCache:
+    '''On-disk cache of stage outputs
+
+    directory = path of the cache directory (created if needed)
+    max_bytes = size limit of the cache, least recently used entries
+                are removed when this is exceeded
+
+    Outputs of a stage are stored as  <key>.npz  and should be a dict
+    of numpy arrays or scalars (no None or other python objects, the
+    entries are read without pickle). '''
+
+    def __init__(self, directory='calibration_cache', max_bytes=512*1024**2):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # --------------------------------------------------
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    # --------------------------------------------------
+
+    def get(self, key):
+        '''returns => dict of outputs, or None when not in cache'''
+
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                out = {name: (data[name].item() if data[name].ndim == 0
+                              else data[name]) for name in data.files}
+        except (OSError, ValueError, EOFError, KeyError,
+                zipfile.BadZipFile):
+            # missing, truncated or otherwise unreadable entry : miss
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return out
+
+    # --------------------------------------------------
+
+    def put(self, key, outputs):
+        '''Store the dict of outputs under key (atomic write)'''
+
+        if not isinstance(outputs, dict):
+            raise TypeError('Outputs of a stage should be a dict of arrays '
+                            'or scalars, not {0}'.format(type(outputs)))
+        arrays = {}
+        for name, value in outputs.items():
+            arr = np.asarray(value)
+            if arr.dtype.hasobject:
+                raise TypeError('Output {0} of type {1} cannot be cached, '
+                                'outputs should be arrays or scalars'.format(
+                                    name, type(value)))
+            arrays[name] = arr
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self._path(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict(keep=self._path(key))
+
+    # --------------------------------------------------
+
+    def size(self):
+        '''total size of the cached entries in bytes'''
+        return sum(e.stat().st_size for e in os.scandir(self.directory)
+                   if e.name.endswith('.npz'))
+
+    def evict(self, keep=None):
+        '''Remove least recently used entries until the size of the
+        cache is below max_bytes (the entry at path keep is not
+        removed)'''
+
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.name.endswith('.npz'):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(item[1] for item in entries)
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total = total - size
+            except OSError:
+                pass
+
+    def clear(self):
+        '''Remove all cached entries'''
+        for e in os.scandir(self.directory):
+            if e.name.endswith('.npz'):
+                os.remove(e.path)
+
+    # --------------------------------------------------
+
+    def run(self, name, func, inputs, version='', depends=()):
+        '''Cached evaluation of func(**inputs)
+
+        name    = name of the stage (part of the key)
+        func    = function returning a dict of arrays/scalars
+        inputs  = dict of keyword arguments for func
+        version = string, change to invalidate previous results of
+                  this stage. The bytecode of func is part of the key,
+                  so a change in func itself invalidates them, but not a
+                  change in the functions it calls
+        depends = keys of the stages whose outputs this stage depends
+                  on (part of the key)
+
+        returns => (outputs, key) '''
+
+        key = input_hash(name, version, func, inputs, list(depends))
+        out = self.get(key)
+        if out is not None:
+            self.hits = self.hits + 1
+            return out, key
+
+        self.misses = self.misses + 1
+        out = func(**inputs)
+        self.put(key, out)
+        return out, key
+
+    # --------------------------------------------------
+
+    def stats(self):
+        '''dict with the number of hits and misses and the size'''
+        return {'hits': self.hits, 'misses': self.misses,
+                'bytes': self.size()}
+
+# ------------------------------------------------------
+#                  PIPELINE STAGES
+# ------------------------------------------------------
+
+
+def _import_gen_correction():
+    '''gen_correction is in the directory determine_C0_C1_correction'''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'determine_C0_C1_correction')
+    if path not in sys.path:
+        sys.path.append(path)
+    import gen_correction
+    return gen_correction
+
+
+@contextlib.contextmanager
+def _no_plots():
+    '''plt.show does nothing (gen_C1 plots the fit), the figures opened
+    in the block are closed'''
+
+    import matplotlib.pyplot as plt
+    show = plt.show
+    before = set(plt.get_fignums())
+    plt.show = lambda *args, **kwargs: None
+    try:
+        yield
+    finally:
+        plt.show = show
+        for num in set(plt.get_fignums()) - before:
+            plt.close(num)
+
+# ------------------------------------------------------
+
+
+def stage_C0_C1(Ramanshift, laser_nm, wl_spectra, norm_pnt, mask=None,
+                set_mask_nan=None):
+    '''Stage computing C0 and C1 using gen_C0_C1 (without plots)
+
+    returns => dict with C0, C1 and correction (C0/C1) '''
+
+    gen_correction = _import_gen_correction()
+    C0 = gen_correction.gen_C0(Ramanshift, norm_pnt)
+    with _no_plots():
+        correction = gen_correction.gen_C0_C1(Ramanshift, laser_nm,
+                                              wl_spectra, norm_pnt,
+                                              mask=mask,
+                                              set_mask_nan=set_mask_nan)
+    return {'C0': C0, 'C1': C0 / correction, 'correction': correction}
+
+# ------------------------------------------------------
+
+
+def _import_calibration_problem():
+    '''calibration_problem is in the directory of genC2_VR_T_dep_para
+    (the energy levels are read relative to the modules)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'determine_C2', 'vibration_rotation_H2_HD_D2',
+                        'T_dependent_analysis')
+    if path not in sys.path:
+        sys.path.append(path)
+    import calibration_problem
+    return calibration_problem
+
+
+def stage_C2_VR(dataH2, dataHD, dataD2, degree, param_init,
+                polarization='para', J=None, norm='Frobenius',
+                basis='monomial', weighted=False, scenter=3316.3,
+                xaxis=None, fit_options=None):
+    '''Stage fitting C2 with T as parameter, as run_fit_* of
+    genC2_VR_T_dep_para (polarization='para') or genC2_VR_T_dep_perp
+    ('perp'), using calibration_problem.CalibrationProblem
+
+    dataH2, dataHD, dataD2 = band areas ( area | error ), rows in the
+                             order of the computed spectra
+    degree       = degree of the polynomial (1 to 5)
+    param_init   = initial [T, c1, ...]
+    J            = dict of the J indices (default :
+                   calibration_problem.default_J)
+    xaxis        = x-axis on which the C2 curve and its standard error
+                   are returned (optional)
+    fit_options  = dict, see fit_utils.minimize
+
+    returns => dict with param, residual, nfev, cov and stderr, and C2,
+               C2_std when xaxis is given '''
+
+    calibration_problem = _import_calibration_problem()
+    problem = calibration_problem.CalibrationProblem(
+        {'H2': dataH2, 'HD': dataHD, 'D2': dataD2}, degree,
+        polarization=polarization, J=J, norm=norm, scenter=scenter,
+        xaxis=xaxis, weighted=weighted, basis=basis)
+    res = problem.fit(np.asarray(param_init, dtype=np.float64),
+                      **dict(fit_options or {}))
+    cov = problem.covariance(res.x)
+
+    out = {'param': res.x, 'residual': float(res.fun), 'nfev': res.nfev,
+           'cov': cov['cov'], 'stderr': cov['stderr']}
+    if xaxis is not None:
+        out['C2'] = problem.curve(res.x, xaxis)
+        out['C2_std'] = problem.curve_std(cov['cov'], xaxis)
+    return out
+
+# ------------------------------------------------------
+
+
+def run_pipeline(cache, Ramanshift, laser_nm, wl_spectra, norm_pnt,
+                 mask=None, set_mask_nan=None, fit_C2=None, C2_inputs=None,
+                 C2_version=''):
+    '''Run the calibration pipeline using the cache
+
+    cache      = StageCache
+    Ramanshift, laser_nm, wl_spectra, norm_pnt, mask, set_mask_nan
+               = as for gen_C0_C1
+    fit_C2     = function performing the C2 fit of the chosen scheme
+                 (for example stage_C2_VR). Called as fit_C2(**C2_inputs),
+                 it should return a dict of arrays/scalars (for example,
+                 param and residual)
+    C2_inputs  = dict, all inputs of the C2 fit (band areas, x-axis,
+                 J indices, degree, norm, solver options, ...)
+    C2_version = string, change to invalidate cached C2 results
+
+    The C2 fit uses the band areas in C2_inputs and does not read the
+    C0/C1 outputs, so its key depends only on its own inputs (a change
+    of C0/C1 does not invalidate it). When the band areas are obtained
+    from spectra corrected with C0/C1, they change and so does the key.
+
+    returns => dict with 'C0_C1' and 'C2' outputs, and 'keys' of the
+               stages '''
+
+    C0_C1, key_C0_C1 = cache.run(
+        'C0_C1', stage_C0_C1,
+        {'Ramanshift': Ramanshift, 'laser_nm': laser_nm,
+         'wl_spectra': wl_spectra, 'norm_pnt': norm_pnt, 'mask': mask,
+         'set_mask_nan': set_mask_nan})
+
+    out = {'C0_C1': C0_C1, 'C2': None,
+           'keys': {'C0_C1': key_C0_C1, 'C2': None}}
+
+    if fit_C2 is not None:
+        C2, key_C2 = cache.run('C2', fit_C2, dict(C2_inputs or {}),
+                               version=C2_version)
+        out['C2'] = C2
+        out['keys']['C2'] = key_C2
+
+    return out
+
+# ------------------------------------------------------
+
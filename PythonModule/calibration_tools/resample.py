@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for mapping spectra and correction vectors from one x-axis
+to another (for example, when the axis of the spectrometer has shifted
+slightly between sessions).
+
+For every pair of (source axis, target axis) a sparse interpolation
+operator is built once and cached, using fingerprints of the two axes
+as the key. A block of spectra is then mapped using a single sparse
+matrix product instead of a loop of np.interp over the spectra.
+
+Note : C0 depends on the spacing of the x-axis (see gen_C0). For a new
+axis, C0 should be regenerated using the new axis, while C1 and the
+spectra can be resampled here."""
+
+from collections import OrderedDict
+import numpy as np
+from scipy import sparse
+
+from correction_model import axis_fingerprint
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# resampling_operator(source, target, kind='linear')
+#    Returns the (cached) ResamplingOperator for the pair of axes
+
+# resample(data, source, target, kind='linear', fill_value=np.nan)
+#    Map a vector (n,) or a block of spectra (n, n_spectra) from
+#    source axis to target axis
+
+# clear_cache()
+
+# ------------------------------------------------------
+
+# number of operators kept in memory
+cache_size = 32
+
+_cache = OrderedDict()
+
+# ------------------------------------------------------
+
+
+class ResamplingOperator:
+    '''Sparse interpolation operator from source axis (n points) to
+    target axis (m points)
+
+    matrix  = scipy.sparse csr matrix, shape (m, n)
+    outside = boolean vector (m), True for target points outside the
+              source axis (no extrapolation is done)
+    kind    = 'linear' or 'cubic' '''
+
+    def __init__(self, matrix, outside, kind):
+        self.matrix = matrix
+        self.outside = outside
+        self.kind = kind
+        self.shape = matrix.shape
+
+    def apply(self, data, fill_value=np.nan):
+        '''Map data defined on the source axis, 1D (n) or 2D
+        (n, n_spectra), to the target axis'''
+
+        data = np.asarray(data, dtype=np.float64)
+        if data.shape[0] != self.shape[1]:
+            raise ValueError('Dimension mismatch for data ({0}) and the '
+                             'source axis ({1})'.format(data.shape[0],
+                                                         self.shape[1]))
+        out = self.matrix @ data
+        if fill_value is not None and np.any(self.outside):
+            out[self.outside] = fill_value
+        return out
+
+    def __repr__(self):
+        return 'ResamplingOperator({0}, shape={1}, nnz={2})'.format(
+            self.kind, self.shape, self.matrix.nnz)
+
+# ------------------------------------------------------
+
+
+def _locate(source, target, width):
+    '''Sort the source axis and find, for every target point, the first
+    of the `width` source points used for the interpolation'''
+
+    order = np.argsort(source, kind='stable')
+    xs = source[order]
+    n = xs.shape[0]
+    if n < width:
+        raise ValueError('Source axis needs at least {0} points'
+                         .format(width))
+
+    idx = np.searchsorted(xs, target, side='right') - 1
+    start = np.clip(idx - (width // 2 - 1), 0, n - width)
+    outside = (target < xs[0]) | (target > xs[-1])
+    return order, xs, start, outside
+
+# ------------------------------------------------------
+
+
+def _linear_weights(source, target):
+    order, xs, start, outside = _locate(source, target, 2)
+
+    x0 = xs[start]
+    x1 = xs[start + 1]
+    w = (target - x0) / (x1 - x0)
+
+    cols = np.stack((start, start + 1), axis=1)
+    data = np.stack((1.0 - w, w), axis=1)
+    return order, cols, data, outside
+
+# ------------------------------------------------------
+
+
+def _cubic_weights(source, target):
+    '''Four-point Lagrange (cubic) interpolation, valid for non-uniform
+    axes'''
+
+    order, xs, start, outside = _locate(source, target, 4)
+
+    cols = start[:, None] + np.arange(4)[None, :]
+    nodes = xs[cols]                          # (m, 4)
+    t = target[:, None]
+
+    data = np.ones_like(nodes)
+    for k in range(4):
+        for j in range(4):
+            if j != k:
+                data[:, k] *= (t[:, 0] - nodes[:, j]) / \
+                    (nodes[:, k] - nodes[:, j])
+    return order, cols, data, outside
+
+# ------------------------------------------------------
+
+
+def _build(source, target, kind):
+    if kind == 'linear':
+        order, cols, data, outside = _linear_weights(source, target)
+    elif kind == 'cubic':
+        order, cols, data, outside = _cubic_weights(source, target)
+    else:
+        raise ValueError("kind should be 'linear' or 'cubic'")
+
+    m, width = cols.shape
+    data[outside] = 0.0
+    rows = np.repeat(np.arange(m), width)
+
+    # map back from the sorted to the original order of the source axis
+    matrix = sparse.csr_matrix((data.ravel(), (rows, order[cols].ravel())),
+                               shape=(m, source.shape[0]))
+    matrix.eliminate_zeros()
+    return ResamplingOperator(matrix, outside, kind)
+
+# ------------------------------------------------------
+
+
+def resampling_operator(source, target, kind='linear'):
+    '''Returns the sparse operator mapping data from the source axis
+    to the target axis. Operators are cached, keyed by fingerprints
+    of both axes and the kind of interpolation.
+
+    source = vector, x-axis on which the data is defined
+    target = vector, new x-axis
+    kind   = 'linear' or 'cubic' '''
+
+    source = np.asarray(source, dtype=np.float64).ravel()
+    target = np.asarray(target, dtype=np.float64).ravel()
+
+    key = (axis_fingerprint(source), axis_fingerprint(target), kind)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    op = _build(source, target, kind)
+    _cache[key] = op
+    while len(_cache) > cache_size:
+        _cache.popitem(last=False)
+    return op
+
+# ------------------------------------------------------
+
+
+def resample(data, source, target, kind='linear', fill_value=np.nan):
+    '''Map a vector (n) or a block of spectra (n, n_spectra, one
+    spectrum per column as for the white light spectra in gen_C0_C1)
+    from the source axis to the target axis.
+
+    Points of the target axis outside the source axis are set to
+    fill_value (no extrapolation). '''
+
+    op = resampling_operator(source, target, kind)
+    return op.apply(data, fill_value)
+
+# ------------------------------------------------------
+
+
+def clear_cache():
+    '''remove all cached operators'''
+    _cache.clear()
+
+# ------------------------------------------------------
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module rendering stick spectra (line positions and intensities, for
+example the output of compute_spectra or compute_series_para/perp) as
+spectra on the x-axis of the detector.
+
+The convolution is done on a fine uniform grid covering the x-axis.
+The Fourier transform of the lines (exact for any position, not
+rounded to the grid) is multiplied by the analytical Fourier transform
+of the instrument function (gaussian, lorentzian or voigt), and the
+spectra on the grid are obtained with one inverse real FFT. The result
+is interpolated on the x-axis (cubic, see resample.py)
+and divided by the intensity correction C0/(C1*C2), so that applying
+the correction to the rendered spectrum gives back the convolved
+lines. Noise is added last.
+
+Many spectra (for example, the same lines at several temperatures)
+share the grid and the transform of the lines, so that a block of
+spectra is obtained with one matrix product and one inverse FFT."""
+
+import numpy as np
+from scipy import fft
+
+import resample
+from correction_model import CorrectionModel
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# render(positions, intensities, xaxis, instrument='gaussian', fwhm=2.0,
+#        fwhm_lorentz=None, correction=None, noise=None, noise_level=0.0,
+#        seed=None, oversample=4)
+#    Spectrum (n_points) or block of spectra (n_points, n_spectra) on the
+#    x-axis
+
+# line_matrix(line_lists, position_column=1, intensity_column=2)
+#    Shared positions and (n_spectra, n_lines) intensities from several
+#    stick spectra (for example, compute_spectra at several T)
+
+# instrument_ft(freq, instrument='gaussian', fwhm=2.0, fwhm_lorentz=None)
+#    Fourier transform of the instrument function (unit area)
+
+# add_noise(spectra, noise='gaussian', noise_level=0.0, seed=None)
+
+# ------------------------------------------------------
+
+instruments = ('gaussian', 'lorentzian', 'voigt')
+noise_models = ('gaussian', 'shot')
+
+# the grid extends beyond the x-axis by margin times the FWHM of the
+# instrument function, lines farther away are not rendered
+margin = 10.0
+
+# the grid is fine enough that the Fourier transform of the instrument
+# function is below kernel_tol at the Nyquist frequency (no aliasing)
+kernel_tol = 1e-7
+
+# spectra convolved at once (limits the memory used by the FFT)
+chunk = 256
+
+# ------------------------------------------------------
+
+
+def _widths(instrument, fwhm, fwhm_lorentz):
+    '''(gaussian FWHM, lorentzian FWHM) of the instrument function'''
+
+    if instrument not in instruments:
+        raise ValueError('instrument should be one of {0}'.format(instruments))
+    if instrument == 'gaussian':
+        return float(fwhm), 0.0
+    if instrument == 'lorentzian':
+        return 0.0, float(fwhm)
+    if fwhm_lorentz is None:
+        raise ValueError('fwhm_lorentz is required for the voigt instrument')
+    return float(fwhm), float(fwhm_lorentz)
+
+
+def voigt_fwhm(fwhm_gauss, fwhm_lorentz):
+    '''FWHM of the voigt profile (Olivero and Longbothum, 0.02 %)'''
+
+    return 0.5346 * fwhm_lorentz + np.sqrt(0.2166 * fwhm_lorentz**2
+                                           + fwhm_gauss**2)
+
+# ------------------------------------------------------
+
+
+def instrument_ft(freq, instrument='gaussian', fwhm=2.0, fwhm_lorentz=None):
+    '''Fourier transform of the instrument function of unit area
+
+    freq         = frequencies, in 1/(unit of the x-axis)
+    instrument   = 'gaussian', 'lorentzian' or 'voigt'
+    fwhm         = FWHM of the gaussian or of the lorentzian, or the
+                   gaussian part of the voigt
+    fwhm_lorentz = FWHM of the lorentzian part of the voigt
+
+    returns => real array, the shape of freq '''
+
+    fg, fl = _widths(instrument, fwhm, fwhm_lorentz)
+    freq = np.abs(np.asarray(freq, dtype=np.float64))
+    sigma = fg / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+    gamma = fl / 2.0
+    return np.exp(-2.0 * (np.pi * sigma * freq)**2
+                  - 2.0 * np.pi * gamma * freq)
+
+# ------------------------------------------------------
+
+
+def line_matrix(line_lists, position_column=1, intensity_column=2):
+    '''Stack several stick spectra on shared positions
+
+    line_lists = list of 2D arrays (lines in rows), as returned by
+                 compute_spectra (J | position | intensity)
+
+    returns => (positions (n_lines), intensities (n_spectra, n_lines)),
+               a line missing from a list has zero intensity '''
+
+    pos = [np.asarray(s, dtype=np.float64)[:, position_column]
+           for s in line_lists]
+    positions, inverse = np.unique(np.concatenate(pos), return_inverse=True)
+
+    intensities = np.zeros((len(line_lists), positions.shape[0]))
+    start = 0
+    for i, s in enumerate(line_lists):
+        n = pos[i].shape[0]
+        np.add.at(intensities[i], inverse[start:start + n],
+                  np.asarray(s, dtype=np.float64)[:, intensity_column])
+        start += n
+    return positions, intensities
+
+# ------------------------------------------------------
+
+
+def _nyquist(fg, fl):
+    '''Frequency above which the transform of the instrument function
+    is below kernel_tol'''
+
+    # solve a f^2 + b f = log(1/kernel_tol), see instrument_ft
+    a = 2.0 * (np.pi * fg / (2.0 * np.sqrt(2.0 * np.log(2.0))))**2
+    b = np.pi * fl
+    c = -np.log(kernel_tol)
+    if a == 0.0:
+        return c / b
+    return (-b + np.sqrt(b * b + 4.0 * a * c)) / (2.0 * a)
+
+
+def _grid(xaxis, fg, fl, oversample):
+    '''Fine uniform grid covering the x-axis with the margin'''
+
+    width = voigt_fwhm(fg, fl)
+    step = np.amin(np.abs(np.diff(xaxis)))
+    h = min(min(step, width) / oversample, 0.5 / _nyquist(fg, fl))
+    lo = np.amin(xaxis) - margin * width
+    hi = np.amax(xaxis) + margin * width
+    n = fft.next_fast_len(int(np.ceil((hi - lo) / h)) + 1, real=True)
+    return lo + h * np.arange(n), h
+
+
+def _line_transform(positions, grid, h, kernel, freq):
+    '''(n_freq, n_lines) matrix giving the real FFT of the convolved lines
+    on the grid from their intensities (exact transform of each line,
+    times the instrument function)'''
+
+    inside = (positions >= grid[0]) & (positions <= grid[-1])
+    out = np.zeros((freq.shape[0], positions.shape[0]), dtype=np.complex128)
+    out[:, inside] = np.exp(-2j * np.pi * np.outer(freq,
+                                                   positions[inside] - grid[0]))
+    # irfft divides by the number of points, the grid holds a density
+    out *= (kernel / h)[:, None]
+    return out
+
+# ------------------------------------------------------
+
+
+def render(positions, intensities, xaxis, instrument='gaussian', fwhm=2.0,
+           fwhm_lorentz=None, correction=None, noise=None, noise_level=0.0,
+           seed=None, oversample=4):
+    '''Render stick spectra on the x-axis of the detector
+
+    positions    = line positions (n_lines), in the unit of xaxis
+    intensities  = line intensities (areas), (n_lines) or
+                   (n_spectra, n_lines), see line_matrix
+    xaxis        = x-axis of the detector (n_points), not necessarily
+                   uniform or increasing
+    instrument   = 'gaussian', 'lorentzian' or 'voigt'
+    fwhm         = FWHM of the instrument function (gaussian part for
+                   the voigt)
+    fwhm_lorentz = FWHM of the lorentzian part of the voigt
+    correction   = multiplicative intensity correction C0/(C1*C2), as
+                   vector (n_points) or CorrectionModel. The rendered
+                   spectrum is divided by it (optional)
+    noise        = None, 'gaussian' or 'shot' (see add_noise)
+    noise_level  = factor of the noise model
+    seed         = seed of the random numbers
+    oversample   = points of the fine grid per FWHM (or per pixel, if
+                   smaller), at least. The grid is finer when needed to
+                   resolve the instrument function (see kernel_tol)
+
+    returns => spectrum (n_points) when intensities is 1D, otherwise
+               (n_points, n_spectra), one spectrum per column '''
+
+    xaxis = np.asarray(xaxis, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    intensities = np.asarray(intensities, dtype=np.float64)
+    single = intensities.ndim == 1
+    intensities = np.atleast_2d(intensities)
+    if intensities.shape[1] != positions.shape[0]:
+        raise ValueError('Dimension mismatch for positions ({0}) and '
+                         'intensities ({1})'.format(positions.shape[0],
+                                                    intensities.shape[1]))
+
+    fg, fl = _widths(instrument, fwhm, fwhm_lorentz)
+    grid, h = _grid(xaxis, fg, fl, oversample)
+    freq = fft.rfftfreq(grid.shape[0], d=h)
+    kernel = instrument_ft(freq, instrument, fwhm, fwhm_lorentz)
+    transform = _line_transform(positions, grid, h, kernel, freq)
+
+    out = np.empty((xaxis.shape[0], intensities.shape[0]))
+    for start in range(0, intensities.shape[0], chunk):
+        spec = transform @ intensities[start:start + chunk].T
+        block = fft.irfft(spec, n=grid.shape[0], axis=0)
+        out[:, start:start + chunk] = resample.resample(block, grid, xaxis,
+                                                        kind='cubic')
+
+    if correction is not None:
+        if isinstance(correction, CorrectionModel):
+            correction = correction.correction(xaxis)
+        correction = np.asarray(correction, dtype=np.float64).ravel()
+        if correction.shape[0] != xaxis.shape[0]:
+            raise ValueError('Dimension mismatch for xaxis ({0}) and '
+                             'correction ({1})'.format(xaxis.shape[0],
+                                                       correction.shape[0]))
+        out /= correction[:, None]
+
+    if noise is not None:
+        out = add_noise(out, noise, noise_level, seed)
+
+    return out[:, 0] if single else out
+
+# ------------------------------------------------------
+
+
+def add_noise(spectra, noise='gaussian', noise_level=0.0, seed=None):
+    '''Add noise to rendered spectra (in place when float64)
+
+    noise       = 'gaussian' : error = noise_level (same for all points)
+                  'shot'     : error = noise_level * sqrt(signal)
+    seed        = seed of the random numbers, or a numpy Generator
+
+    returns => spectra + error * N(0, 1) '''
+
+    if noise not in noise_models:
+        raise ValueError('noise should be one of {0}'.format(noise_models))
+    spectra = np.asarray(spectra, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+
+    draws = rng.standard_normal(spectra.shape)
+    if noise == 'gaussian':
+        draws *= noise_level
+    else:
+        draws *= noise_level * np.sqrt(np.clip(spectra, 0.0, None))
+    spectra += draws
+    return spectra
+
+# ------------------------------------------------------
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+"""Fixtures for the tests of calibration_tools (the modules are imported
+from the parent directory)."""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_DIR = os.path.dirname(HERE)
+
+if MODULE_DIR not in sys.path:
+    sys.path.insert(0, MODULE_DIR)
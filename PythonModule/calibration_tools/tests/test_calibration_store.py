@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from calibration_store import CalibrationStore
+from correction_model import CorrectionModel
+
+
+def test_add_latest_and_model(tmp_path):
+    model = CorrectionModel.from_fit([298.5, -0.05, 0.01], [1e4, 1e7],
+                                     3316.3)
+    with CalibrationStore(str(tmp_path / 'cal.sqlite')) as store:
+        first = store.add('C2', 'spectrometer 1', 'g1200', 532.0,
+                          date='2024-01-01T10:00:00', model=model,
+                          residual=1e-3, fingerprint='abc')
+        second = store.add('C2', 'spectrometer 1', 'g1200', 532.02,
+                           date='2024-02-01T10:00:00', coefs=[0.1],
+                           extra={'note': 'test'})
+        store.add('C2', 'spectrometer 2', 'g1200', 532.0,
+                  date='2024-03-01T10:00:00')
+
+        latest = store.latest('spectrometer 1', 'g1200', 532.0)
+        assert latest['id'] == second
+        assert latest['extra'] == {'note': 'test'}
+        assert store.latest('spectrometer 1', 'g1200', 785.0) is None
+        assert store.latest('spectrometer 1', 'g1200',
+                            before='2024-01-15')['id'] == first
+
+        store.invalidate(second)
+        assert store.latest('spectrometer 1', 'g1200')['id'] == first
+        assert [r['id'] for r in store.find('abc')] == [first]
+
+        record = store.get(first)
+        assert record['temperature'] == 298.5
+        assert record['degree'] == 2
+        np.testing.assert_array_equal(record['coefs'], model.coefs)
+
+        loaded = store.load_model(record)
+        np.testing.assert_array_equal(loaded.coefs, model.coefs)
+        x = np.linspace(2300.0, 4200.0, 50)
+        np.testing.assert_array_equal(loaded.C2(x), model.C2(x))
+        assert store.load_model(second) is None
+
+
+def test_scan(tmp_path):
+    with CalibrationStore(str(tmp_path / 'cal.sqlite')) as store:
+        for month in (3, 1, 2):
+            store.add('C0_C1', 'spectrometer 1',
+                      date='2024-{0:02d}-01T00:00:00'.format(month))
+        found = store.scan('2024-01-15', '2024-03-15')
+        assert [r['date'][:7] for r in found] == ['2024-02', '2024-03']
+        assert len(store.scan(kind='C2')) == 0
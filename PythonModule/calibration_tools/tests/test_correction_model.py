@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from correction_model import CorrectionModel
+
+scales = np.array([1e4, 1e7, 1e9])
+scenter = 3316.3
+x = np.linspace(2300.0, 4200.0, 200)
+
+
+def _model(**kwargs):
+    return CorrectionModel.from_fit([298.5, -0.05, 0.01, 0.002], scales,
+                                    scenter, **kwargs)
+
+
+def test_C2_monomial():
+    model = _model()
+    xs = x - scenter
+    ref = 1.0 - 0.05 * xs / 1e4 + 0.01 * xs**2 / 1e7 + 0.002 * xs**3 / 1e9
+    np.testing.assert_allclose(model.C2(x), ref, rtol=1e-12)
+    assert model.temperature == 298.5
+    assert model.degree == 3
+
+
+def test_C2_chebyshev_is_one_at_center():
+    model = CorrectionModel([0.1, -0.02], [1.0, 1.0], scenter,
+                            basis='chebyshev', domain=(x[0], x[-1]))
+    assert model.C2(np.array([scenter]))[0] == pytest.approx(1.0)
+
+
+def test_correction_with_C0_C1_and_cache():
+    C0 = np.linspace(1.0, 2.0, x.shape[0])
+    C1 = np.full(x.shape[0], 2.0)
+    model = _model(axis=x, C0=C0, C1=C1)
+
+    corr = model.correction(x)
+    np.testing.assert_allclose(corr, C0 / C1 / model.C2(x), rtol=1e-12)
+    assert model.correction(x.copy()) is corr
+    with pytest.raises(ValueError):
+        corr[0] = 0.0             # cached results are read only
+
+
+def test_round_trips(tmp_path):
+    model = _model(axis=x, C0=np.ones_like(x), C1=np.ones_like(x),
+                   metadata={'instrument': 'spectrometer 1'})
+    filename = str(tmp_path / 'model.npz')
+    model.save(filename)
+    for other in (CorrectionModel.from_dict(model.to_dict()),
+                  CorrectionModel.from_bytes(model.to_bytes()),
+                  CorrectionModel.load(filename)):
+        np.testing.assert_array_equal(other.coefs, model.coefs)
+        np.testing.assert_array_equal(other.C0, model.C0)
+        assert other.temperature == model.temperature
+        assert other.metadata == model.metadata
+        np.testing.assert_array_equal(other.correction(x),
+                                      model.correction(x))
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        CorrectionModel([0.1, 0.2], [1.0])
+    with pytest.raises(ValueError):
+        CorrectionModel([0.1], [1.0], basis='chebyshev')
+    with pytest.raises(ValueError):
+        CorrectionModel([0.1], [1.0], C0=np.ones(3))
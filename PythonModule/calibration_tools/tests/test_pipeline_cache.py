@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import os
+import functools
+import subprocess
+import sys
+
+import numpy as np
+
+import pipeline_cache
+
+calls = []
+
+
+def stage(x, scale=2.0):
+    calls.append(x)
+    return {'y': np.asarray(x) * scale}
+
+
+def test_run_hit_and_miss(tmp_path):
+    cache = pipeline_cache.StageCache(str(tmp_path))
+    del calls[:]
+    x = np.arange(5.0)
+
+    out, key = cache.run('s', stage, {'x': x})
+    again, key2 = cache.run('s', stage, {'x': x.copy()})
+    assert key == key2
+    np.testing.assert_array_equal(again['y'], out['y'])
+    assert len(calls) == 1
+
+    cache.run('s', stage, {'x': x + 1.0})
+    cache.run('s', stage, {'x': x}, version='2')
+    assert len(calls) == 3
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 3
+
+
+def test_hash_of_functions():
+    def f(x):
+        return x + 1
+    h = pipeline_cache.input_hash(f)
+
+    def f(x):
+        return x + 2
+    assert pipeline_cache.input_hash(f) != h
+    assert pipeline_cache.input_hash(f) == pipeline_cache.input_hash(f)
+
+    p = functools.partial(stage, scale=3.0)
+    assert pipeline_cache.input_hash(p) == \
+        pipeline_cache.input_hash(functools.partial(stage, scale=3.0))
+    assert pipeline_cache.input_hash(p) != \
+        pipeline_cache.input_hash(functools.partial(stage, scale=4.0))
+
+
+def test_hash_of_functions_is_stable_between_processes():
+    '''the key must not depend on the hash seed of the process'''
+
+    code = ('import sys; sys.path.insert(0, {0!r}); import pipeline_cache;'
+            'f = lambda s: s in {{"a", "b", "c"}};'
+            'print(pipeline_cache.input_hash(f))').format(
+                os.path.dirname(os.path.abspath(pipeline_cache.__file__)))
+    out = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        out.add(subprocess.check_output([sys.executable, '-c', code],
+                                        env=env))
+    assert len(out) == 1
+
+
+def test_import_calibration_problem_keeps_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    module = pipeline_cache._import_calibration_problem()
+    assert os.getcwd() == str(tmp_path)
+    assert hasattr(module, 'CalibrationProblem')
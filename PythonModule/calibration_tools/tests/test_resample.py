@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import resample
+
+source = np.linspace(2300.0, 4200.0, 301)
+target = np.linspace(2250.0, 4150.0, 257) + 0.37
+
+
+def test_linear_matches_interp():
+    data = np.sin(source / 50.0) + source * 1e-3
+    out = resample.resample(data, source, target)
+
+    ref = np.interp(target, source, data, left=np.nan, right=np.nan)
+    np.testing.assert_allclose(out, ref, rtol=1e-12, atol=1e-12)
+    assert np.isnan(out[target < source[0]]).all()
+
+
+def test_descending_source_and_block():
+    rng = np.random.default_rng(1)
+    block = rng.normal(size=(source.shape[0], 5))
+    out = resample.resample(block[::-1], source[::-1], target)
+
+    assert out.shape == (target.shape[0], 5)
+    for k in range(5):
+        ref = np.interp(target, source, block[:, k], left=np.nan,
+                        right=np.nan)
+        np.testing.assert_allclose(out[:, k], ref, rtol=1e-12, atol=1e-12)
+
+
+def test_cubic_is_exact_for_cubic_polynomial():
+    # non-uniform axis
+    x = np.sort(np.random.default_rng(2).uniform(0.0, 10.0, 60))
+    t = np.linspace(x[0], x[-1], 91)
+    out = resample.resample(x**3 - 2.0 * x, x, t, kind='cubic')
+    np.testing.assert_allclose(out, t**3 - 2.0 * t, rtol=1e-9, atol=1e-9)
+
+
+def test_operator_is_cached():
+    resample.clear_cache()
+    op = resample.resampling_operator(source, target)
+    assert resample.resampling_operator(source.copy(), target) is op
+    assert resample.resampling_operator(source, target, 'cubic') is not op
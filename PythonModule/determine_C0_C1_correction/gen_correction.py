@@ -1,6 +1,7 @@
 #############################################################################
 
 import package_util
+import utils
 
 import numpy as np
 from numpy.polynomial import Polynomial
@@ -45,6 +46,9 @@ print('\t\t\t set_mask_nan= boolean, 1 will set the masked region in')
 print('\t\t\t                the output correction to nan, 0 will not do so.')
 print('\t\t\t export = 0 or 1, setting to 1 will export the correction as a txt')
 print('\t\t\t             file with name intensity_correction.txt')
+print('\t\t\t             (and C0, C1 as intensity_correction.npz)')
+print('\t\t\t profile = True will save a profile of the call as')
+print('\t\t\t             profile_gen_C0_C1.prof (see utils.ProfileBlock)')
 
 print('\t\t\t  ------------------------------------------')
 print('\t\t\t  All vectors required here should be numpy arrays.')
@@ -67,6 +71,7 @@ print('\t**********************************************************')
 #############################################################################
 # This file has function(s) for determination of the C0 and C1 corrections
 
+@utils.profiled
 def gen_C0_C1 (Ramanshift, laser_nm, wl_spectra, norm_pnt, mask = None,
                set_mask_nan = None, export = None):
 
@@ -125,6 +130,13 @@ def gen_C0_C1 (Ramanshift, laser_nm, wl_spectra, norm_pnt, mask = None,
         np.savetxt(filename, correction, fmt='%3.7f', newline='\n',
                    header='intensity_corr')
 
+        # compact binary copy, with the C0 and C1 vectors
+        #  (see calibration_tools/correction_model.py)
+        print('\t C0 and C1 will be exported as intensity_correction.npz')
+        np.savez_compressed('intensity_correction.npz', Ramanshift=Ramanshift,
+                            C0=C0, C1=C1, laser_nm=laser_nm,
+                            norm_pnt=norm_pnt)
+
     return correction
     #----------------------------------------------------------
 
@@ -3,6 +3,7 @@
 
 import math
 import numpy as np
+import utils
 import matplotlib.pyplot as plt
 
 import boltzmann_popln as bp
@@ -69,6 +70,7 @@ def normalize1d(array_name):
 #********************************************************************
 #********************************************************************
 
+@utils.timed('spectra')
 def spectra_H2(T, Js, Jas):
     """Compute in intensities and position for rotational Raman bands of H2 """
 
@@ -144,6 +146,7 @@ def spectra_H2(T, Js, Jas):
 #********************************************************************
 #********************************************************************
 
+@utils.timed('spectra')
 def spectra_HD(T, Js, Jas):
     """Compute in intensities and position for rotational Raman bands of HD """
 
@@ -218,6 +221,7 @@ def spectra_HD(T, Js, Jas):
 #********************************************************************
 #********************************************************************
 
+@utils.timed('spectra')
 def spectra_D2(T, Js, Jas):
     """Compute in intensities and position for rotational Raman bands of D2 """
 
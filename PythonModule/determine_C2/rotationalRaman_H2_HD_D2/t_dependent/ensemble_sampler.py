@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module implementing an affine-invariant ensemble sampler (MCMC) for the
+posterior of T and the coefs of the sensitivity polynomial.
+
+The stretch move of Goodman and Weare (Comm. App. Math. Comp. Sci. 5, 65
+(2010)) is used, with the walkers split in two halves : all walkers of
+one half are moved using the other half, so the log probability of a
+half is evaluated in a single batched call (see
+CalibrationProblem.log_likelihood, and log_likelihood of
+genC2_PR_T_dep). The chain can be saved to disk at regular intervals,
+and a run resumes from the saved chain."""
+
+# The same module is in determine_C2/rotationalRaman_H2_HD_D2/t_dependent/
+# and determine_C2/vibration_rotation_H2_HD_D2/T_dependent_analysis/ (the
+# modules are copied in each directory, as utils.py), keep both copies
+# identical.
+
+import os
+import json
+import tempfile
+import numpy as np
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# EnsembleSampler(log_prob, n_walkers, n_dim, a=2.0, seed=None,
+#                 checkpoint=None, checkpoint_every=500)
+#    run(p0, n_steps)                 : run (or resume) up to n_steps
+#    samples(burn=0, thin=1)          : flattened chain
+#    acceptance_fraction, chain, log_prob_chain
+
+# autocorr_time(chain)
+#    Integrated autocorrelation time of each parameter
+
+# ------------------------------------------------------
+
+
+class EnsembleSampler:
+    '''Affine-invariant ensemble sampler (stretch move)
+
+    log_prob   = function returning the log probability for a 2D array
+                 of param (m, n_dim), as a vector (m). Return -np.inf
+                 outside the prior range
+    n_walkers  = number of walkers, even and at least 2*n_dim
+    n_dim      = number of parameters
+    a          = scale of the stretch move
+    seed       = seed of the random numbers
+    checkpoint = filename (npz) to save the chain, a run with the same
+                 file resumes from the saved chain
+    checkpoint_every = number of steps between saves '''
+
+    def __init__(self, log_prob, n_walkers, n_dim, a=2.0, seed=None,
+                 checkpoint=None, checkpoint_every=500):
+
+        if n_walkers % 2 or n_walkers < 2 * n_dim:
+            raise ValueError('n_walkers should be even and at least '
+                             '2*n_dim')
+        self.log_prob = log_prob
+        self.n_walkers = n_walkers
+        self.n_dim = n_dim
+        self.a = a
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.rng = np.random.default_rng(seed)
+
+        self._chain = np.zeros((0, n_walkers, n_dim))
+        self._lnp = np.zeros((0, n_walkers))
+        self.accepted = np.zeros(n_walkers, dtype=int)
+        self.position = None
+        self.lnp = None
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.load(checkpoint)
+
+    # --------------------------------------------------
+
+    @property
+    def chain(self):
+        '''array (n_steps, n_walkers, n_dim)'''
+        return self._chain
+
+    @property
+    def log_prob_chain(self):
+        '''array (n_steps, n_walkers)'''
+        return self._lnp
+
+    @property
+    def n_steps(self):
+        return self._chain.shape[0]
+
+    @property
+    def acceptance_fraction(self):
+        '''fraction of accepted moves of each walker'''
+        return self.accepted / max(self.n_steps, 1)
+
+    # --------------------------------------------------
+
+    def _move(self, half):
+        '''stretch move of the walkers in half (0 or 1)'''
+
+        W = self.n_walkers // 2
+        active = slice(0, W) if half == 0 else slice(W, None)
+        other = slice(W, None) if half == 0 else slice(0, W)
+
+        X = self.position[active]
+        C = self.position[other]
+
+        z = ((self.a - 1.0) * self.rng.random(W) + 1.0)**2 / self.a
+        j = self.rng.integers(0, W, size=W)
+        Y = C[j] + z[:, None] * (X - C[j])
+
+        lnp_new = np.asarray(self.log_prob(Y), dtype=np.float64)
+        lnq = (self.n_dim - 1) * np.log(z) + lnp_new - self.lnp[active]
+        accept = np.log(self.rng.random(W)) < lnq
+
+        X[accept] = Y[accept]
+        self.position[active] = X
+        lnp = self.lnp[active]
+        lnp[accept] = lnp_new[accept]
+        self.lnp[active] = lnp
+        self.accepted[active] += accept
+
+    # --------------------------------------------------
+
+    def run(self, p0, n_steps):
+        '''Run the chain up to a total of n_steps steps. When the chain
+        was loaded from the checkpoint, p0 is not used and the run
+        continues from the last saved position.
+
+        p0 = initial positions of the walkers, (n_walkers, n_dim)
+
+        returns => chain, (n_steps, n_walkers, n_dim) '''
+
+        if self.position is None:
+            self.position = np.array(p0, dtype=np.float64)
+            if self.position.shape != (self.n_walkers, self.n_dim):
+                raise ValueError('p0 should have shape (n_walkers, n_dim)')
+            self.lnp = np.asarray(self.log_prob(self.position),
+                                  dtype=np.float64)
+            if not np.all(np.isfinite(self.lnp)):
+                raise ValueError('log_prob of p0 should be finite')
+
+        remaining = n_steps - self.n_steps
+        if remaining <= 0:
+            return self._chain
+
+        chain = np.zeros((remaining, self.n_walkers, self.n_dim))
+        lnp = np.zeros((remaining, self.n_walkers))
+        start = 0
+        for i in range(remaining):
+            self._move(0)
+            self._move(1)
+            chain[i] = self.position
+            lnp[i] = self.lnp
+
+            if self.checkpoint is not None and \
+                    (i + 1 - start == self.checkpoint_every
+                     or i + 1 == remaining):
+                self._chain = np.concatenate((self._chain, chain[start:i+1]))
+                self._lnp = np.concatenate((self._lnp, lnp[start:i+1]))
+                self.save(self.checkpoint)
+                start = i + 1
+
+        if start < remaining:
+            self._chain = np.concatenate((self._chain, chain[start:]))
+            self._lnp = np.concatenate((self._lnp, lnp[start:]))
+        return self._chain
+
+    # --------------------------------------------------
+
+    def samples(self, burn=0, thin=1):
+        '''Chain after removing burn steps and keeping every thin-th
+        step, flattened to (n, n_dim)'''
+        return self._chain[burn::thin].reshape(-1, self.n_dim)
+
+    # --------------------------------------------------
+
+    def save(self, filename):
+        '''Save the chain and the state of the sampler (atomic write)'''
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, chain=self._chain, log_prob=self._lnp,
+                         position=self.position, lnp=self.lnp,
+                         accepted=self.accepted, a=self.a,
+                         rng_state=json.dumps(
+                             self.rng.bit_generator.state))
+            os.replace(tmp, filename)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def load(self, filename):
+        '''Load the chain and the state of the sampler'''
+
+        with np.load(filename) as data:
+            if data['chain'].shape[1:] != (self.n_walkers, self.n_dim):
+                raise ValueError('Checkpoint {0} is for a different number '
+                                 'of walkers or parameters'.format(filename))
+            self._chain = data['chain']
+            self._lnp = data['log_prob']
+            self.position = data['position']
+            self.lnp = data['lnp']
+            self.accepted = data['accepted']
+            self.rng.bit_generator.state = json.loads(str(data['rng_state']))
+
+# ------------------------------------------------------
+
+
+def autocorr_time(chain, c=5.0):
+    '''Integrated autocorrelation time of each parameter, from the
+    autocorrelation averaged over the walkers, with the automatic window
+    of Sokal (window M is the smallest with M >= c*tau)
+
+    chain = array (n_steps, n_walkers, n_dim)
+
+    returns => vector (n_dim) '''
+
+    chain = np.asarray(chain, dtype=np.float64)
+    n = chain.shape[0]
+    size = 2**int(np.ceil(np.log2(2 * n)))
+
+    x = chain - np.mean(chain, axis=0)
+    f = np.fft.rfft(x, n=size, axis=0)
+    acf = np.fft.irfft(f * np.conjugate(f), n=size, axis=0)[:n]
+    acf = np.mean(acf, axis=1)                      # mean over walkers
+    acf = acf / acf[0]
+
+    taus = 2.0 * np.cumsum(acf, axis=0) - 1.0
+    out = np.zeros(chain.shape[2])
+    for k in range(chain.shape[2]):
+        m = np.arange(n) < c * taus[:, k]
+        window = np.argmin(m) if not np.all(m) else n - 1
+        out[k] = taus[window, k]
+    return out
+
+# ------------------------------------------------------
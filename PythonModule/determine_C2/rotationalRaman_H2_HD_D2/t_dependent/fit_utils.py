@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module with the optimizer settings and tools shared by the run_fit_*
+functions of genC2_PR_T_dep (rotationalRaman_H2_HD_D2/t_dependent), and
+of genC2_VR_T_dep_para, genC2_VR_T_dep_perp, CalibrationProblem and
+influence (vibration_rotation_H2_HD_D2/T_dependent_analysis)"""
+
+# The same module is in both directories (the modules are copied in each
+# directory, as utils.py), keep both copies identical.
+
+import time
+from collections import deque
+import numpy as np
+import scipy.optimize as opt
+
+try:
+    from common import utils        # vibration-rotation modules
+except ImportError:
+    import utils
+
+# ------------------------------------------------------
+
+# default tolerances of the Nelder-Mead minimization
+xatol = 1e-9
+fatol = 1e-9
+
+# message of a fit stopped at the deadline
+deadline_message = 'Deadline reached, best parameters found so far.'
+
+# message of a fit stopped by the criterion on the correction curve
+curve_message = 'Change of the correction curve and of T below tolerance.'
+
+# ------------------------------------------------------
+
+
+def initial_simplex(param, step):
+    '''Initial simplex for Nelder-Mead around param
+
+    param = vector, [T, c1, c2, ...]
+    step  = vector (same length as param) or scalar, displacement of
+            the vertices along each parameter
+
+    returns => array, (n+1) x n '''
+
+    param = np.asarray(param, dtype=np.float64)
+    step = np.broadcast_to(np.asarray(step, dtype=np.float64), param.shape)
+
+    simplex = np.tile(param, (param.shape[0] + 1, 1))
+    for i in range(param.shape[0]):
+        simplex[i + 1, i] = simplex[i + 1, i] + step[i]
+    return simplex
+
+# ------------------------------------------------------
+
+
+class _DeadlineReached(Exception):
+    pass
+
+
+class _CurveConverged(Exception):
+    pass
+
+
+class _Tracker:
+    '''Wraps the residual function, keeps the best evaluation and
+    the trace of the minimization'''
+
+    def __init__(self, residual, deadline, curve=None, curve_tol=None,
+                 T_tol=None, window=None, recorder=None):
+        self.residual = residual
+        self.recorder = recorder
+        self.start = time.perf_counter()
+        self.end = None if deadline is None else self.start + deadline
+        self.nfev = 0
+        self.nit = 0
+        self.best_x = None
+        self.best_fun = np.inf
+        self.trace = []
+
+        # stopping rule on the correction curve, the param evaluated in
+        # the last window iterations (around the simplex) are compared
+        # with the best param
+        self.curve = curve
+        self.curve_tol = curve_tol
+        self.T_tol = T_tol
+        self.points = []
+        self.history = None if curve_tol is None else deque(maxlen=window)
+
+    def __call__(self, param):
+        if self.end is not None and time.perf_counter() > self.end:
+            raise _DeadlineReached
+        f = self.residual(param)
+        self.nfev += 1
+        if self.history is not None:
+            self.points.append(np.array(param, dtype=np.float64))
+        if f < self.best_fun:
+            self.best_fun = f
+            self.best_x = np.array(param, dtype=np.float64)
+        return f
+
+    def callback(self, xk):
+        self.nit += 1
+        elapsed = time.perf_counter() - self.start
+        self.trace.append((self.nit, self.nfev, elapsed, self.best_fun))
+        if self.recorder is not None:
+            self.recorder.record(self.nit, self.nfev, elapsed, self.best_x,
+                                 self.best_fun)
+        if self.history is not None:
+            self.history.append(self.points)
+            self.points = []
+            if self.history.maxlen == len(self.history):
+                self.check_curve()
+
+    def check_curve(self):
+        points = [p for step in self.history for p in step]
+        if not points:
+            return
+        if self.T_tol is not None and \
+                max(abs(p[0] - self.best_x[0]) for p in points) >= self.T_tol:
+            return
+        best = self.curve(self.best_x)
+        scale = np.amax(np.abs(best))
+        for p in points:
+            if np.amax(np.abs(self.curve(p) - best)) >= self.curve_tol * scale:
+                return
+        raise _CurveConverged
+
+# ------------------------------------------------------
+
+
+def minimize(residual, param_init, maxiter=None, simplex_step=None,
+             deadline=None, maxfev=None, curve=None, curve_tol=None,
+             T_tol=None, window=None, recorder=None):
+    '''Nelder-Mead minimization of the residual function, as used
+    by run_fit_*
+
+    residual     = function of param, returning scalar
+    param_init   = initial values, [T, c1, c2, ...]
+    maxiter      = maximum number of iterations (optional)
+    simplex_step = step for the initial simplex (see initial_simplex),
+                   small steps are suited to warm starts close to the
+                   optimum (optional, default is the scipy simplex)
+    deadline     = wall-clock time allowed for the fit, in seconds
+                   (optional)
+    maxfev       = maximum number of evaluations of the residual
+                   (optional)
+    curve        = function of param returning the correction curve on
+                   the x-axis, required for curve_tol
+    curve_tol    = stop when the curves of all param evaluated in the
+                   last window iterations differ from the curve of the
+                   best param by less than curve_tol, relative to its
+                   maximum (optional, for example 1e-5). As for xatol,
+                   this is a measure of the size of the simplex, here
+                   in the space of the correction curve
+    T_tol        = with curve_tol, T of the same param must also be
+                   within T_tol of the best (optional)
+    window       = number of iterations for curve_tol and T_tol
+                   (default : number of param + 1)
+    recorder     = fit_trace.TraceRecorder, records every iteration and
+                   the result (optional)
+
+    When the deadline or maxfev is reached, the best parameters found so
+    far are returned with res.success = False. When the criterion on the
+    curve is met, the best parameters are returned with
+    res.success = True.
+
+    returns => OptimizeResult, with in addition
+                 trace   = array (nit, 4) : iteration, number of
+                           evaluations, elapsed time (s) and best residual
+                 elapsed = time of the fit (s) '''
+
+    options = {'xatol': xatol, 'fatol': fatol}
+    if maxiter is not None:
+        options['maxiter'] = maxiter
+    if maxfev is not None:
+        options['maxfev'] = maxfev
+    if simplex_step is not None:
+        options['initial_simplex'] = initial_simplex(param_init,
+                                                     simplex_step)
+
+    if curve_tol is not None and curve is None:
+        raise ValueError('curve is required for curve_tol')
+    if window is None:
+        window = len(param_init) + 1
+
+    tracker = _Tracker(residual, deadline, curve, curve_tol, T_tol, window,
+                       recorder)
+    if recorder is not None:
+        recorder.start(getattr(residual, '__name__', 'fit'))
+    try:
+        # self time of 'fit' is the overhead of the optimizer
+        with utils.MeasureBlockTime('fit', no_print=True):
+            res = opt.minimize(tracker, param_init, method='Nelder-Mead',
+                               options=options, callback=tracker.callback)
+    except _DeadlineReached:
+        if tracker.best_x is None:
+            tracker.best_x = np.array(param_init, dtype=np.float64)
+        res = opt.OptimizeResult(x=tracker.best_x, fun=tracker.best_fun,
+                                 nit=tracker.nit, nfev=tracker.nfev,
+                                 success=False, status=-1,
+                                 message=deadline_message)
+    except _CurveConverged:
+        res = opt.OptimizeResult(x=tracker.best_x, fun=tracker.best_fun,
+                                 nit=tracker.nit, nfev=tracker.nfev,
+                                 success=True, status=0,
+                                 message=curve_message)
+
+    res.trace = np.array(tracker.trace).reshape(-1, 4)
+    res.elapsed = time.perf_counter() - tracker.start
+    if recorder is not None:
+        recorder.finish(res)
+    return res
+
+# ------------------------------------------------------
+
+
+def jacobian(func, param, rel_step=1e-6):
+    '''Jacobian of the vector function func at param, by central
+    differences. func is called once with the 2D array of the 2n
+    displaced param (as for the batched residuals of
+    CalibrationProblem).
+
+    returns => array (k, n) '''
+
+    param = np.asarray(param, dtype=np.float64)
+    n = param.shape[0]
+    h = rel_step * np.maximum(np.abs(param), 1e-3)
+
+    displaced = np.tile(param, (2 * n, 1))
+    displaced[np.arange(n), np.arange(n)] += h
+    displaced[n + np.arange(n), np.arange(n)] -= h
+
+    f = np.asarray(func(displaced))
+    return ((f[:n] - f[n:]) / (2 * h[:, None])).T
+
+# ------------------------------------------------------
+
+
+def covariance(func, param, rel_step=1e-6):
+    '''Linearized covariance of param at the optimum of the sum of
+    squares of the vector function func (residual vector),
+
+        cov = s2 * inv(J.T J),    s2 = sum(r**2) / (k - n)
+
+    For the norms other than frobenius_square, this is the covariance of
+    the equivalent least squares problem.
+
+    returns => dict with cov, stderr, s2 and dof '''
+
+    param = np.asarray(param, dtype=np.float64)
+    r = np.asarray(func(param[None, :]))[0]
+    J = jacobian(func, param, rel_step)
+
+    dof = max(r.shape[0] - param.shape[0], 1)
+    s2 = float(np.dot(r, r)) / dof
+    cov = s2 * np.linalg.pinv(J.T @ J)
+
+    return {'cov': cov,
+            'stderr': np.sqrt(np.maximum(np.diag(cov), 0.0)),
+            's2': s2,
+            'dof': dof}
+
+# ------------------------------------------------------
@@ -9,7 +9,11 @@ as a model function"""
 import numpy as np
 import math
 import compute_spectra
-import scipy.optimize as opt
+import sensitivity_basis
+import fit_utils
+import fit_trace
+import ensemble_sampler
+import utils
 import logging
 from datetime import datetime
 
@@ -65,6 +69,26 @@ norm =  'Frobenius'
 # if norm is not set then the default is sum of absolute values 
 # See readme for more details
 
+# ----------------------------------------
+
+# basis of the polynomial for the sensitivity
+# available bases : monomial, chebyshev, legendre
+#   monomial  : terms are x**k / scale_k (scale1 to scale4)
+#   chebyshev, legendre : the range of the band positions (domain) is
+#               mapped to [-1, 1], no scale factors are required
+# In every basis, the sensitivity is 1 at x = 0 (see sensitivity_basis.py)
+# Do not change the variable name on the LHS
+
+basis = 'monomial'
+
+# range of the band positions (does not depend on T)
+domain = sensitivity_basis.band_domain(
+    compute_spectra.spectra_H2(300, H2_aSJmax, H2_SJmax),
+    compute_spectra.spectra_HD(300, HD_aSJmax, HD_SJmax),
+    compute_spectra.spectra_D2(300, D2_aSJmax, D2_SJmax))
+
+# ----------------------------------------
+
 
 # these are used for scaling the weights for O2 as needed
 # Do not change the variable name on the LHS 
@@ -223,6 +247,7 @@ log.info('\t\t Scaling factor (O2 pure rotation):\t %s\n', scale_O2_pureRotn )
 #------------------------------------------------
 #                COMMON FUNCTIONS
 #------------------------------------------------
+@utils.timed('ratio matrix')
 def gen_intensity_mat (arr, index):
     """To obtain the intensity matrix for the numerator or denominator\
         in the Intensity ratio matrix
@@ -281,9 +306,34 @@ def inverse_square(array):
 
 #------------------------------------------------
 
+def gen_curve(param, x=None):
+    '''Correction curve (C2) for param = [T, c1, ...] on the x-axis x
+    (default : xaxis), in the basis set above'''
+
+    if x is None:
+        x = xaxis
+    scales = [scale1, scale2, scale3, scale4]
+    return sensitivity_basis.curve(param[1:], x, basis, scales, 0.0, domain)
+
+#------------------------------------------------
+
+@utils.timed('S-matrix')
+def gen_s_basis(computed_data, param):
+    '''Generates the S-matrix for any degree and basis, using
+    gen_curve'''
+
+    s = gen_curve(param, computed_data[:, 1])
+    return s[:, None] / s[None, :]
+
+#------------------------------------------------
+
+@utils.timed('S-matrix')
 def gen_s_linear(computed_data, param ):
     '''Generates the S-matrix assuming linear function 
     for the wavelength dependent sensitivity'''
+
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
     
     mat=np.zeros((computed_data.shape[0],computed_data.shape[0]))
     #print(mat.shape)
@@ -302,9 +352,13 @@ def gen_s_linear(computed_data, param ):
     return mat
 
 #------------------------------------------------
+@utils.timed('S-matrix')
 def gen_s_quadratic(computed_data, param ):
     '''Generates the S-matrix assuming quadratic function 
     for the wavelength dependent sensitivity'''
+
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
     mat=np.zeros((computed_data.shape[0],computed_data.shape[0]))
     #print(mat.shape)
 
@@ -323,9 +377,13 @@ def gen_s_quadratic(computed_data, param ):
     return mat
 
 #------------------------------------------------
+@utils.timed('S-matrix')
 def gen_s_cubic(computed_data, param ):
     '''Generates the S-matrix assuming cubic function 
     for the wavelength dependent sensitivity'''
+
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
         
     mat=np.zeros((computed_data.shape[0],computed_data.shape[0]))
     #print(mat.shape)
@@ -348,10 +406,14 @@ def gen_s_cubic(computed_data, param ):
     return mat
 
 #------------------------------------------------
+@utils.timed('S-matrix')
 def gen_s_quartic(computed_data, param, scale1):
     '''Generates the S-matrix assuming quartic function 
     for the wavelength dependent sensitivity'''    
-    
+
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
+
     mat=np.zeros((computed_data.shape[0],computed_data.shape[0]))
     #print(mat.shape)
 
@@ -408,10 +470,31 @@ log.info('================================================' )
 
 # ----------------------------------------
 
+@utils.timed('norm')
+def residual_norm(eD2, eHD, eH2, resd_O2, resd_O2p):
+    '''Residual from the residual matrices of D2, HD and H2 and the
+    residuals of O2, using the norm set above'''
+
+    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
+        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) +\
+            np.sum(np.abs(eH2)) +    np.sum(np.abs(resd_O2))  + np.sum(resd_O2p)
+
+    elif norm.lower()=='frobenius' or norm =='F'  :
+        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) +\
+            np.sqrt(np.sum(np.square(eH2))) +   np.sqrt(np.sum(np.abs(resd_O2)))  +\
+        np.sqrt(np.sum(resd_O2p))
+
+    elif norm.lower()=='frobenius_square' or norm =='FS' :
+        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD)) +\
+            np.sum(np.square(eH2)) +  np.sum(np.square(resd_O2))  + np.sum(np.square(resd_O2p))
+
+    return E
+
 #*******************************************************************
 # The residual functions are defined below
 #*******************************************************************
 
+@utils.timed('residual')
 def residual_linear(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -420,6 +503,7 @@ def residual_linear(param):
     param : T, c1
 
     '''
+
     #TK = param[0]
     TK = param[0]
     #c1 = param[1]
@@ -471,38 +555,33 @@ def residual_linear(param):
     
 	# - O2 high frequency : 1400 to 1700 cm-1
     ratio_O2 = dataO2[:, 1]/dataO2[:, 2]
-    RHS_O2 = (1.0 + param[0]/scale1 * dataO2[:, 3] )/ (1.0 +\
-             param[0]/scale1 * dataO2[:, 4] )
+    RHS_O2 = (1.0 + param[1]/scale1 * dataO2[:, 3] )/ (1.0 +\
+             param[1]/scale1 * dataO2[:, 4] )
+    if basis != 'monomial':
+        RHS_O2 = gen_curve(param, dataO2[:, 3]) / gen_curve(param, dataO2[:, 4])
     resd_O2 = ( dataO2[:, 5] * scale_O2_S1O1 ) * ((ratio_O2 - RHS_O2)**2)
 	# ------
 
 
     # - O2 pure rotation : -150 to +150 cm-1
     ratio_O2p = dataO2_p[:, 1]/dataO2_p[:, 2]
-    RHS_O2p = (1.0 + param[0]/scale1 * dataO2_p[:, 3] )/ (1.0 +\
-             param[0]/scale1 * dataO2_p[:, 4] )
+    RHS_O2p = (1.0 + param[1]/scale1 * dataO2_p[:, 3] )/ (1.0 +\
+             param[1]/scale1 * dataO2_p[:, 4] )
+    if basis != 'monomial':
+        RHS_O2p = gen_curve(param, dataO2_p[:, 3]) / \
+            gen_curve(param, dataO2_p[:, 4])
     resd_O2p = (dataO2_p[:, 5] * scale_O2_pureRotn ) * ((ratio_O2p - RHS_O2p)**2)
 	# ------
 
 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) +\
-            np.sum(np.abs(eH2)) +    np.sum(np.abs(resd_O2))  + np.sum(resd_O2p)    
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) +\
-            np.sqrt(np.sum(np.square(eH2))) +   np.sqrt(np.sum(np.abs(resd_O2)))  +\
-        np.sqrt(np.sum(resd_O2p))
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD)) +\
-            np.sum(np.square(eH2)) +  np.sum(np.square(resd_O2))  + np.sum(np.square(resd_O2p))     
+    E = residual_norm(eD2, eHD, eH2, resd_O2, resd_O2p)
 
     return(E)
 
 #*******************************************************************
 #*******************************************************************
 
+@utils.timed('residual')
 def residual_quadratic(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -554,8 +633,8 @@ def residual_quadratic(param):
     eH2=clean_mat(eH2)
 
     # oxygen----------------------------
-    c1=param[0]
-    c2=param[1]
+    c1=param[1]
+    c2=param[2]
 
 
     # oxygen----------------------------
@@ -568,6 +647,8 @@ def residual_quadratic(param):
     RHS_O2 = (1.0 + c1/scale1 * dataO2[:, 3] + c2/scale2 * (dataO2[:, 3]**2))/ (1.0 +\
              c1/scale1 * dataO2[:, 4] + c2/scale2 * (dataO2[:, 4]**2))
 
+    if basis != 'monomial':
+        RHS_O2 = gen_curve(param, dataO2[:, 3]) / gen_curve(param, dataO2[:, 4])
     resd_O2 = (dataO2[:, 5] * scale_O2_S1O1 ) * ((ratio_O2 - RHS_O2)**2)
 	# ------
 
@@ -577,27 +658,20 @@ def residual_quadratic(param):
              c1/scale1 * dataO2_p[:, 4] + c2/scale2 * (dataO2_p[:, 4]**2))
 
 
+    if basis != 'monomial':
+        RHS_O2p = gen_curve(param, dataO2_p[:, 3]) / \
+            gen_curve(param, dataO2_p[:, 4])
     resd_O2p = (dataO2_p[:, 5]* scale_O2_pureRotn ) * ((ratio_O2p - RHS_O2p)**2)
 	# ------
 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) +\
-            np.sum(np.abs(eH2)) +    np.sum(np.abs(resd_O2))  + np.sum(resd_O2p)    
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) +\
-            np.sqrt(np.sum(np.square(eH2))) +   np.sqrt(np.sum(np.abs(resd_O2)))  +\
-        np.sqrt(np.sum(resd_O2p))
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD)) +\
-            np.sum(np.square(eH2)) +  np.sum(np.square(resd_O2))  + np.sum(np.square(resd_O2p))       
+    E = residual_norm(eD2, eHD, eH2, resd_O2, resd_O2p)
 
     return(E)
 
 #*******************************************************************
 #*******************************************************************
 
+@utils.timed('residual')
 def residual_cubic(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -650,9 +724,9 @@ def residual_cubic(param):
 
 
     # oxygen----------------------------
-    c1=param[0]
-    c2=param[1]
-    c3=param[2]
+    c1=param[1]
+    c2=param[2]
+    c3=param[3]
 
 
     # oxygen----------------------------
@@ -666,6 +740,8 @@ def residual_cubic(param):
               c3/scale3 * (dataO2[:, 3]**3))/ ( 1.0 + c1/scale1 * dataO2[:, 4] +\
                           c2/scale2 *(dataO2[:, 4]**2)+ c3/scale3 *( dataO2[:, 4]**3))
 
+    if basis != 'monomial':
+        RHS_O2 = gen_curve(param, dataO2[:, 3]) / gen_curve(param, dataO2[:, 4])
     resd_O2 =( dataO2[:, 5]  * scale_O2_S1O1 ) * ((ratio_O2 - RHS_O2)**2)
 	# ------
 
@@ -675,34 +751,187 @@ def residual_cubic(param):
                c3/scale3 * (dataO2_p[:, 3]**3))/ ( 1.0 + c1/scale1 * dataO2_p[:, 4] +\
                            c2/scale2 * (dataO2_p[:, 4]**2)+ c3/scale3 * ( dataO2_p[:, 4]**3))
 
+    if basis != 'monomial':
+        RHS_O2p = gen_curve(param, dataO2_p[:, 3]) / \
+            gen_curve(param, dataO2_p[:, 4])
     resd_O2p = (dataO2_p[:, 5] * scale_O2_pureRotn  ) * ((ratio_O2p - RHS_O2p)**2)
 	# ------
 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) +\
-            np.sum(np.abs(eH2)) +    np.sum(np.abs(resd_O2))  + np.sum(resd_O2p)    
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) +\
-            np.sqrt(np.sum(np.square(eH2))) +   np.sqrt(np.sum(np.abs(resd_O2)))  +\
-        np.sqrt(np.sum(resd_O2p))
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD)) +\
-            np.sum(np.square(eH2)) +  np.sum(np.square(resd_O2))  + np.sum(np.square(resd_O2p))      
-
+    E = residual_norm(eD2, eHD, eH2, resd_O2, resd_O2p)
 
     return(E)
 
+#***************************************************************
+
+def _O2_elements(c, data, factor):
+    '''Elements of the O2 part of the residuals, for coefs c (n, degree),
+    c = param[:, 1:], in the basis set above'''
+
+    scales = [scale1, scale2, scale3, scale4]
+    degree = c.shape[1]
+    num = 1.0 + c @ sensitivity_basis.terms(data[:, 3], degree, basis, scales,
+                                           0.0, domain).T
+    den = 1.0 + c @ sensitivity_basis.terms(data[:, 4], degree, basis, scales,
+                                           0.0, domain).T
+    ratio = data[:, 1] / data[:, 2]
+    return (data[:, 5] * factor) * ((ratio - num / den)**2)
+
+
+# temperatures (K) used to obtain the coefficients of ln I = a + b/T of
+# the computed bands (see residual_vector)
+T_ref = (250.0, 350.0)
+
+
+def _lnI_coefs(spectra, aSJmax, SJmax):
+    '''Coefficients a and b of ln I = a + b/T of the computed bands,
+    up to a term common to the species (sum of states, normalization),
+    which cancels in the ratios. T enters the intensities only through
+    the Boltzmann factor.
+
+    returns => a, b, positions '''
+
+    T1, T2 = T_ref
+    s1 = spectra(T1, aSJmax, SJmax)
+    s2 = spectra(T2, aSJmax, SJmax)
+    l1 = np.log(s1[:, 2])
+    l2 = np.log(s2[:, 2])
+    b = (l1 - l2) / (1.0 / T1 - 1.0 / T2)
+    return l1 - b / T1, b, s1[:, 1]
+
+
+def residual_vector(param):
+    '''Residual elements (lower triangular parts of the residual matrices
+    of D2, HD and H2, followed by the O2 terms) for a batch of param,
+    (n, degree + 1), evaluated without loops over param. The sum of
+    their squares is the residual with the frobenius_square norm, of
+    any degree.
+
+    returns => array (n, number of elements), see
+               fit_utils.covariance '''
+
+    param = np.atleast_2d(np.asarray(param, dtype=np.float64))
+    degree = param.shape[1] - 1
+    T = param[:, :1]
+    c = param[:, 1:]
+    scales = [scale1, scale2, scale3, scale4]
+    data = ((dataD2, wMat_D2, D2_aSJmax, D2_SJmax, compute_spectra.spectra_D2),
+            (dataHD, wMat_HD, HD_aSJmax, HD_SJmax, compute_spectra.spectra_HD),
+            (dataH2, wMat_H2, H2_aSJmax, H2_SJmax, compute_spectra.spectra_H2))
+
+    elements = []
+    for expt, weight, aSJmax, SJmax, spectra in data:
+        a, b, positions = _lnI_coefs(spectra, aSJmax, SJmax)
+        n = positions.shape[0]
+        rows, cols = np.tril_indices(n, k=-1)
+
+        # experimental / computed ratio of the pairs, (n_param, n_pairs)
+        expt_ratio = expt[rows, 0] / expt[cols, 0]
+        I = expt_ratio * np.exp(a[cols] - a[rows]
+                                + (b[cols] - b[rows]) / T)
+
+        # sensitivity of the bands, (n_param, n)
+        s = 1.0 + c @ sensitivity_basis.terms(positions, degree, basis,
+                                               scales, 0.0, domain).T
+        w = np.broadcast_to(weight, (n, n))[rows, cols]
+        elements.append(w * I - s[:, rows] / s[:, cols])
+
+    return np.concatenate(elements
+                          + [_O2_elements(c, dataO2, scale_O2_S1O1),
+                             _O2_elements(c, dataO2_p, scale_O2_pureRotn)],
+                          axis=1)
+
+
+def log_likelihood(param, s2=1.0):
+    '''Gaussian log likelihood from the residual elements (see
+    residual_vector), -0.5 * sum(r**2) / s2, with a flat prior for T > 0
+
+    s2 = variance of the residual elements, for example the residual
+         variance at the optimum (see fit_utils.covariance)
+
+    returns => vector (m) for a 2D array of param '''
+
+    param = np.atleast_2d(np.asarray(param, dtype=np.float64))
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        r = residual_vector(param)
+        out = -0.5 * np.sum(np.square(r), axis=-1) / s2
+    ok = (param[:, 0] > 0) & np.isfinite(out)
+    return np.where(ok, out, -np.inf)
+
+
+def add_covariance(res):
+    """Add the linearized covariance of [T, c1, ...] at the optimum to
+    the result of a fit (see fit_utils.covariance and residual_vector)
+
+        res.cov       = covariance matrix
+        res.stderr    = standard errors of T, c1, ...
+        res.curve_std = standard error of the correction curve on xaxis """
+
+    out = fit_utils.covariance(residual_vector, res.x)
+    res.cov = out['cov']
+    res.stderr = out['stderr']
+
+    degree = res.x.shape[0] - 1
+    B = sensitivity_basis.terms(xaxis, degree, basis,
+                                [scale1, scale2, scale3, scale4], 0.0, domain)
+    C = res.cov[1:, 1:]
+    res.curve_std = np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', B, C, B),
+                                       0.0))
+
+    print("\nStandard errors : T = {0}, coefs = {1}".format(
+        round(res.stderr[0], 6), np.round(res.stderr[1:], 6)))
+    print("\tmaximum std. error of the curve = {0}".format(
+        np.amax(res.curve_std)))
+    log.info('\n Standard errors : T = %4.6f, coefs = %s\n', res.stderr[0],
+             res.stderr[1:])
+
+#***************************************************************
+
+
+def export_model(res, name):
+    """Save the optimized T and coefs as a compact correction model
+    (correction_<name>_model.npz), which can be evaluated on any x-axis
+    (see calibration_tools/correction_model.py)
+
+    res  = OptimizeResult from the fit, res.x = [T, c1, c2, ...]
+    name = linear, quadratic or cubic """
+
+    degree = res.x.shape[0] - 1
+    scales = np.array([scale1, scale2, scale3, scale4])[:degree]
+
+    np.savez("correction_{}_model.npz".format(name), coefs=res.x[1:],
+             scales=scales, scenter=0.0, temperature=res.x[0],
+             basis=basis, domain=domain, residual=res.fun,
+             cov=getattr(res, 'cov', np.nan),
+             stderr=getattr(res, 'stderr', np.nan))
+
+
+# results of the last fit of each degree (OptimizeResult, with the
+# convergence trace, see fit_utils.minimize)
+fit_results = {}
+
+# every iteration of the fits is recorded (see fit_trace.py), for example
+#  trace_recorder.write_jsonl('fit_trace.jsonl')
+#  trace_recorder.write_prometheus('c2_fit.prom')
+trace_recorder = fit_trace.TraceRecorder()
+
 #***************************************************************
 #***************************************************************
 # Fit functions
 #***************************************************************
 #***************************************************************
 
-def run_fit_linear ( init_T, init_k1 ):
+@utils.profiled
+def run_fit_linear ( init_T, init_k1, **fit_options ):
     '''Function performing the actual fit using the residual_linear function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve).
+                  When the deadline or maxfev is reached, the best
+                  result so far is kept with success = False.
+                  The result is kept in fit_results '''
 
     # init_k1 : Intial guess
 
@@ -715,18 +944,24 @@ def run_fit_linear ( init_T, init_k1 ):
 
 
     print("\nOptimization run     \n")
-    res = opt.minimize(residual_linear, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9})
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_linear, param_init, **fit_options)
+    fit_results['linear'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     print("\nOptimized result : T={0}, k1={1} \n".format(round(optT, 6) ,  round(optk1, 6) ))
 
-    correction_curve_line= 1+(optk1/scale1)*xaxis     # generate the correction curve
+    correction_curve_line = gen_curve(res.x)   # generate the correction curve
 
     np.savetxt("correction_linear.txt", correction_curve_line, fmt='%2.8f',\
                header='corrn_curve_linear', comments='')
+    export_model(res, "linear")
 
     print("**********************************************************")
     print("\n C2 correction curve (as linear polynomial) saved as correction_linear.txt\n")
@@ -742,9 +977,18 @@ def run_fit_linear ( init_T, init_k1 ):
 #***************************************************************
 #***************************************************************
 
-def run_fit_quadratic ( init_T, init_k1, init_k2 ):
+@utils.profiled
+def run_fit_quadratic ( init_T, init_k1, init_k2, **fit_options ):
     '''Function performing the actual fit using the residual_linear function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve).
+                  When the deadline or maxfev is reached, the best
+                  result so far is kept with success = False.
+                  The result is kept in fit_results '''
 
     # init_k1 : Intial guess
 
@@ -757,19 +1001,25 @@ def run_fit_quadratic ( init_T, init_k1, init_k2 ):
 
 
     print("\nOptimization run     \n")
-    res = opt.minimize(residual_quadratic, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9})
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_quadratic, param_init, **fit_options)
+    fit_results['quadratic'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     optk2 = res.x[2]
     print("\nOptimized result : T={0}, k1={1}, k2={2} \n".format(round(optT, 6) ,  round(optk1, 6), round(optk2, 6) ))
 
-    correction_curve_line= 1+(optk1/scale1)*xaxis  +(optk2/scale2)*xaxis**2    # generate the correction curve
+    correction_curve_line = gen_curve(res.x)   # generate the correction curve
 
     np.savetxt("correction_quadratic.txt", correction_curve_line, fmt='%2.8f',\
                header='corrn_curve_quadratic', comments='')
+    export_model(res, "quadratic")
     print("\n C2 correction curve (as quadratic polynomial) saved as quadratic_cubic.txt\n")
     print("**********************************************************")
     # save log -----------
@@ -783,9 +1033,18 @@ def run_fit_quadratic ( init_T, init_k1, init_k2 ):
 #***************************************************************
 
 
-def run_fit_cubic ( init_T, init_k1, init_k2, init_k3 ):
+@utils.profiled
+def run_fit_cubic ( init_T, init_k1, init_k2, init_k3, **fit_options ):
     '''Function performing the actual fit using the residual_linear function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve).
+                  When the deadline or maxfev is reached, the best
+                  result so far is kept with success = False.
+                  The result is kept in fit_results '''
 
     # init_k1 : Intial guess
 
@@ -798,21 +1057,26 @@ def run_fit_cubic ( init_T, init_k1, init_k2, init_k3 ):
 
 
     print("\nOptimization run     \n")
-    res = opt.minimize(residual_cubic, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9})
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_cubic, param_init, **fit_options)
+    fit_results['cubic'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     optk2 = res.x[2]
     optk3 = res.x[3]
     print("\nOptimized result : T={0}, k1={1}, k2={2} \n".format(round(optT, 6) ,  round(optk1, 6), round(optk2, 6) ))
 
-    correction_curve_line= 1+(optk1/scale1)*xaxis  +(optk2/scale2)*xaxis**2  +\
-        +(optk3/scale3)*xaxis**3 # generate the correction curve
+    correction_curve_line = gen_curve(res.x)   # generate the correction curve
 
     np.savetxt("correction_cubic.txt", correction_curve_line, fmt='%2.8f',\
                header='corrn_curve_cubic', comments='')
+    export_model(res, "cubic")
     print("\n C2 correction curve (as cubic polynomial) saved as correction_cubic.txt\n")
     print("**********************************************************")
     # save log -----------
@@ -823,3 +1087,62 @@ def run_fit_cubic ( init_T, init_k1, init_k2, init_k3 ):
     log.info(' *******************************************')
     # -------------------- 
 #***************************************************************
+
+def run_sampler(degree, n_walkers=32, n_steps=5000, burn=None,
+                checkpoint=None, seed=None):
+    '''Posterior of T and the coefs for the polynomial of the given
+    degree (1 to 3, run the fit first), using the affine-invariant
+    ensemble sampler (see ensemble_sampler.py). The log likelihood is
+    obtained from the residual elements (see residual_vector), scaled by
+    the residual variance at the optimum.
+
+    n_walkers  = number of walkers (even, at least 2*(degree+1))
+    n_steps    = total number of steps
+    burn       = steps removed at the start (default : n_steps // 4)
+    checkpoint = filename (npz) for saving the chain, a repeated call
+                 with the same file resumes the run
+
+    returns => dict with samples, mean, std, corr (correlation matrix),
+               acceptance and tau (autocorrelation time, in steps) '''
+
+    name = {1: 'linear', 2: 'quadratic', 3: 'cubic'}[degree]
+    if name not in fit_results:
+        raise ValueError('Run the {0} fit first'.format(name))
+
+    popt = fit_results[name].x
+    cov = fit_utils.covariance(residual_vector, popt)
+
+    def log_prob(param):
+        return log_likelihood(param, cov['s2'])
+
+    sampler = ensemble_sampler.EnsembleSampler(
+        log_prob, n_walkers, degree + 1, seed=seed, checkpoint=checkpoint)
+
+    # start in a small ball around the optimum
+    rng = np.random.default_rng(seed)
+    p0 = popt + 1e-2 * cov['stderr'] * rng.standard_normal(
+        (n_walkers, degree + 1))
+    sampler.run(p0, n_steps)
+
+    if burn is None:
+        burn = n_steps // 4
+    samples = sampler.samples(burn)
+    out = {'samples': samples,
+           'mean': np.mean(samples, axis=0),
+           'std': np.std(samples, axis=0, ddof=1),
+           'corr': np.corrcoef(samples, rowvar=False),
+           'acceptance': float(np.mean(sampler.acceptance_fraction)),
+           'tau': ensemble_sampler.autocorr_time(sampler.chain[burn:])}
+
+    print("\nPosterior ({0}, {1} walkers x {2} steps) : T = {3} +/- {4}"
+          .format(name, n_walkers, n_steps, round(out['mean'][0], 4),
+                  round(out['std'][0], 4)))
+    print("\tacceptance = {0}, autocorrelation time = {1}".format(
+        round(out['acceptance'], 3), np.round(out['tau'], 1)))
+    log.info('\n *******  Posterior : %s  *******', name)
+    log.info('\n\t mean = %s\n\t std = %s\n\t corr = %s\n', out['mean'],
+             out['std'], out['corr'])
+    log.info(' *******************************************')
+    return out
+
+#***************************************************************
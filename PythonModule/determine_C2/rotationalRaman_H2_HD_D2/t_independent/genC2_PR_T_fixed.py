@@ -720,6 +720,7 @@ def residual_cubic_TF(param):
 #***************************************************************
 #***************************************************************
 
+@utils.profiled
 def run_fit_linear_TF ( init_k1 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -761,6 +762,7 @@ def run_fit_linear_TF ( init_k1 ):
 
 #***************************************************************
 
+@utils.profiled
 def run_fit_quadratic_TF ( init_k1, init_k2 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -805,6 +807,7 @@ def run_fit_quadratic_TF ( init_k1, init_k2 ):
 #***************************************************************
 
 
+@utils.profiled
 def run_fit_cubic_TF ( init_k1, init_k2, init_k3 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
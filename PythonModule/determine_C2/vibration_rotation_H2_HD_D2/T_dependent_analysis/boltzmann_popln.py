@@ -1,5 +1,7 @@
+import os
 import numpy as np
 import math
+from common import utils
 # Constants ------------------------------
 K = np.float64(1.38064852e-23)   # J/K
 H = np.float64(6.626070040e-34)  # J.s
@@ -9,9 +11,13 @@ C = np.float64(2.99792458e+10)   # cm/s
 ##################################
 ############ COMMON ##############
 
-eJH2 = np.genfromtxt("./energy_levels/H2.dat", delimiter="\t")
-eJHD = np.genfromtxt("./energy_levels/HD.dat", delimiter="\t")
-eJD2 = np.genfromtxt("./energy_levels/D2.dat", delimiter="\t")
+# the data are read relative to this module (it may be imported from
+# another directory)
+_dir = os.path.dirname(os.path.abspath(__file__))
+
+eJH2 = np.genfromtxt(os.path.join(_dir, "energy_levels", "H2.dat"), delimiter="\t")
+eJHD = np.genfromtxt(os.path.join(_dir, "energy_levels", "HD.dat"), delimiter="\t")
+eJD2 = np.genfromtxt(os.path.join(_dir, "energy_levels", "D2.dat"), delimiter="\t")
 
 
 #********************************************************************
@@ -26,6 +32,7 @@ eJD2 = np.genfromtxt("./energy_levels/D2.dat", delimiter="\t")
 #   its isotopologues at given temperature.
 # Data on energy levels is needed for the specific molecule
 
+@utils.timed('partition function')
 def sumofstate_H2(T):
     """calculate the sum of state for H2 molecule at T """
 
@@ -79,6 +86,7 @@ def sumofstate_H2(T):
 # compute the temperature dependent sum of state for HD which includes contributions
 # from the ground and first vibrational state of electronic ground state.
 
+@utils.timed('partition function')
 def sumofstate_HD(T):
     """calculate the sum of state for HD molecule at T """
 
@@ -130,6 +138,7 @@ def sumofstate_HD(T):
 # compute the temperature dependent sum of state for D2 which includes contributions
 # from the ground and first vibrational state of electronic ground state.
 
+@utils.timed('partition function')
 def sumofstate_D2(T):
     """calculate the sum of state for D2 molecule at T """
 
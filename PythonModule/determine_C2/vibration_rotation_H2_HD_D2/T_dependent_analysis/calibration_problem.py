@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module describing the optimization problem of genC2_VR_T_dep_para and
+genC2_VR_T_dep_perp as an object holding its own data, so that the
+residual can be evaluated without the module level variables and the
+band areas can be updated in memory.
+
+The temperature enters the computed intensities only through the
+Boltzmann factor, exp(-E/kT), and the sum of states which is common to
+all bands of a species (cancels in the ratios). Hence, for every band,
+
+        ln I(T) = a + b/T  + (term common to the species)
+
+a and b are obtained once from the computed spectra at two temperatures
+(compute_series_para or compute_series_perp), after which the ratios of
+the computed intensities at any T, and the residual for a batch of
+parameters, are obtained using array operations."""
+
+import numpy as np
+
+import compute_series_para
+import compute_series_perp
+import boltzmann_popln as bp
+from common import utils
+
+import fit_utils
+import sensitivity_basis
+
+# ------------------------------------------------------
+
+# default indices for OJ, QJ (and SJ) of the bands, as in the genC2 modules
+default_J = {'H2': (3, 4), 'HD': (3, 3, 2), 'D2': (4, 6, 3)}
+
+# temperatures (K) used to obtain the coefficients a and b
+T_ref = (250.0, 350.0)
+
+_sumofstate = {'H2': bp.sumofstate_H2, 'HD': bp.sumofstate_HD,
+               'D2': bp.sumofstate_D2}
+
+# ------------------------------------------------------
+
+
+def computed_spectra(species, T, J, polarization='para'):
+    '''Computed bands of the species at T, as used in the residual
+    functions of genC2_VR_T_dep_para/perp (for perpendicular
+    polarization, the row of Q(J=0) is removed)
+
+    returns => 2D array, columns : J, position, intensity, abs_wavenum'''
+
+    if polarization == 'para':
+        module = compute_series_para
+    elif polarization == 'perp':
+        module = compute_series_perp
+    else:
+        raise ValueError("polarization should be 'para' or 'perp'")
+
+    sos = _sumofstate[species](T)
+    if species == 'H2':
+        out = module.spectra_H2_c(T, J[0], J[1], sos)
+    elif species == 'HD':
+        out = module.spectra_HD(T, J[0], J[1], J[2], sos)
+    elif species == 'D2':
+        out = module.spectra_D2(T, J[0], J[1], J[2], sos)
+    else:
+        raise ValueError('species should be H2, HD or D2')
+
+    if polarization == 'perp':
+        i, = np.where(out[:, 0] == 0.0)
+        out = np.delete(out, np.amin(i), axis=0)
+    return out
+
+# ------------------------------------------------------
+
+
+def _norm(e, norm):
+    '''norm of the residual matrices e, (..., n, n)'''
+
+    if norm == '' or norm.lower() == 'absolute' or norm in ('a', 'A'):
+        return np.sum(np.abs(e), axis=(-2, -1))
+    if norm.lower() == 'frobenius' or norm == 'F':
+        return np.sqrt(np.sum(np.square(e), axis=(-2, -1)))
+    if norm.lower() == 'frobenius_square' or norm == 'FS':
+        return np.sum(np.square(e), axis=(-2, -1))
+    raise ValueError('Unknown norm : {0}'.format(norm))
+
+# ------------------------------------------------------
+
+
+class CalibrationProblem:
+    '''Weighted ratio problem for the C2 correction with temperature as
+    a fit parameter (see genC2_VR_T_dep_para and genC2_VR_T_dep_perp)
+
+    data         = dict of band areas for 'H2', 'HD' and 'D2', each a 2D
+                   array ( band area | error ) or a vector of band areas,
+                   rows in the same order as the computed spectra
+    degree       = degree of the polynomial (1 to 5)
+    polarization = 'para' or 'perp'
+    J            = dict of (OJ, QJ) for H2 and (OJ, QJ, SJ) for HD and D2
+                   (default : default_J)
+    norm         = 'Frobenius', 'absolute' or 'frobenius_square'
+    scenter      = center of the x-axis
+    scales       = scale1 to scale_degree. When not given, obtained as in
+                   the genC2 modules from xaxis (or the band positions)
+    basis        = 'monomial', 'chebyshev' or 'legendre' (see
+                   sensitivity_basis)
+    domain       = (min, max) mapped to [-1, 1] for the chebyshev and
+                   legendre bases (default : range of the band positions)
+    weighted     = if True, elements are weighted using the errors
+                   (gen_weight), otherwise the weight is 1 as in the
+                   genC2 modules
+    species      = species included in the residual. As in the genC2
+                   modules, the default is D2 and HD '''
+
+    def __init__(self, data, degree, polarization='para', J=None,
+                 norm='Frobenius', scenter=3316.3, scales=None, xaxis=None,
+                 weighted=False, species=('D2', 'HD'), basis='monomial',
+                 domain=None):
+
+        self.degree = int(degree)
+        self.polarization = polarization
+        self.J = dict(default_J, **(J or {}))
+        self.norm = norm
+        self.scenter = float(scenter)
+        self.weighted = weighted
+        self.species = tuple(species)
+        self.basis = basis
+
+        self.positions = {}
+        self.J_values = {}
+        self._a = {}
+        self._b = {}
+        T1, T2 = T_ref
+        for name in self.species:
+            s1 = computed_spectra(name, T1, self.J[name], polarization)
+            s2 = computed_spectra(name, T2, self.J[name], polarization)
+            l1 = np.log(s1[:, 2])
+            l2 = np.log(s2[:, 2])
+            b = (l1 - l2) / (1/T1 - 1/T2)
+            self.positions[name] = s1[:, 1]
+            self.J_values[name] = s1[:, 0]
+            self._b[name] = b
+            self._a[name] = l1 - b / T1
+
+        if scales is None:
+            x = xaxis if xaxis is not None else \
+                np.concatenate([self.positions[n] for n in self.species])
+            magn = np.floor(np.log10(np.amax(np.asarray(x) - self.scenter)))
+            scales = (10**magn)**np.arange(1, self.degree + 1)
+        self.scales = np.asarray(scales, dtype=np.float64)[:self.degree]
+        if domain is None:
+            domain = sensitivity_basis.band_domain(
+                *[np.column_stack((self.J_values[n], self.positions[n]))
+                  for n in self.species])
+        self.domain = tuple(domain)
+
+        n = {name: self.positions[name].shape[0] for name in self.species}
+        self._mask = {name: np.tri(n[name], k=-1, dtype=bool)
+                      for name in self.species}
+        self._v = {name: self.basis_terms(self.positions[name])
+                   for name in self.species}
+
+        self.data = {}
+        self.expt = {}
+        self.weight = {}
+        self.version = 0
+        self.set_data(**data)
+
+    # --------------------------------------------------
+
+    def set_data(self, **data):
+        '''Replace the band areas of the given species, for example
+        set_data(HD=array, D2=array). Only the experimental ratio
+        matrices and weights of these species are regenerated.'''
+
+        for name, arr in data.items():
+            if name not in self.positions:
+                continue
+            arr = np.asarray(arr, dtype=np.float64)
+            if arr.ndim == 1:
+                arr = np.column_stack((arr, np.zeros_like(arr)))
+            if arr.shape[0] != self.positions[name].shape[0]:
+                raise ValueError('Number of bands for {0} ({1}) differs from '
+                                 'the computed spectra ({2})'.format(
+                                     name, arr.shape[0],
+                                     self.positions[name].shape[0]))
+
+            area = arr[:, 0]
+            self.data[name] = arr
+            self.expt[name] = area[:, None] / area[None, :]
+
+            if self.weighted:
+                rel = np.square(arr[:, 1] / area)
+                error_mat = self.expt[name] * np.sqrt(rel[:, None]
+                                                      + rel[None, :])
+                with np.errstate(divide='ignore'):
+                    w = 1 / np.square(error_mat)
+                w[~np.isfinite(w)] = 0.0
+                self.weight[name] = w
+            else:
+                self.weight[name] = 1.0
+
+        missing = [name for name in self.species if name not in self.data]
+        if missing:
+            raise ValueError('Band areas missing for {0}'.format(missing))
+        self.version = self.version + 1
+
+    # --------------------------------------------------
+
+    def computed_ratio(self, name, T):
+        '''Ratio of computed intensities, I(r)/I(c), for the species at
+        temperatures T (scalar or vector)
+
+        returns => array (n, n), or (m, n, n) for vector T'''
+
+        T = np.asarray(T, dtype=np.float64)
+        lnI = self._a[name] + self._b[name] / T[..., None]
+        return np.exp(lnI[..., :, None] - lnI[..., None, :])
+
+    # --------------------------------------------------
+
+    def sensitivity(self, name, coefs):
+        '''Ratio of sensitivity, s(r)/s(c), at the band positions of the
+        species, for coefs (c1, ...) or a 2D array of coefs (m, degree)'''
+
+        p = 1 + np.asarray(coefs, dtype=np.float64) @ self._v[name].T
+        return p[..., :, None] / p[..., None, :]
+
+    # --------------------------------------------------
+
+    def residual_matrices(self, param):
+        '''Weighted residual matrices (lower triangular part) for each
+        species, for param [T, c1, ...] or a 2D array of param (m, n)'''
+
+        param = np.asarray(param, dtype=np.float64)
+        T = param[..., 0]
+        coefs = param[..., 1:]
+
+        out = {}
+        for name in self.species:
+            e = self.expt[name] / self.computed_ratio(name, T) \
+                - self.sensitivity(name, coefs)
+            out[name] = np.where(self._mask[name], e * self.weight[name], 0.0)
+        return out
+
+    # --------------------------------------------------
+
+    def contributions(self, param):
+        '''Contribution of each species to the residual at param, as
+        dict of the norm of its residual matrix'''
+
+        e = self.residual_matrices(param)
+        return {name: float(_norm(e[name], self.norm))
+                for name in self.species}
+
+    # --------------------------------------------------
+
+    @utils.timed('residual (batched)')
+    def residual(self, param):
+        '''Residual of the fit, same definition as residual_<degree> in
+        the genC2_VR_T_dep modules.
+
+        param = [T, c1, ..., c_degree], or 2D array (m, degree+1) to
+                evaluate m sets of parameters at once
+
+        returns => scalar, or vector (m) '''
+
+        E = 0.0
+        for e in self.residual_matrices(param).values():
+            E = E + _norm(e, self.norm)
+        return E
+
+    def __call__(self, param):
+        return self.residual(param)
+
+    # --------------------------------------------------
+
+    def residual_vector(self, param):
+        '''Elements of the weighted residual matrices (lower triangular
+        part) of all species as a single vector, or 2D array (m, k) for
+        a 2D array of param. Used for the Jacobian of the fit.'''
+
+        mats = self.residual_matrices(param)
+        return np.concatenate([mats[name][..., self._mask[name]]
+                               for name in self.species], axis=-1)
+
+    # --------------------------------------------------
+
+    def pair_index(self):
+        '''Species and bands (row, column of the ratio matrix) of every
+        element of residual_vector
+
+        returns => list of (species, row, column) '''
+
+        out = []
+        for name in self.species:
+            rows, cols = np.nonzero(self._mask[name])
+            out.extend((name, r, c) for r, c in zip(rows, cols))
+        return out
+
+    # --------------------------------------------------
+
+    def log_likelihood(self, param, s2=1.0):
+        '''Gaussian log likelihood from the weighted residual elements,
+        -0.5 * sum(r**2) / s2, with a flat prior for T > 0.
+
+        s2 = variance of the residual elements. With weighted=True,
+             s2 = 1 corresponds to the errors of the band areas.
+             Otherwise use the residual variance at the optimum
+             (see covariance)
+
+        returns => scalar, or vector (m) for a 2D array of param '''
+
+        param = np.asarray(param, dtype=np.float64)
+        r = self.residual_vector(param)
+        with np.errstate(invalid='ignore'):
+            out = -0.5 * np.sum(np.square(r), axis=-1) / s2
+        ok = (param[..., 0] > 0) & np.isfinite(out)
+        return np.where(ok, out, -np.inf)
+
+    # --------------------------------------------------
+
+    def basis_terms(self, x):
+        '''Terms t_k of the polynomial on the x-axis, for example
+        ((x-scenter)**k)/scale_k for the monomial basis
+
+        returns => array (len(x), degree) '''
+
+        return sensitivity_basis.terms(x, self.degree, self.basis,
+                                       self.scales, self.scenter, self.domain)
+
+    # --------------------------------------------------
+
+    def curve(self, param, x):
+        '''Correction curve (C2) of param on the x-axis
+
+        param = [T, c1, ...], or 2D array (m, degree+1)
+
+        returns => vector (len(x)), or array (m, len(x)) '''
+
+        return 1 + np.asarray(param, dtype=np.float64)[..., 1:] \
+            @ self.basis_terms(x).T
+
+    # --------------------------------------------------
+
+    def covariance(self, param, rel_step=1e-6):
+        '''Linearized covariance of param at the optimum, from the
+        Jacobian of residual_vector (see fit_utils.covariance)'''
+        return fit_utils.covariance(self.residual_vector, param, rel_step)
+
+    # --------------------------------------------------
+
+    def curve_std(self, cov, x):
+        '''Standard error of the correction curve on the x-axis,
+        propagated from the covariance of param (T does not enter
+        the curve)'''
+
+        B = self.basis_terms(x)
+        C = np.asarray(cov)[1:, 1:]
+        return np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', B, C, B), 0.0))
+
+    # --------------------------------------------------
+
+    def predicted_areas(self, name, param):
+        '''Band areas of the species predicted by param, up to a common
+        factor : computed intensity at T times the sensitivity'''
+
+        param = np.asarray(param, dtype=np.float64)
+        lnI = self._a[name] + self._b[name] / param[0]
+        p = 1 + self._v[name] @ param[1:]
+        return np.exp(lnI - np.amax(lnI)) * p
+
+    # --------------------------------------------------
+
+    def fit(self, param_init, **fit_options):
+        '''Minimize the residual starting from param_init (see
+        fit_utils.minimize for fit_options)
+
+        returns => OptimizeResult '''
+
+        fit_options.setdefault('simplex_step', sensitivity_basis.simplex_step(
+            param_init, self.basis))
+        return fit_utils.minimize(self.residual, param_init, **fit_options)
+
+# ------------------------------------------------------
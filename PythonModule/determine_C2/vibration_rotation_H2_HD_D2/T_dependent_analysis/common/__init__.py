@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Mar 30 11:19:19 2020
+
+@author: ankit
+"""
+
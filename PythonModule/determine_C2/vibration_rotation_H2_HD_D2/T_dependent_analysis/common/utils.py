@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Mar 12 15:31:01 2020
+
+@author: Ankit Raj
+"""
+
+# utils.py
+#
+# MeasureTime, MeasureBlockTime : print the elapsed time of a function or
+#                                 of a block
+#
+# Timings of nested functions and blocks can also be accumulated per label
+# (count, total, self time), see enable_timings. Functions decorated with
+# timed(label), and MeasureTime/MeasureBlockTime, are recorded when enabled.
+# Setting the environment variable C2_TIMINGS enables the timings when the
+# module is imported : C2_TIMINGS=1 prints the table at exit, any other
+# value is the name of the JSON file written at exit ({pid} is replaced
+# by the process id).
+#
+#    enable_timings(True/False), reset_timings()
+#    timing_summary()          : list of dict, one per path of labels
+#    timing_table()            : summary as text table
+#    save_timings(filename)    : summary as JSON
+#    merge_timings(summary)    : add a summary from another process
+#
+# ProfileBlock(name), profiled : cProfile and tracemalloc for a block or
+#                                for a call with profile=True, see below
+#
+# The same file is copied in every directory using it (the modules are run
+# from their directory) : determine_C0_C1_correction/,
+# determine_C2/rotationalRaman_H2_HD_D2/t_dependent/ and t_independent/,
+# determine_C2/vibration_rotation_H2_HD_D2/common_rotational_state/ and
+# common_rotational_state/common/, and
+# determine_C2/vibration_rotation_H2_HD_D2/T_dependent_analysis/common/.
+# Keep the copies identical (md5sum of the six files).
+
+from functools import wraps
+import gc
+import os
+import sys
+import json
+import atexit
+import tempfile
+import threading
+import timeit
+import cProfile
+import pstats
+import tracemalloc
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {}               # path (tuple of labels) -> [count, total, child, min, max]
+_pid = os.getpid()
+
+# ------------------------------------------------------
+
+
+def enable_timings(flag=True):
+    '''Enable (or disable) recording of timings'''
+    global _enabled
+    _enabled = bool(flag)
+
+
+def timings_enabled():
+    return _enabled
+
+
+def reset_timings():
+    '''Remove all recorded timings'''
+    with _lock:
+        _stats.clear()
+
+# ------------------------------------------------------
+
+
+def _stack():
+    global _pid
+    if _pid != os.getpid():
+        # forked process, timings of the parent are not counted again
+        _pid = os.getpid()
+        _stats.clear()
+        _local.__dict__.clear()
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _enter(label):
+    stack = _stack()
+    stack.append([label, 0.0])
+    return timeit.default_timer()
+
+
+def _exit(start):
+    elapsed = timeit.default_timer() - start
+    stack = _stack()
+    if not stack:
+        return elapsed
+    path = tuple(item[0] for item in stack)
+    child = stack.pop()[1]
+    if stack:
+        stack[-1][1] += elapsed
+    with _lock:
+        entry = _stats.get(path)
+        if entry is None:
+            _stats[path] = [1, elapsed, child, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += child
+            if elapsed < entry[3]:
+                entry[3] = elapsed
+            if elapsed > entry[4]:
+                entry[4] = elapsed
+    return elapsed
+
+# ------------------------------------------------------
+
+
+def timed(label=None):
+    '''Decorator recording the time of each call under label (default :
+    name of the function) when timings are enabled. When disabled, the
+    cost is a single check of a flag.'''
+
+    def decorate(f):
+        name = label or f.__name__
+
+        @wraps(f)
+        def _wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            start = _enter(name)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _exit(start)
+        return _wrapper
+    return decorate
+
+# ------------------------------------------------------
+
+
+def MeasureTime(f, no_print=False, disable_gc=False):
+    @wraps(f)
+    def _wrapper(*args, **kwargs):
+        gcold = gc.isenabled()
+        if disable_gc:
+            gc.disable()
+        record = _enabled
+        start_time = _enter(f.__name__) if record else \
+            timeit.default_timer()
+        try:
+            result = f(*args, **kwargs)
+        finally:
+            if record:
+                elapsed = _exit(start_time)
+            else:
+                elapsed = timeit.default_timer() - start_time
+            if disable_gc and gcold:
+                gc.enable()
+            if not no_print:
+                print('"{}": {}s'.format(f.__name__, elapsed))
+        return result
+    return _wrapper
+
+class MeasureBlockTime:
+    def __init__(self,name="(block)", no_print=False, disable_gc=False):
+        self.name = name
+        self.no_print = no_print
+        self.disable_gc = disable_gc
+    def __enter__(self):
+        self.gcold = gc.isenabled()
+        if self.disable_gc:
+            gc.disable()
+        self.record = _enabled
+        self.start_time = _enter(self.name) if self.record else \
+            timeit.default_timer()
+    def __exit__(self,ty,val,tb):
+        if self.record:
+            self.elapsed = _exit(self.start_time)
+        else:
+            self.elapsed = timeit.default_timer() - self.start_time
+        if self.disable_gc and self.gcold:
+            gc.enable()
+        if not self.no_print:
+            print('Function "{}": {}s'.format(self.name, self.elapsed))
+        return False #re-raise any exceptions
+
+# ------------------------------------------------------
+
+
+def timing_summary():
+    '''Recorded timings, one dict per path of nested labels with
+    path ('fit/residual/spectra'), label, depth, count, total, self
+    (total minus the time of the nested labels), mean, min and max
+    (seconds), in order of the path'''
+
+    with _lock:
+        items = sorted((path, list(entry)) for path, entry in _stats.items())
+    out = []
+    for path, (count, total, child, tmin, tmax) in items:
+        out.append({'path': '/'.join(path), 'label': path[-1],
+                    'depth': len(path) - 1, 'count': count, 'total': total,
+                    'self': total - child, 'mean': total / count,
+                    'min': tmin, 'max': tmax})
+    return out
+
+
+def merge_timings(summary):
+    '''Add the timings of another process (output of timing_summary)'''
+
+    with _lock:
+        for row in summary:
+            path = tuple(row['path'].split('/'))
+            child = row['total'] - row['self']
+            entry = _stats.get(path)
+            if entry is None:
+                _stats[path] = [row['count'], row['total'], child,
+                                row['min'], row['max']]
+            else:
+                entry[0] += row['count']
+                entry[1] += row['total']
+                entry[2] += child
+                entry[3] = min(entry[3], row['min'])
+                entry[4] = max(entry[4], row['max'])
+
+# ------------------------------------------------------
+
+
+def timing_table():
+    '''Recorded timings as text table, nested labels are indented'''
+
+    lines = ['{0:<40s} {1:>9s} {2:>11s} {3:>11s} {4:>11s}'.format(
+        'label', 'count', 'total (s)', 'self (s)', 'mean (ms)')]
+    for row in timing_summary():
+        lines.append('{0:<40s} {1:>9d} {2:>11.4f} {3:>11.4f} {4:>11.4f}'
+                     .format('  ' * row['depth'] + row['label'], row['count'],
+                             row['total'], row['self'], 1e3 * row['mean']))
+    return '\n'.join(lines)
+
+
+def save_timings(filename):
+    '''Write the recorded timings as JSON, {pid} in filename is replaced
+    by the process id. The file is replaced atomically.'''
+
+    filename = filename.format(pid=os.getpid())
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'argv': sys.argv,
+                       'timings': timing_summary()}, f, indent=1)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+# ------------------------------------------------------
+
+
+def _report_at_exit(target):
+    if not _stats:
+        return
+    if target == '1':
+        print(timing_table())
+    else:
+        save_timings(target)
+
+
+if os.environ.get('C2_TIMINGS', '') not in ('', '0'):
+    enable_timings()
+    atexit.register(_report_at_exit, os.environ['C2_TIMINGS'])
+
+# ------------------------------------------------------
+
+
+class ProfileBlock:
+    '''Profile of a block with cProfile and peak memory with tracemalloc.
+
+    On exit, saved in directory as
+        <name>.prof         : pstats file (python -m pstats, snakeviz)
+        <name>_memory.txt   : peak memory and the largest allocations
+    and the top functions (cumulative time) and the peak memory are
+    printed. '''
+
+    def __init__(self, name='profile', directory='.', top=15,
+                 no_print=False, n_frames=1):
+        self.name = name
+        self.directory = directory
+        self.top = top
+        self.no_print = no_print
+        self.n_frames = n_frames
+
+    def __enter__(self):
+        self.own_trace = not tracemalloc.is_tracing()
+        if self.own_trace:
+            tracemalloc.start(self.n_frames)
+        else:
+            tracemalloc.reset_peak()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, ty, val, tb):
+        self.profiler.disable()
+        current, self.peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if self.own_trace:
+            tracemalloc.stop()
+
+        base = os.path.join(self.directory, self.name)
+        self.profiler.dump_stats(base + '.prof')
+        allocations = snapshot.statistics('lineno')[:self.top]
+        with open(base + '_memory.txt', 'w') as f:
+            f.write('peak memory : {0:.3f} MiB\n'.format(self.peak / 2**20))
+            f.write('largest allocations at the end of the block :\n')
+            for stat in allocations:
+                f.write('{0}\n'.format(stat))
+
+        if not self.no_print:
+            print('\n Profile of "{0}" saved as {1}.prof, {1}_memory.txt'
+                  .format(self.name, base))
+            print(' peak memory : {0:.3f} MiB'.format(self.peak / 2**20))
+            pstats.Stats(self.profiler).sort_stats('cumulative')\
+                .print_stats(self.top)
+        return False
+
+
+def profiled(f):
+    '''Decorator adding the keyword profile to f. With profile=True
+    the call is profiled (see ProfileBlock), results are saved as
+    profile_<name of f>.prof and profile_<name of f>_memory.txt
+
+    Used for the run_fit_* of the modules importing utils.py
+    (genC2_VR_T_dep_*, genC2_CR_*, genC2_PR_*) and for gen_C0_C1 only,
+    the other modules can be profiled with ProfileBlock '''
+
+    @wraps(f)
+    def _wrapper(*args, profile=False, **kwargs):
+        if not profile:
+            return f(*args, **kwargs)
+        with ProfileBlock('profile_' + f.__name__):
+            return f(*args, **kwargs)
+    return _wrapper
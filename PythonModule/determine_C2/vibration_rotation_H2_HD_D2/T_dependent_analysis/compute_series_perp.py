@@ -2,8 +2,10 @@
 # pylint: disable=wildcard-import, method-hidden,C0103
 '''Module for computing the pure rotational Raman spectra from H2, HD and D2'''
 
+import os
 import math
 import numpy as np
+from common import utils
 
 
 # FOR PERPENDICULAR POLARIZATION
@@ -30,33 +32,37 @@ omega_sc = omega / 1e4  # scaled frequency (for better numerical accuracy)
 #   b) K. Pachucki and J. Komasa, Phys. Chem. Chem. Phys. 12, 9188 (2010).
 # ----------------------------------------
 
-eJH2v0 = np.loadtxt("./energy_levels_and_ME/H2eV0.dat")
-eJH2v1 = np.loadtxt("./energy_levels_and_ME/H2eV1.dat")
-eJHDv0 = np.loadtxt("./energy_levels_and_ME/HDeV0.dat")
-eJHDv1 = np.loadtxt("./energy_levels_and_ME/HDeV1.dat")
-eJD2v0 = np.loadtxt("./energy_levels_and_ME/D2eV0.dat")
-eJD2v1 = np.loadtxt("./energy_levels_and_ME/D2eV1.dat")
+# the data are read relative to this module (it may be imported from
+# another directory)
+_dir = os.path.dirname(os.path.abspath(__file__))
+
+eJH2v0 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "H2eV0.dat"))
+eJH2v1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "H2eV1.dat"))
+eJHDv0 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "HDeV0.dat"))
+eJHDv1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "HDeV1.dat"))
+eJD2v0 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "D2eV0.dat"))
+eJD2v1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "D2eV1.dat"))
 
 #   Data on the matrix elements of polarizability anisotropy has been taken
 #    from our previous work.
 #   c) A. Raj, H. Hamaguchi, and H. A. Witek, J. Chem. Phys. 148, 104308 (2018)
 
-ME_alpha_H2_532_Q1 = np.loadtxt("./energy_levels_and_ME/H2_532.2_mp_Q1.dat")
-ME_alpha_HD_532_Q1 = np.loadtxt("./energy_levels_and_ME/HD_532.2_mp_Q1.dat")
-ME_alpha_D2_532_Q1 = np.loadtxt("./energy_levels_and_ME/D2_532.2_mp_Q1.dat")
+ME_alpha_H2_532_Q1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "H2_532.2_mp_Q1.dat"))
+ME_alpha_HD_532_Q1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "HD_532.2_mp_Q1.dat"))
+ME_alpha_D2_532_Q1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "D2_532.2_mp_Q1.dat"))
 
-ME_gamma_H2_532_Q1 = np.loadtxt("./energy_levels_and_ME/H2_532.2_gamma_Q1.dat")
-ME_gamma_HD_532_Q1 = np.loadtxt("./energy_levels_and_ME/HD_532.2_gamma_Q1.dat")
-ME_gamma_D2_532_Q1 = np.loadtxt("./energy_levels_and_ME/D2_532.2_gamma_Q1.dat")
+ME_gamma_H2_532_Q1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "H2_532.2_gamma_Q1.dat"))
+ME_gamma_HD_532_Q1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "HD_532.2_gamma_Q1.dat"))
+ME_gamma_D2_532_Q1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "D2_532.2_gamma_Q1.dat"))
 
-ME_gamma_H2_532_O1 = np.loadtxt("./energy_levels_and_ME/H2_532.2_gamma_O1.dat")
-ME_gamma_H2_532_S1 = np.loadtxt("./energy_levels_and_ME/H2_532.2_gamma_S1.dat")
+ME_gamma_H2_532_O1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "H2_532.2_gamma_O1.dat"))
+ME_gamma_H2_532_S1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "H2_532.2_gamma_S1.dat"))
 
-ME_gamma_HD_532_O1 = np.loadtxt("./energy_levels_and_ME/HD_532.2_gamma_O1.dat")
-ME_gamma_HD_532_S1 = np.loadtxt("./energy_levels_and_ME/HD_532.2_gamma_S1.dat")
+ME_gamma_HD_532_O1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "HD_532.2_gamma_O1.dat"))
+ME_gamma_HD_532_S1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "HD_532.2_gamma_S1.dat"))
 
-ME_gamma_D2_532_O1 = np.loadtxt("./energy_levels_and_ME/D2_532.2_gamma_O1.dat")
-ME_gamma_D2_532_S1 = np.loadtxt("./energy_levels_and_ME/D2_532.2_gamma_S1.dat")
+ME_gamma_D2_532_O1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "D2_532.2_gamma_O1.dat"))
+ME_gamma_D2_532_S1 = np.loadtxt(os.path.join(_dir, "energy_levels_and_ME", "D2_532.2_gamma_S1.dat"))
 
 
 
@@ -180,6 +186,7 @@ def HD_Q1(T, JMax, sos):
     return specHD
 # *****************************************************************************
 
+@utils.timed('spectra')
 def spectra_HD(T, OJ, QJ, SJ, sos):
     """Compute in intensities and position for rotational Raman bands of HD
         where OJ = max J state for O(v = 1) bands
@@ -198,6 +205,7 @@ def spectra_HD(T, OJ, QJ, SJ, sos):
     # --------------------------------------------------
 # *****************************************************************************
 
+@utils.timed('spectra')
 def spectra_HD_o1s1(T, OJ, SJ, sos):
     """Compute in intensities and position for rotational Raman bands of HD
         where OJ = max J state for O(v = 1) bands
@@ -317,6 +325,7 @@ def D2_Q1(T, JMax, sos):
 # *****************************************************************************
 
 
+@utils.timed('spectra')
 def spectra_D2(T, OJ, QJ, SJ, sos):
     """Compute in intensities and position for rotational Raman bands of D2
         where OJ = max J state for O(v = 1) bands
@@ -337,6 +346,7 @@ def spectra_D2(T, OJ, QJ, SJ, sos):
 # *****************************************************************************
 
 
+@utils.timed('spectra')
 def spectra_D2_o1s1(T, OJ, SJ, sos):
     """Compute in intensities and position for rotational Raman bands of D2
         where OJ = max J state for O(v = 1) bands
@@ -465,6 +475,7 @@ def H2_Q1(T, JMax, sos):
 # *****************************************************************************
 
 
+@utils.timed('spectra')
 def spectra_H2(T, OJ, QJ, SJ, sos):
     """Compute in intensities and position for rotational Raman bands of H2
         where OJ = max J state for O(v = 1) bands
@@ -486,6 +497,7 @@ def spectra_H2(T, OJ, QJ, SJ, sos):
 # *****************************************************************************
 
 
+@utils.timed('spectra')
 def spectra_H2_c(T, OJ, QJ, sos):
     """Compute in intensities and position for rotational Raman bands of H2
         where OJ = max J state for O(v = 1) bands
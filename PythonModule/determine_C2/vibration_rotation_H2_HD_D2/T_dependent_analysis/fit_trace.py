@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for recording the course of the fits, iteration by iteration.
+
+A TraceRecorder is passed to fit_utils.minimize (option recorder), which
+calls it from the callback of the optimizer. For every iteration the
+best parameters, the residual, the contribution of each species (when a
+function for these is given), the number of evaluations and the elapsed
+time are kept in a buffer of bounded length. The recorder is meant to be
+shared by many fits : every record carries the label and the number of
+its fit, and counters (fits, iterations, evaluations, time) are kept per
+label for all fits, also when old records have left the buffer.
+
+Records are written as JSON Lines or npz, the counters as a text file in
+the format of Prometheus (textfile collector)."""
+
+import os
+import json
+import tempfile
+import threading
+from collections import deque, OrderedDict
+import numpy as np
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# TraceRecorder(maxlen=10000, contributions=None, prefix='c2_fit')
+#    write_jsonl(filename), write_npz(filename), write_prometheus(filename)
+#    records, counters
+
+# ------------------------------------------------------
+
+
+def _atomic_write(filename, write):
+    '''write(f) to a temporary file, renamed to filename'''
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+# ------------------------------------------------------
+
+
+def _value(v):
+    '''value in the Prometheus text format'''
+    if isinstance(v, float) and np.isnan(v):
+        return 'NaN'
+    return repr(v)
+
+# ------------------------------------------------------
+
+
+class TraceRecorder:
+    '''Bounded record of the iterations of the fits
+
+    maxlen        = maximum number of records (iterations) kept, older
+                    records are dropped first
+    contributions = function of param returning a dict of the
+                    contribution of each species to the residual
+                    (optional, see CalibrationProblem.contributions),
+                    evaluated once per iteration for the best param
+    prefix        = prefix of the names of the metrics '''
+
+    def __init__(self, maxlen=10000, contributions=None, prefix='c2_fit'):
+        self.records = deque(maxlen=maxlen)
+        self.contributions = contributions
+        self.prefix = prefix
+        self.n_fits = 0
+        self.dropped = 0
+        self.counters = OrderedDict()
+        self._lock = threading.Lock()
+        self._fit = None
+        self._last = (None, None)
+
+    # --------------------------------------------------
+
+    def start(self, label):
+        '''Start the record of a new fit, returns its number'''
+        with self._lock:
+            self.n_fits += 1
+            self._fit = (label, self.n_fits)
+            return self.n_fits
+
+    def record(self, nit, nfev, elapsed, param, fun):
+        '''Record one iteration (called from the optimizer callback)'''
+
+        label, fit = self._fit
+        entry = {'fit': fit, 'label': label, 'nit': int(nit),
+                 'nfev': int(nfev), 'elapsed': float(elapsed),
+                 'residual': float(fun),
+                 'param': [float(v) for v in param]}
+        if self.contributions is not None:
+            # the best param is often unchanged between iterations
+            last_param, species = self._last
+            if last_param is None or not np.array_equal(last_param, param):
+                species = {name: float(v) for name, v in
+                           self.contributions(param).items()}
+                self._last = (np.array(param), species)
+            entry['species'] = species
+        with self._lock:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(entry)
+
+    def finish(self, res):
+        '''Update the counters with the result of the fit'''
+
+        label, fit = self._fit
+        if res.success:
+            status = 'converged'
+        elif res.get('status') == -1:
+            status = 'deadline'
+        else:
+            status = 'not_converged'
+
+        with self._lock:
+            c = self.counters.setdefault(label, {
+                'fits': {'converged': 0, 'deadline': 0, 'not_converged': 0},
+                'iterations': 0, 'evaluations': 0, 'seconds': 0.0,
+                'last_residual': np.nan, 'last_T': np.nan})
+            c['fits'][status] += 1
+            c['iterations'] += int(res.nit)
+            c['evaluations'] += int(res.nfev)
+            c['seconds'] += float(res.get('elapsed', 0.0))
+            c['last_residual'] = float(res.fun)
+            c['last_T'] = float(res.x[0])
+            self._fit = None
+
+    # --------------------------------------------------
+
+    def write_jsonl(self, filename, append=False):
+        '''Write the records as JSON Lines, one iteration per line'''
+
+        with self._lock:
+            lines = [json.dumps(r) for r in self.records]
+        with open(filename, 'a' if append else 'w') as f:
+            for line in lines:
+                f.write(line + '\n')
+
+    def write_npz(self, filename):
+        '''Write the records as arrays : fit, nit, nfev, elapsed,
+        residual, param (padded with nan to the largest number of param),
+        species (names) and contributions, labels (label of each fit)'''
+
+        with self._lock:
+            records = list(self.records)
+        n = max([len(r['param']) for r in records] or [0])
+        param = np.full((len(records), n), np.nan)
+        for i, r in enumerate(records):
+            param[i, :len(r['param'])] = r['param']
+        species = sorted({name for r in records
+                          for name in r.get('species', {})})
+        contrib = np.array([[r.get('species', {}).get(name, np.nan)
+                             for name in species] for r in records])
+        fits = OrderedDict((r['fit'], r['label']) for r in records)
+
+        arrays = {'fit': np.array([r['fit'] for r in records], dtype=int),
+                  'nit': np.array([r['nit'] for r in records], dtype=int),
+                  'nfev': np.array([r['nfev'] for r in records], dtype=int),
+                  'elapsed': np.array([r['elapsed'] for r in records]),
+                  'residual': np.array([r['residual'] for r in records]),
+                  'param': param, 'species': np.array(species),
+                  'contributions': contrib.reshape(len(records),
+                                                   len(species)),
+                  'fit_numbers': np.array(list(fits.keys()), dtype=int),
+                  'labels': np.array(list(fits.values()))}
+        _atomic_write(filename, lambda f: np.savez(f, **arrays))
+
+    # --------------------------------------------------
+
+    def prometheus(self):
+        '''Counters as text in the exposition format of Prometheus'''
+
+        p = self.prefix
+        metrics = [
+            ('total', 'counter', 'Number of fits', 'fits'),
+            ('iterations_total', 'counter', 'Iterations of the optimizer',
+             'iterations'),
+            ('evaluations_total', 'counter', 'Evaluations of the residual',
+             'evaluations'),
+            ('seconds_total', 'counter', 'Time spent in the fits',
+             'seconds'),
+            ('last_residual', 'gauge', 'Residual of the last fit',
+             'last_residual'),
+            ('last_temperature_kelvin', 'gauge', 'T of the last fit',
+             'last_T')]
+
+        with self._lock:
+            counters = json.loads(json.dumps(self.counters))
+            dropped = self.dropped
+
+        lines = []
+        for suffix, kind, text, key in metrics:
+            name = '{0}_{1}'.format(p, suffix)
+            lines.append('# HELP {0} {1}'.format(name, text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for label, c in counters.items():
+                if key == 'fits':
+                    for status, v in c['fits'].items():
+                        lines.append('{0}{{fit="{1}",status="{2}"}} {3}'
+                                     .format(name, label, status, v))
+                else:
+                    lines.append('{0}{{fit="{1}"}} {2}'
+                                 .format(name, label, _value(c[key])))
+        name = '{0}_trace_dropped_total'.format(p)
+        lines.append('# HELP {0} Records dropped from the trace buffer'
+                     .format(name))
+        lines.append('# TYPE {0} counter'.format(name))
+        lines.append('{0} {1}'.format(name, dropped))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename):
+        '''Write the counters (see prometheus) to filename, replaced
+        atomically as required by the textfile collector'''
+        text = self.prometheus().encode()
+        _atomic_write(filename, lambda f: f.write(text))
+
+# ------------------------------------------------------
@@ -9,17 +9,27 @@ as a model function"""
 import os
 import sys
 import math
+import hashlib
 import logging
 from datetime import datetime
 import numpy as np
 
-import scipy.optimize as opt
 import matplotlib.pyplot as plt
 
 import compute_series_para
 import boltzmann_popln as bp
 
 from common import utils
+import fit_utils
+import warm_start
+import uncertainty
+import calibration_problem
+import ensemble_sampler
+import model_selection
+import influence
+import sensitivity_basis
+import fit_trace
+import joint_fit
 # ------------------------------------------------------
 def orderOfMagnitude(number):
     return math.floor(math.log(number, 10))
@@ -112,6 +122,24 @@ norm =  'Frobenius'
 
 # ----------------------------------------
 
+# basis of the polynomial for the sensitivity
+# available bases : monomial, chebyshev, legendre
+#   monomial  : terms are (x-scenter)**k / scale_k (scale1 to scale5)
+#   chebyshev, legendre : the range of the band positions (domain) is
+#               mapped to [-1, 1], no scale factors are required. These
+#               are better conditioned for the quartic and quintuple fits.
+# In every basis, the sensitivity is 1 at scenter (see sensitivity_basis.py)
+
+basis = 'monomial'
+
+# range of the band positions (does not depend on T)
+domain = sensitivity_basis.band_domain(
+    compute_series_para.spectra_H2_c(300, OJ_H2, QJ_H2, 1.0),
+    compute_series_para.spectra_HD(300, OJ_HD, QJ_HD, SJ_HD, 1.0),
+    compute_series_para.spectra_D2(300, OJ_D2, QJ_D2, SJ_D2, 1.0))
+
+# ----------------------------------------
+
 
 # ------------------------------------------------------
 #                COMMON SETTINGS
@@ -288,12 +316,52 @@ log.info('\t\t Norm:\t %s', norm)
 #    Returns : np array of residuals, with 4 elements
 
 
+# run_degree_selection(max_degree=5, criterion='bic')
+#    Fits increasing degrees (warm started) until the criterion
+#    (aic, bic or ftest) stops improving, saves the selected fit
+#    Returns : dict with the selected degree and table of statistics
+
+
 # plot_curves(residual_array="None")
 #   Plotting the curves (from fit)
 #   and plot the residuals over the number of unknown variables
 #   np array of residuals to be passed for plot of residuals
 
+# run_fit_warm(degree, prior=None, store=None, config=None)
+#    Fit starting from a previous calibration of the same instrument
+#    Returns : dict with the optimized param and the drift from prior
+
+# run_uncertainty(degree, n_draws=1000, method='parametric', n_jobs=None)
+#    Refits of perturbed band areas for the last fit of given degree
+#    Returns : dict with T statistics and percentile bands of the curve
+
+# run_sampler(degree, n_walkers=32, n_steps=5000, checkpoint=None)
+#    Posterior of T and coefs (ensemble MCMC) for the last fit
+#    Returns : dict with samples, mean, std and correlation matrix
+
+# run_influence(degree, threshold=1.0)
+#    Change of T and curve on removing each band (no refits)
+#    Returns : list of dict, one per band, outliers flagged
+
+# run_joint_fit(degree, datasets, init_T=299.0, init_coefs=None)
+#    One curve shared by several acquisitions, one T per acquisition
+#    Returns : OptimizeResult with T, coefs and their standard errors
+
+# gen_problem(degree)
+#    CalibrationProblem with the data and settings of this module
+
+# Results of the last fit of each degree are kept (OptimizeResult) in
+#  fit_results, for example fit_results['cubic'].x
+
+# Every iteration of the fits is recorded in trace_recorder (see
+#  fit_trace.py), for example
+#  trace_recorder.write_jsonl('fit_trace.jsonl')
+#  trace_recorder.write_prometheus('c2_fit.prom')
+
+fit_results = {}
+
 # ------------------------------------------------------
+@utils.profiled
 def run_all_fit():
     '''
     Runs the fitting from linear to quartic polynomial
@@ -323,6 +391,7 @@ def run_all_fit():
 # *******************************************************************
 # ------------------------------------------------------
 
+@utils.timed('ratio matrix')
 def gen_intensity_mat(arr, index):
     """To obtain the intensity matrix for the numerator or denominator\
         in the Intensity ratio matrix
@@ -390,11 +459,40 @@ def scale_elements(array, index_array, factor):
 # ------------------------------------------------
 
 
+def gen_curve(param, x=None):
+    """Correction curve (C2) for param = [T, c1, ...] on the x-axis x
+    (default : xaxis), in the basis set above"""
+
+    if x is None:
+        x = xaxis
+    scales = [scale1, scale2, scale3, scale4, scale5]
+    return sensitivity_basis.curve(param[1:], x, basis, scales, scenter,
+                                   domain)
+
+# ------------------------------------------------
+
+
+@utils.timed('S-matrix')
+def gen_s_basis(computed_data, param):
+    """Generate the sensitivity matrix for any degree and basis, using
+    gen_curve. Elements are the ratio of sensitivity at two
+    wavenumber/wavelength points"""
+
+    s = gen_curve(param, computed_data[:, 1])
+    return s[:, None] / s[None, :]
+
+# ------------------------------------------------
+
+
+@utils.timed('S-matrix')
 def gen_s_linear(computed_data, param):
     """Generate the sensitivity matrix assuming the wavelength
     dependent sensitivity as a line. Elements are the ratio of
     sensitivity at two wavenumber/wavelength points"""
 
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
+
     mat = np.zeros((computed_data.shape[0], computed_data.shape[0]))
 
     for i in range(computed_data.shape[0]):
@@ -413,11 +511,15 @@ def gen_s_linear(computed_data, param):
 # ------------------------------------------------
 
 
+@utils.timed('S-matrix')
 def gen_s_quadratic(computed_data, param):
     """Generate the sensitivity matrix assuming the wavelength
     dependent sensitivity as a quadratic polynomial. Elements are
     the ratio of sensitivity at two wavenumber/wavelength points"""
 
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
+
     mat = np.zeros((computed_data.shape[0], computed_data.shape[0]))
 
     for i in range(computed_data.shape[0]):
@@ -438,11 +540,15 @@ def gen_s_quadratic(computed_data, param):
 # ------------------------------------------------
 
 
+@utils.timed('S-matrix')
 def gen_s_cubic(computed_data, param):
     """Generate the sensitivity matrix assuming the wavelength
     dependent sensitivity as a cubic polynomial. Elements are
     the ratio of sensitivity at two wavenumber/wavelength points"""
 
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
+
     mat = np.zeros((computed_data.shape[0], computed_data.shape[0]))
     # print('norm')
     for i in range(computed_data.shape[0]):
@@ -465,11 +571,15 @@ def gen_s_cubic(computed_data, param):
 # ------------------------------------------------
 
 
+@utils.timed('S-matrix')
 def gen_s_quartic(computed_data, param):
     """Generate the sensitivity matrix assuming the wavelength
     dependent sensitivity as quartic polynomial. Elements are
     the ratio of sensitivity at two wavenumber/wavelength points"""
 
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
+
     mat = np.zeros((computed_data.shape[0], computed_data.shape[0]))
 
     for i in range(computed_data.shape[0]):
@@ -492,11 +602,15 @@ def gen_s_quartic(computed_data, param):
 # ------------------------------------------------
 
 
+@utils.timed('S-matrix')
 def gen_s_quintuple(computed_data, param):
     """Generate the sensitivity matrix assuming the wavelength
     dependent sensitivity as quartic polynomial. Elements are
     the ratio of sensitivity at two wavenumber/wavelength points"""
 
+    if basis != 'monomial':
+        return gen_s_basis(computed_data, param)
+
     mat = np.zeros((computed_data.shape[0], computed_data.shape[0]))
 
     for i in range(computed_data.shape[0]):
@@ -521,11 +635,29 @@ def gen_s_quintuple(computed_data, param):
 
 # ------------------------------------------------
 # ------------------------------------------------
+@utils.timed('norm')
+def residual_norm(eD2, eHD):
+    '''Residual from the residual matrices of D2 and HD, using the
+    norm set above'''
+
+    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
+        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD))
+
+    elif norm.lower()=='frobenius' or norm =='F'  :
+        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD)))
+
+    elif norm.lower()=='frobenius_square' or norm =='FS' :
+        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD))
+
+    return E
+
+
 # *******************************************************************
 #     RESIDUAL FUNCTIONS DEFINED BELOW
 # *******************************************************************
 
 
+@utils.timed('residual')
 def residual_linear(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -588,14 +720,7 @@ def residual_linear(param):
     eH2 = clean_mat(eH2)
 
     #  choosing norm 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) 
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) 
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD))   
+    E = residual_norm(eD2, eHD)
 
     return E
 
@@ -603,6 +728,7 @@ def residual_linear(param):
 # *******************************************************************
 
 
+@utils.timed('residual')
 def residual_quadratic(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -664,14 +790,7 @@ def residual_quadratic(param):
     eH2 = clean_mat(eH2)
 
     #  choosing norm 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) 
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) 
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD))   
+    E = residual_norm(eD2, eHD)
 
     return E
 
@@ -679,6 +798,7 @@ def residual_quadratic(param):
 # *******************************************************************
 
 
+@utils.timed('residual')
 def residual_cubic(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -741,14 +861,7 @@ def residual_cubic(param):
         + np.sum(np.square(eH2))
 
     #  choosing norm 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) 
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) 
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD))   
+    E = residual_norm(eD2, eHD)
 
     return E
 
@@ -756,6 +869,7 @@ def residual_cubic(param):
 # *******************************************************************
 
 
+@utils.timed('residual')
 def residual_quartic(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -817,14 +931,7 @@ def residual_quartic(param):
     eH2 = clean_mat(eH2)
 
     #  choosing norm 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) 
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) 
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD))   
+    E = residual_norm(eD2, eHD)
 
     return E
 
@@ -832,6 +939,7 @@ def residual_quartic(param):
 # *******************************************************************
 
 
+@utils.timed('residual')
 def residual_quintuple(param):
     '''Function which computes the residual (as sum of squares) comparing the
     ratio of expt to theoretical intensity ratio to the sensitivity  profile
@@ -893,17 +1001,53 @@ def residual_quintuple(param):
     eH2 = clean_mat(eH2)
 
     #  choosing norm 
-    if norm=='' or norm.lower()=='absolute' or norm =='a' or norm =='A':
-        E=np.sum(np.abs(eD2)) + np.sum(np.abs(eHD)) 
-        
-    elif norm.lower()=='frobenius' or norm =='F'  :
-        E=np.sqrt(np.sum(np.square(eD2))) + np.sqrt(np.sum(np.square(eHD))) 
-        
-    elif norm.lower()=='frobenius_square' or norm =='FS' :
-        E=np.sum(np.square(eD2)) + np.sum(np.square(eHD))   
+    E = residual_norm(eD2, eHD)
 
     return E
 
+# *******************************************************************
+
+
+def export_model(res, name):
+    """Save the optimized T and coefs as a compact correction model
+    (correction_<name>_model.npz), which can be evaluated on any x-axis
+    (see calibration_tools/correction_model.py)
+
+    res  = OptimizeResult from the fit, res.x = [T, c1, c2, ...]
+    name = linear, quadratic, cubic, quartic or quintuple """
+
+    degree = res.x.shape[0] - 1
+    scales = np.array([scale1, scale2, scale3, scale4, scale5])[:degree]
+
+    np.savez("correction_{}_model.npz".format(name), coefs=res.x[1:],
+             scales=scales, scenter=scenter, temperature=res.x[0],
+             basis=basis, domain=domain, residual=res.fun,
+             cov=getattr(res, 'cov', np.nan),
+             stderr=getattr(res, 'stderr', np.nan))
+
+
+def add_covariance(res):
+    """Add the linearized covariance of [T, c1, ...] at the optimum to
+    the result of a fit (see CalibrationProblem.covariance)
+
+        res.cov       = covariance matrix
+        res.stderr    = standard errors of T, c1, ...
+        res.curve_std = standard error of the correction curve on xaxis """
+
+    problem = gen_problem(res.x.shape[0] - 1)
+    out = problem.covariance(res.x)
+    res.cov = out['cov']
+    res.stderr = out['stderr']
+    res.curve_std = problem.curve_std(out['cov'], xaxis)
+
+    print("\nStandard errors : T = {0}, coefs = {1}".format(
+        round(res.stderr[0], 6), np.round(res.stderr[1:], 6)))
+    print("\tmaximum std. error of the curve = {0}".format(
+        np.amax(res.curve_std)))
+    log.info('\n Standard errors : T = %4.6f, coefs = %s\n', res.stderr[0],
+             res.stderr[1:])
+
+
 # *******************************************************************
 # *******************************************************************
 # Fit functions
@@ -911,9 +1055,16 @@ def residual_quintuple(param):
 # *******************************************************************
 
 
-def run_fit_linear(init_T, init_k1):
+@utils.profiled
+def run_fit_linear(init_T, init_k1, **fit_options):
     '''Function performing the actual fit using the residual_linear function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, simplex_step,
+                  deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve) '''
 
     # init_k1 : Intial guess
 
@@ -927,19 +1078,25 @@ def run_fit_linear(init_T, init_k1):
 
 
     print("\nOptimization run: Linear     \n")
-    res = opt.minimize(residual_linear, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9})
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_linear, param_init, **fit_options)
+    fit_results['linear'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     print("\nOptimized result : T={0}, k1={1} \n".format(round(optT, 6),
                                                          round(optk1, 6)))
 
-    correction_curve = 1+(optk1/scale1)*(xaxis-scenter)  # generate the correction curve
+    correction_curve = gen_curve(res.x)  # generate the correction curve
 
     np.savetxt("correction_linear.txt", correction_curve, fmt='%2.8f',\
                header='corrn_curve_linear', comments='')
+    export_model(res, "linear")
 
     print("**********************************************************")
 
@@ -955,9 +1112,16 @@ def run_fit_linear(init_T, init_k1):
 # *******************************************************************
 # *******************************************************************
 
-def run_fit_quadratic(init_T, init_k1, init_k2):
+@utils.profiled
+def run_fit_quadratic(init_T, init_k1, init_k2, **fit_options):
     '''Function performing the actual fit using the residual_quadratic function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, simplex_step,
+                  deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve) '''
 
     # init_k1 : Intial guess
 
@@ -970,22 +1134,27 @@ def run_fit_quadratic(init_T, init_k1, init_k2):
          init_k2, (residual_quadratic(param_init))))
 
     print("\nOptimization run: Quadratic     \n")
-    res = opt.minimize(residual_quadratic, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9, 'maxiter':1500})
+    fit_options.setdefault('maxiter', 1500)
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_quadratic, param_init, **fit_options)
+    fit_results['quadratic'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     optk2 = res.x[2]
     print("\nOptimized result : T={0}, k1={1}, k2={2} \n".format(round(optT, 6)\
      ,  round(optk1, 6), round(optk2, 6)))
 
-     # generate the correction curve
-    correction_curve = 1 + (optk1 / scale1)*(xaxis - scenter)\
-        + (optk2 / scale2) * (xaxis - scenter)**2
+    correction_curve = gen_curve(res.x)  # generate the correction curve
 
     np.savetxt("correction_quadratic.txt", correction_curve, fmt='%2.8f',\
                header='corrn_curve_quadratic', comments='')
+    export_model(res, "quadratic")
 
     print("**********************************************************")
 
@@ -1001,9 +1170,16 @@ def run_fit_quadratic(init_T, init_k1, init_k2):
 # *******************************************************************
 # *******************************************************************
 
-def run_fit_cubic(init_T, init_k1, init_k2, init_k3):
+@utils.profiled
+def run_fit_cubic(init_T, init_k1, init_k2, init_k3, **fit_options):
     '''Function performing the actual fit using the residual_cubic function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, simplex_step,
+                  deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve) '''
 
     # init_k1 : Intial guess
 
@@ -1017,10 +1193,16 @@ def run_fit_cubic(init_T, init_k1, init_k2, init_k3):
 
 
     print("\nOptimization run : Cubic     \n")
-    res = opt.minimize(residual_cubic, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9, 'maxiter':2500})
+    fit_options.setdefault('maxiter', 2500)
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_cubic, param_init, **fit_options)
+    fit_results['cubic'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     optk2 = res.x[2]
@@ -1029,12 +1211,11 @@ def run_fit_cubic(init_T, init_k1, init_k2, init_k3):
           format(round(optT, 6) ,  round(optk1, 6), round(optk2, 6),\
                  round(optk3, 6)))
 
-    correction_curve = 1+(optk1/scale1)*(xaxis-scenter)  \
-        + (optk2/scale2)*(xaxis-scenter)**2  \
-        +(optk3/scale3)*(xaxis-scenter)**3 # generate the correction curve
+    correction_curve = gen_curve(res.x)  # generate the correction curve
 
     np.savetxt("correction_cubic.txt", correction_curve, fmt='%2.8f',\
                header='corrn_curve_cubic', comments='')
+    export_model(res, "cubic")
 
     print("**********************************************************")
     # save log -----------
@@ -1051,9 +1232,16 @@ def run_fit_cubic(init_T, init_k1, init_k2, init_k3):
 # *******************************************************************
 # *******************************************************************
 
-def run_fit_quartic(init_T, init_k1, init_k2, init_k3, init_k4):
+@utils.profiled
+def run_fit_quartic(init_T, init_k1, init_k2, init_k3, init_k4, **fit_options):
     '''Function performing the actual fit using the residual_quartic function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, simplex_step,
+                  deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve) '''
 
     # init_k1 : Intial guess
 
@@ -1068,10 +1256,16 @@ def run_fit_quartic(init_T, init_k1, init_k2, init_k3, init_k4):
 
 
     print("\nOptimization run : Quartic     \n")
-    res = opt.minimize(residual_quartic, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9, 'maxiter':1500})
+    fit_options.setdefault('maxiter', 1500)
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_quartic, param_init, **fit_options)
+    fit_results['quartic'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     optk2 = res.x[2]
@@ -1081,14 +1275,11 @@ def run_fit_quartic(init_T, init_k1, init_k2, init_k3, init_k4):
           format(round(optT, 6) ,  round(optk1, 6), round(optk2, 6),\
                  round(optk3, 6), round(optk4, 6)))
 
-    # generate the correction curve
-    correction_curve= 1+(optk1/scale1)*(xaxis-scenter)  \
-        +(optk2/scale2)*(xaxis-scenter)**2  \
-        +(optk3/scale3)*(xaxis-scenter)**3 \
-            +(optk4/scale4)*(xaxis-scenter)**4
+    correction_curve = gen_curve(res.x)  # generate the correction curve
 
     np.savetxt("correction_quartic.txt", correction_curve, fmt='%2.8f',\
                header='corrn_curve_quartic', comments='')
+    export_model(res, "quartic")
 
     print("**********************************************************")
     # save log -----------
@@ -1106,9 +1297,16 @@ def run_fit_quartic(init_T, init_k1, init_k2, init_k3, init_k4):
 # *******************************************************************
 # *******************************************************************
 
-def run_fit_quintuple(init_T, init_k1, init_k2, init_k3, init_k4, init_k5):
+@utils.profiled
+def run_fit_quintuple(init_T, init_k1, init_k2, init_k3, init_k4, init_k5, **fit_options):
     '''Function performing the actual fit using the residual_quintuple function
-    defined earlier '''
+    defined earlier
+
+    fit_options : optional, passed to fit_utils.minimize
+                  (for example maxiter, simplex_step,
+                  deadline in seconds, maxfev,
+                  curve_tol and T_tol to stop on the change of
+                  the correction curve) '''
 
     # init_k1 : Intial guess
 
@@ -1123,10 +1321,16 @@ def run_fit_quintuple(init_T, init_k1, init_k2, init_k3, init_k4, init_k5):
 
 
     print("\nOptimization run : Quintuple  \n")
-    res = opt.minimize(residual_quintuple, param_init, method='Nelder-Mead', \
-                              options={'xatol': 1e-9, 'fatol': 1e-9, 'maxiter':1500})
+    fit_options.setdefault('maxiter', 1500)
+    fit_options.setdefault('simplex_step',
+                           sensitivity_basis.simplex_step(param_init, basis))
+    fit_options.setdefault('curve', gen_curve)
+    fit_options.setdefault('recorder', trace_recorder)
+    res = fit_utils.minimize(residual_quintuple, param_init, **fit_options)
+    fit_results['quintuple'] = res
 
     print(res)
+    add_covariance(res)
     optT = res.x[0]
     optk1 = res.x[1]
     optk2 = res.x[2]
@@ -1137,15 +1341,11 @@ def run_fit_quintuple(init_T, init_k1, init_k2, init_k3, init_k4, init_k5):
           format(round(optT, 6) ,  round(optk1, 6), round(optk2, 6),\
                  round(optk3, 6), round(optk4, 6), round(optk5, 6)))
 
-    # generate the correction curve
-    correction_curve= 1+(optk1/scale1)*(xaxis-scenter)  \
-        +(optk2/scale2)*(xaxis-scenter)**2  \
-          +(optk3/scale3)*(xaxis-scenter)**3 \
-            +(optk4/scale4)*(xaxis-scenter)**4 \
-              +(optk5/scale5)*(xaxis-scenter)**5
+    correction_curve = gen_curve(res.x)  # generate the correction curve
 
     np.savetxt("correction_quintuple.txt", correction_curve, fmt='%2.8f',\
                header='corrn_curve_quintuple', comments='')
+    export_model(res, "quintuple")
 
     print("**********************************************************")
     # save log -----------
@@ -1160,6 +1360,354 @@ def run_fit_quintuple(init_T, init_k1, init_k2, init_k3, init_k4, init_k5):
     # --------------------
 
 
+@utils.profiled
+def run_fit_warm(degree, prior=None, store=None, config=None, **fit_options):
+    '''Run the fit of the given degree (1 to 5) starting from a previous
+    calibration of the same instrument, and report the drift from it.
+
+    prior  = previous result : OptimizeResult or [T, c1, ...], record
+             from the calibration store or CorrectionModel. Coefs of a
+             different degree or basis are projected onto the present
+             polynomial (see warm_start.map_coefs)
+    store  = calibration store (see calibration_tools), used when prior
+             is not given, as store.latest(**config)
+    config = dict of tags of the configuration, for example
+             {'instrument': 'spec1', 'grating': 1200, 'laser_nm': 532.2}
+
+    When no previous calibration is found, the default initial values
+    (param_linear, param_quadratic, ...) are used.
+
+    returns => dict with param, residual, prior (initial param), dT,
+               dcoefs and max_rel_curve (see warm_start.drift) '''
+
+    name = warm_start.degree_names[degree]
+    # scales of all degrees, the prior may have more coefs than degree
+    scales = np.array([scale1, scale2, scale3, scale4, scale5])
+
+    if prior is None and store is not None:
+        record = store.latest(**(config or {}))
+        if record is not None:
+            model = store.load_model(record) if hasattr(store, 'load_model')\
+                else None
+            prior = record if model is None else model
+
+    if prior is None:
+        print("\t No previous calibration found, using default initial values")
+        param_init = globals()['param_' + name]
+    else:
+        # the default temperature is used when the prior has none
+        param_init = warm_start.prior_param(
+            prior, degree, xaxis, scales, scenter, basis, domain,
+            T_init=globals()['param_' + name][0])
+        fit_options.setdefault('simplex_step',
+                               warm_start.default_step(param_init))
+
+    globals()['run_fit_' + name](*param_init, **fit_options)
+    res = fit_results[name]
+
+    out = {'param': res.x, 'residual': res.fun, 'prior': param_init}
+    if prior is not None:
+        out.update(warm_start.drift(prior, res.x, xaxis, scales, scenter,
+                                    basis, domain))
+        print("\nDrift from previous calibration : dT = {0}, "
+              "max relative change of curve = {1}".format(
+                  round(out['dT'], 6), round(out['max_rel_curve'], 6)))
+        log.info('\n Drift from previous calibration : dT = %4.6f, '
+                 'max relative change of curve = %4.6f\n', out['dT'],
+                 out['max_rel_curve'])
+    return out
+
+# *******************************************************************
+# *******************************************************************
+
+def gen_problem(degree):
+    '''CalibrationProblem (see calibration_problem.py) with the data and
+    settings of this module, for the polynomial of the given degree'''
+
+    return calibration_problem.CalibrationProblem(
+        {'H2': dataH2, 'HD': dataHD, 'D2': dataD2}, degree,
+        polarization='para',
+        J={'H2': (OJ_H2, QJ_H2), 'HD': (OJ_HD, QJ_HD, SJ_HD),
+           'D2': (OJ_D2, QJ_D2, SJ_D2)},
+        norm=norm, scenter=scenter,
+        scales=[scale1, scale2, scale3, scale4, scale5][:degree],
+        basis=basis, domain=domain)
+
+# *******************************************************************
+# *******************************************************************
+
+# problems used for the contributions of the species, by degree, as
+# (key, problem)
+_problems = {}
+
+
+def _problem_key(degree):
+    '''Key of the problem of gen_problem(degree) : the settings and a
+    hash of the band areas (the module level variables may be changed
+    between fits)'''
+
+    h = hashlib.sha1()
+    for arr in (dataH2, dataHD, dataD2):
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        h.update(str(arr.shape).encode())
+        h.update(arr.tobytes())
+    J = (OJ_H2, QJ_H2, OJ_HD, QJ_HD, SJ_HD, OJ_D2, QJ_D2, SJ_D2)
+    scales = (scale1, scale2, scale3, scale4, scale5)[:degree]
+    return (basis, norm, scenter, repr(domain), J, scales, h.hexdigest())
+
+
+def species_residuals(param):
+    '''Contribution of each species to the residual at param (see
+    CalibrationProblem.contributions), recorded in the trace. The
+    problem is rebuilt when the data or the settings have changed.'''
+
+    degree = len(param) - 1
+    key = _problem_key(degree)
+    if degree not in _problems or _problems[degree][0] != key:
+        _problems[degree] = (key, gen_problem(degree))
+    return _problems[degree][1].contributions(param)
+
+
+trace_recorder = fit_trace.TraceRecorder(contributions=species_residuals)
+
+# *******************************************************************
+# *******************************************************************
+
+def run_uncertainty(degree, n_draws=1000, method='parametric', n_jobs=None,
+                    seed=None):
+    '''Uncertainty of T and of the C2 curve for the last fit of the given
+    degree (run the fit first), from n_draws refits of perturbed band
+    areas on a pool of processes (see uncertainty.py)
+
+    method = 'parametric' (from the errors of band areas) or 'bootstrap'
+
+    The curve, its standard deviation and percentiles (of the refits
+    which converged with T in uncertainty.T_bounds) are saved as
+    correction_<degree>_uncertainty.txt
+
+    returns => dict (see uncertainty.run_uncertainty) '''
+
+    name = warm_start.degree_names[degree]
+    if name not in fit_results:
+        raise ValueError('Run the {0} fit first'.format(name))
+
+    out = uncertainty.run_uncertainty(gen_problem(degree),
+                                      fit_results[name].x, xaxis,
+                                      n_draws=n_draws, method=method,
+                                      n_jobs=n_jobs, seed=seed)
+
+    print("\nUncertainty ({0}, {1} refits, {2}) : T = {3} +/- {4}".format(
+        name, n_draws, method, round(out['T_mean'], 4),
+        round(out['T_std'], 4)))
+    print("\t{0} refits rejected (not converged or T out of range)".format(
+        out['n_rejected']))
+    print("\tmaximum std. of the curve = {0}".format(
+        np.amax(out['curve_std'])))
+
+    header = 'xaxis\tcorrn_curve\tstd\t' + '\t'.join(
+        'p{0}'.format(p) for p in out['percentiles'])
+    np.savetxt("correction_{0}_uncertainty.txt".format(name),
+               np.column_stack((xaxis, out['curve'], out['curve_std'],
+                                out['curve_percentiles'].T)),
+               fmt='%2.8f', header=header, comments='')
+
+    log.info('\n *******  Uncertainty : %s  *******', name)
+    log.info('\n\t %d refits (%s) : T = %4.6f +/- %4.6f\n', n_draws, method,
+             out['T_mean'], out['T_std'])
+    log.info('\t %d refits rejected\n', out['n_rejected'])
+    log.info(' *******************************************')
+    return out
+
+# *******************************************************************
+# *******************************************************************
+
+def run_sampler(degree, n_walkers=32, n_steps=5000, burn=None,
+                checkpoint=None, seed=None):
+    '''Posterior of T and the coefs for the polynomial of the given
+    degree (run the fit first), using the affine-invariant ensemble
+    sampler (see ensemble_sampler.py). The log likelihood is obtained
+    from the pair residuals, scaled by the residual variance at the
+    optimum.
+
+    n_walkers  = number of walkers (even, at least 2*(degree+1))
+    n_steps    = total number of steps
+    burn       = steps removed at the start (default : n_steps // 4)
+    checkpoint = filename (npz) for saving the chain, a repeated call
+                 with the same file resumes the run
+
+    returns => dict with samples, mean, std, corr (correlation matrix),
+               acceptance and tau (autocorrelation time, in steps) '''
+
+    name = warm_start.degree_names[degree]
+    if name not in fit_results:
+        raise ValueError('Run the {0} fit first'.format(name))
+
+    problem = gen_problem(degree)
+    popt = fit_results[name].x
+    cov = problem.covariance(popt)
+
+    def log_prob(param):
+        return problem.log_likelihood(param, cov['s2'])
+
+    sampler = ensemble_sampler.EnsembleSampler(
+        log_prob, n_walkers, degree + 1, seed=seed, checkpoint=checkpoint)
+
+    # start in a small ball around the optimum
+    rng = np.random.default_rng(seed)
+    p0 = popt + 1e-2 * cov['stderr'] * rng.standard_normal(
+        (n_walkers, degree + 1))
+    sampler.run(p0, n_steps)
+
+    if burn is None:
+        burn = n_steps // 4
+    samples = sampler.samples(burn)
+    out = {'samples': samples,
+           'mean': np.mean(samples, axis=0),
+           'std': np.std(samples, axis=0, ddof=1),
+           'corr': np.corrcoef(samples, rowvar=False),
+           'acceptance': float(np.mean(sampler.acceptance_fraction)),
+           'tau': ensemble_sampler.autocorr_time(sampler.chain[burn:])}
+
+    print("\nPosterior ({0}, {1} walkers x {2} steps) : T = {3} +/- {4}"
+          .format(name, n_walkers, n_steps, round(out['mean'][0], 4),
+                  round(out['std'][0], 4)))
+    print("\tacceptance = {0}, autocorrelation time = {1}".format(
+        round(out['acceptance'], 3), np.round(out['tau'], 1)))
+    log.info('\n *******  Posterior : %s  *******', name)
+    log.info('\n\t mean = %s\n\t std = %s\n\t corr = %s\n', out['mean'],
+             out['std'], out['corr'])
+    log.info(' *******************************************')
+    return out
+
+# *******************************************************************
+# *******************************************************************
+
+def run_degree_selection(max_degree=5, criterion='bic', alpha=0.05):
+    '''Select the degree of the polynomial automatically (instead of
+    run_all_fit and the plot of residuals). Degrees are fitted in
+    increasing order starting from param_linear, each one warm started
+    from the previous optimum, until the criterion ('aic', 'bic' or
+    'ftest') stops improving (see model_selection.py). The fit of the
+    selected degree is then saved as for run_fit_*.
+
+    returns => dict with the selected degree, param and the table of
+               statistics for the fitted degrees '''
+
+    out = model_selection.select_degree(gen_problem, param_linear,
+                                        max_degree=max_degree,
+                                        criterion=criterion, alpha=alpha)
+
+    print("\n degree\t residual\t    AIC\t\t    BIC\t     chi2_red\t  F-test p")
+    log.info('\n *******  Degree selection (%s)  *******', criterion)
+    for row in out['table']:
+        line = " {0}\t {1:.6e}\t {2:10.4f}\t {3:10.4f}\t {4:.4e}\t {5:.4g}"\
+            .format(row['degree'], row['residual'], row['aic'], row['bic'],
+                    row['chi2_red'], row['p_value'])
+        print(line)
+        log.info(line)
+    print("\nSelected degree ({0}) : {1}".format(criterion, out['degree']))
+    log.info('\n Selected degree : %d', out['degree'])
+
+    # save outputs of the selected degree, starting at its optimum
+    name = warm_start.degree_names[out['degree']]
+    globals()['run_fit_' + name](
+        *out['param'], simplex_step=warm_start.default_step(out['param']))
+    return out
+
+# *******************************************************************
+# *******************************************************************
+
+def run_influence(degree, threshold=1.0):
+    '''Leave-one-band-out diagnostics for the last fit of the given
+    degree (run the fit first), without refits (see influence.py).
+    For every band the estimated change of T and of the correction
+    curve on removing the band, and Cook's distance, are printed.
+    Bands with Cook's distance above threshold are flagged.
+
+    returns => list of dict, one per band (see influence.band_influence)'''
+
+    name = warm_start.degree_names[degree]
+    if name not in fit_results:
+        raise ValueError('Run the {0} fit first'.format(name))
+
+    out = influence.band_influence(gen_problem(degree), fit_results[name].x,
+                                   xaxis, threshold=threshold)
+
+    print("\n species  row   J   position\t    dT\t     max dC2\t   Cook")
+    log.info('\n *******  Influence of bands : %s  *******', name)
+    for item in sorted(out, key=lambda d: -d['cook']):
+        line = " {0:>5}  {1:4d}  {2:2d}  {3:9.3f}\t{4:9.4f}\t{5:.4e}\t{6:8.4f}"\
+            " {7}".format(item['species'], item['index'], item['J'],
+                          item['position'], item['dT'], item['max_dcurve'],
+                          item['cook'], '*' if item['outlier'] else '')
+        print(line)
+        log.info(line)
+    print("\n (*) Cook's distance above {0}".format(threshold))
+    return out
+
+# *******************************************************************
+# *******************************************************************
+
+def run_joint_fit(degree, datasets, init_T=299.0, init_coefs=None,
+                  **options):
+    '''Joint fit of several acquisitions of the same gases with the same
+    optics (see joint_fit.py) : one correction curve for all, and one
+    temperature per acquisition. The settings of this module (J, scales,
+    basis, ...) are used.
+
+    datasets   = list of dicts of band areas, for example
+                 [{'H2': 'BA_H2_1', 'HD': 'BA_HD_1', 'D2': 'BA_D2_1'},
+                  {'H2': 'BA_H2_2', 'HD': 'BA_HD_2', 'D2': 'BA_D2_2'}]
+                 (filenames or arrays)
+    init_T     = initial temperature, scalar or one per acquisition
+    init_coefs = initial coefs (default : last fit of this degree, or 0)
+    options    = passed to scipy.optimize.least_squares
+
+    The curve and its standard error are saved as
+    correction_<degree>_joint.txt
+
+    returns => OptimizeResult (see JointCalibrationProblem.fit) '''
+
+    name = warm_start.degree_names[degree]
+    if init_coefs is None:
+        init_coefs = fit_results[name].x[1:] if name in fit_results \
+            else np.zeros(degree)
+
+    problem = joint_fit.JointCalibrationProblem(
+        datasets, degree, polarization='para',
+        J={'H2': (OJ_H2, QJ_H2), 'HD': (OJ_HD, QJ_HD, SJ_HD),
+           'D2': (OJ_D2, QJ_D2, SJ_D2)},
+        scenter=scenter,
+        scales=[scale1, scale2, scale3, scale4, scale5][:degree],
+        basis=basis, domain=domain)
+    res = problem.fit(init_T, init_coefs, **options)
+    res.curve_std = problem.curve_std(res.cov, xaxis)
+    fit_results[name + '_joint'] = res
+
+    print("\nJoint fit ({0}, {1} acquisitions) : {2}".format(
+        name, problem.K, res.message))
+    for k in range(problem.K):
+        print("\t acquisition {0} : T = {1} +/- {2}".format(
+            k, round(res.T[k], 4), round(res.T_std[k], 4)))
+    print("\t coefs = {0} +/- {1}".format(np.round(res.coefs, 8),
+                                          np.round(res.coefs_std, 8)))
+
+    np.savetxt("correction_{0}_joint.txt".format(name),
+               np.column_stack((problem.curve(res.x, xaxis), res.curve_std)),
+               fmt='%2.8f', header='corrn_curve_{0}_joint\tstd'.format(name),
+               comments='')
+
+    log.info('\n *******  Joint fit : %s, %d acquisitions  *******', name,
+             problem.K)
+    log.info('\n\t T = %s\n\t T_std = %s', res.T, res.T_std)
+    log.info('\n\t coefs = %s\n\t coefs_std = %s', res.coefs,
+             res.coefs_std)
+    log.info(' *******************************************')
+    return res
+
+# *******************************************************************
+# *******************************************************************
+
 # *******************************************************************
 # *******************************************************************
 # *******************************************************************
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for leave-one-band-out influence diagnostics, without refits.
+
+Removing a band removes all ratios (pair residual elements) in which
+the band appears. Using the Jacobian J and the residual vector r at the
+optimum, the change of the parameters on removing band b is estimated
+by a Gauss-Newton step of the linearized problem,
+
+    d(param) = inv(H) g - inv(H - H_b) (g - g_b)
+
+where H = J.T J, g = J.T r, and H_b, g_b are the contributions of the
+elements with band b (a downdate of H and g). Since the number of
+parameters is small (T and up to five coefs) the downdated system is
+solved directly. All bands of all species are covered with a single
+Jacobian, the cost of about one evaluation of the residual per
+parameter."""
+
+import numpy as np
+
+import fit_utils
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# band_influence(problem, param, xaxis, threshold=1.0)
+#    Estimated change of T, coefs and the C2 curve on removing each band
+
+# ------------------------------------------------------
+
+
+def band_influence(problem, param, xaxis, threshold=1.0, rel_step=1e-6):
+    '''Influence of every band on the fit at param (the optimum)
+
+    problem   = CalibrationProblem
+    param     = optimum [T, c1, ...]
+    xaxis     = x-axis for the change of the C2 curve
+    threshold = bands with Cook's distance above this are flagged as
+                outliers (4/number of bands is a stricter choice)
+
+    returns => list of dict, one per band, with species, index (row in
+               the band area data), J, position, dT, dcoefs,
+               max_dcurve (largest change of the C2 curve on xaxis),
+               leverage, cook and outlier (bool) '''
+
+    param = np.asarray(param, dtype=np.float64)
+    p = param.shape[0]
+
+    r = problem.residual_vector(param)
+    J = fit_utils.jacobian(problem.residual_vector, param, rel_step)
+    H = J.T @ J
+    g = J.T @ r
+    H_inv = np.linalg.pinv(H)
+    step_full = H_inv @ g
+
+    dof = max(r.shape[0] - p, 1)
+    s2 = float(np.dot(r, r)) / dof
+    basis = problem.basis_terms(xaxis)
+
+    pairs = problem.pair_index()
+    species = np.array([item[0] for item in pairs])
+    rows = np.array([item[1] for item in pairs])
+    cols = np.array([item[2] for item in pairs])
+
+    # leverage of every element, diagonal of the hat matrix
+    hat = np.einsum('ij,jk,ik->i', J, H_inv, J)
+
+    out = []
+    for name in problem.species:
+        for b in range(problem.positions[name].shape[0]):
+            sel = (species == name) & ((rows == b) | (cols == b))
+            Jb = J[sel]
+            Hb = H - Jb.T @ Jb
+            gb = g - Jb.T @ r[sel]
+
+            delta = step_full - np.linalg.pinv(Hb) @ gb
+            cook = float(delta @ H @ delta) / (p * s2)
+
+            out.append({'species': name,
+                        'index': b,
+                        'J': int(problem.J_values[name][b]),
+                        'position': float(problem.positions[name][b]),
+                        'dT': float(delta[0]),
+                        'dcoefs': delta[1:],
+                        'max_dcurve': float(np.amax(np.abs(basis
+                                                           @ delta[1:]))),
+                        'leverage': float(np.sum(hat[sel])),
+                        'cook': cook,
+                        'outlier': cook > threshold})
+    return out
+
+# ------------------------------------------------------
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for the joint fit of several acquisitions (sets of band areas
+of the same gases with the same optics, for example on different days)
+with one C2 polynomial shared by all acquisitions and one temperature
+per acquisition.
+
+The residual elements of the K acquisitions (lower triangular parts of
+the ratio matrices, as CalibrationProblem.residual_vector) are stacked
+into (K, n_pairs) arrays. The elements of acquisition k depend only on
+T_k and on the shared coefs, so the Jacobian, obtained analytically, is
+block sparse :
+
+                 T_1  T_2 ... T_K   c_1 ... c_n
+    acq. 1     [  x    .       .     x  ...  x ]
+    acq. 2     [  .    x       .     x  ...  x ]
+    ...
+    acq. K     [  .    .       x     x  ...  x ]
+
+The sum of squares of all elements (the 'frobenius_square' norm) is
+minimized with scipy.optimize.least_squares using this sparse Jacobian,
+and the covariance is obtained from the Schur complement of the T
+block. The cost of both grows linearly with K."""
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import least_squares
+
+import calibration_problem
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# JointCalibrationProblem(datasets, degree, polarization='para', ...)
+#    residual_vector(param) : stacked residual elements, (K, n_pairs)
+#    jacobian(param)        : sparse Jacobian (K * n_pairs, K + degree)
+#    fit(T_init, coefs_init, **options) : joint least squares fit
+#    covariance(param)      : covariance of the T_k and of the coefs
+#    curve(param, x), curve_std(cov, x)
+
+# stack_datasets(datasets)
+#    List of dicts of band areas from the output of
+#    synthetic_data.generate_datasets or from filenames
+
+# ------------------------------------------------------
+
+
+def stack_datasets(datasets):
+    '''Datasets as list of dicts of band areas
+
+    datasets = list of dicts {'H2': array, 'HD': array, 'D2': array}, or
+               dicts of filenames (read with np.loadtxt), or a dict of
+               (K, n_bands, 2) arrays (as 'data' of
+               synthetic_data.generate_datasets)
+
+    returns => list of dicts of 2D arrays '''
+
+    if isinstance(datasets, dict):
+        names = list(datasets)
+        n = np.asarray(datasets[names[0]]).shape[0]
+        return [{name: np.asarray(datasets[name])[k] for name in names}
+                for k in range(n)]
+
+    out = []
+    for ds in datasets:
+        out.append({name: np.loadtxt(value) if isinstance(value, str)
+                    else np.asarray(value, dtype=np.float64)
+                    for name, value in ds.items()})
+    return out
+
+# ------------------------------------------------------
+
+
+class JointCalibrationProblem:
+    '''Joint fit of K acquisitions : param = [T_1, ..., T_K, c1, ...,
+    c_degree]
+
+    datasets = see stack_datasets (rows of the band areas in the same
+               order as the computed spectra, as for CalibrationProblem)
+
+    The other arguments are those of CalibrationProblem. The norm is
+    always 'frobenius_square' (least squares). '''
+
+    def __init__(self, datasets, degree, polarization='para', J=None,
+                 scenter=3316.3, scales=None, xaxis=None, weighted=False,
+                 species=('D2', 'HD'), basis='monomial', domain=None):
+
+        datasets = stack_datasets(datasets)
+        if not datasets:
+            raise ValueError('At least one dataset is required')
+
+        # computed intensities, scales and basis, shared by all datasets
+        self.problem = calibration_problem.CalibrationProblem(
+            datasets[0], degree, polarization=polarization, J=J,
+            norm='frobenius_square', scenter=scenter, scales=scales,
+            xaxis=xaxis, weighted=weighted, species=species, basis=basis,
+            domain=domain)
+        p = self.problem
+        self.degree = p.degree
+        self.species = p.species
+        self.scales = p.scales
+        self.scenter = p.scenter
+        self.basis = p.basis
+        self.domain = p.domain
+
+        # per pair (row, column) of every species : differences of the
+        # coefficients of ln I, and basis terms of the two bands
+        self._pairs = {}
+        da, db, vr, vc = [], [], [], []
+        for name in self.species:
+            rows, cols = np.nonzero(p._mask[name])
+            self._pairs[name] = (rows, cols)
+            da.append(p._a[name][rows] - p._a[name][cols])
+            db.append(p._b[name][rows] - p._b[name][cols])
+            vr.append(p._v[name][rows])
+            vc.append(p._v[name][cols])
+        self._da = np.concatenate(da)
+        self._db = np.concatenate(db)
+        self._vr = np.concatenate(vr)
+        self._vc = np.concatenate(vc)
+        self.n_pairs = self._da.shape[0]
+
+        self.set_datasets(datasets)
+
+    # --------------------------------------------------
+
+    def set_datasets(self, datasets):
+        '''Replace all acquisitions (see stack_datasets)'''
+
+        datasets = stack_datasets(datasets)
+        expt = np.empty((len(datasets), self.n_pairs))
+        weight = np.empty((len(datasets), self.n_pairs))
+        for k, ds in enumerate(datasets):
+            self.problem.set_data(**ds)
+            e, w = [], []
+            for name in self.species:
+                rows, cols = self._pairs[name]
+                e.append(self.problem.expt[name][rows, cols])
+                wn = self.problem.weight[name]
+                w.append(np.broadcast_to(wn, self.problem.expt[name].shape)
+                         [rows, cols])
+            expt[k] = np.concatenate(e)
+            weight[k] = np.concatenate(w)
+
+        self.datasets = datasets
+        self.K = len(datasets)
+        self.n_param = self.K + self.degree
+        self._expt = expt
+        self._weight = weight
+
+    # --------------------------------------------------
+
+    def split(self, param):
+        '''(T (K), coefs (degree)) from param'''
+
+        param = np.asarray(param, dtype=np.float64)
+        return param[:self.K], param[self.K:]
+
+    def param(self, param, k):
+        '''[T_k, c1, ...] of acquisition k, as for CalibrationProblem'''
+
+        T, coefs = self.split(param)
+        return np.concatenate(([T[k]], coefs))
+
+    # --------------------------------------------------
+
+    def _terms(self, param):
+        T, coefs = self.split(param)
+        # experimental / computed ratio, (K, n_pairs)
+        q = self._expt * np.exp(-self._da - self._db / T[:, None])
+        pr = 1 + self._vr @ coefs
+        pc = 1 + self._vc @ coefs
+        return T, q, pr, pc
+
+    def residual_vector(self, param):
+        '''Weighted residual elements of all acquisitions, (K, n_pairs),
+        in the order of CalibrationProblem.residual_vector for each'''
+
+        _, q, pr, pc = self._terms(param)
+        return (q - pr / pc) * self._weight
+
+    def residual(self, param):
+        '''Sum of squares of all residual elements'''
+
+        r = self.residual_vector(param)
+        return float(np.sum(r * r))
+
+    def __call__(self, param):
+        return self.residual(param)
+
+    # --------------------------------------------------
+
+    def _blocks(self, param):
+        '''Non-zero blocks of the Jacobian : d/dT_k (K, n_pairs) and
+        d/dcoefs (K, n_pairs, degree)'''
+
+        T, q, pr, pc = self._terms(param)
+        dT = q * self._db / np.square(T)[:, None] * self._weight
+        ds = (self._vr - (pr / pc)[:, None] * self._vc) / pc[:, None]
+        dc = -ds[None, :, :] * self._weight[:, :, None]
+        return dT, dc
+
+    def jacobian(self, param):
+        '''Sparse Jacobian of the flattened residual_vector,
+        (K * n_pairs, K + degree), with 1 + degree non-zero elements in
+        every row'''
+
+        dT, dc = self._blocks(param)
+        K, P, n = self.K, self.n_pairs, self.degree
+        data = np.concatenate((dT[:, :, None], dc), axis=2).ravel()
+        cols = np.empty((K, P, 1 + n), dtype=np.int64)
+        cols[:, :, 0] = np.arange(K)[:, None]
+        cols[:, :, 1:] = K + np.arange(n)
+        indptr = np.arange(0, K * P * (1 + n) + 1, 1 + n)
+        return sparse.csr_matrix((data, cols.ravel(), indptr),
+                                 shape=(K * P, K + n))
+
+    # --------------------------------------------------
+
+    def fit(self, T_init, coefs_init, **options):
+        '''Joint least squares fit
+
+        T_init     = initial temperature, scalar or one per acquisition
+        coefs_init = initial coefs c1, ... (degree)
+        options    = passed to scipy.optimize.least_squares (for example
+                     xtol, ftol, max_nfev)
+
+        returns => OptimizeResult of least_squares with, in addition,
+                   T, coefs, param (per acquisition, (K, degree + 1)),
+                   residual (sum of squares), cov, T_std and coefs_std '''
+
+        T0 = np.broadcast_to(np.asarray(T_init, dtype=np.float64), (self.K,))
+        x0 = np.concatenate((T0, np.asarray(coefs_init, dtype=np.float64)))
+        if x0.shape[0] != self.n_param:
+            raise ValueError('{0} coefs are required'.format(self.degree))
+
+        lower = np.concatenate((np.full(self.K, 1.0),
+                                np.full(self.degree, -np.inf)))
+        options.setdefault('method', 'trf')
+        options.setdefault('tr_solver', 'lsmr')
+        options.setdefault('x_scale', 'jac')
+        res = least_squares(lambda x: self.residual_vector(x).ravel(), x0,
+                            jac=self.jacobian, bounds=(lower, np.inf),
+                            **options)
+
+        res.T, res.coefs = self.split(res.x)
+        res.param = np.column_stack((res.T, np.broadcast_to(
+            res.coefs, (self.K, self.degree))))
+        res.residual = 2.0 * res.cost
+        out = self.covariance(res.x)
+        res.cov = out
+        res.T_std = out['T_std']
+        res.coefs_std = out['coefs_std']
+        return res
+
+    # --------------------------------------------------
+
+    def covariance(self, param):
+        '''Linearized covariance at the optimum, s2 * inv(J.T J) with
+        s2 = sum(r**2) / (k - n) as in fit_utils.covariance. The T block
+        of J.T J is diagonal, so the inverse is obtained from the Schur
+        complement (cost linear in K).
+
+        returns => dict with coefs (covariance of the coefs, degree x
+                   degree), T_std, coefs_std, T_coefs (covariance of the
+                   T_k with the coefs, K x degree), s2 and dof '''
+
+        r = self.residual_vector(param)
+        dT, dc = self._blocks(param)
+        D = np.einsum('kp,kp->k', dT, dT)                 # T block
+        B = np.einsum('kp,kpn->kn', dT, dc)               # T - coefs
+        C = np.einsum('kpn,kpm->nm', dc, dc)              # coefs block
+
+        dof = max(r.size - self.n_param, 1)
+        s2 = float(np.sum(r * r)) / dof
+
+        with np.errstate(divide='ignore'):
+            Dinv = np.where(D > 0, 1.0 / D, 0.0)
+        schur = C - B.T @ (Dinv[:, None] * B)
+        cov_c = np.linalg.pinv(schur)
+        DB = Dinv[:, None] * B
+        cov_Tc = -DB @ cov_c
+        var_T = Dinv + np.einsum('kn,nm,km->k', DB, cov_c, DB)
+
+        return {'coefs': s2 * cov_c,
+                'T_coefs': s2 * cov_Tc,
+                'T_std': np.sqrt(np.maximum(s2 * var_T, 0.0)),
+                'coefs_std': np.sqrt(np.maximum(s2 * np.diag(cov_c), 0.0)),
+                's2': s2,
+                'dof': dof}
+
+    # --------------------------------------------------
+
+    def curve(self, param, x):
+        '''Correction curve (C2) of the shared coefs on the x-axis'''
+
+        return 1 + self.split(param)[1] @ self.problem.basis_terms(x).T
+
+    def curve_std(self, cov, x):
+        '''Standard error of the correction curve on the x-axis, from
+        the covariance of the coefs (output of covariance)'''
+
+        B = self.problem.basis_terms(x)
+        return np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', B, cov['coefs'],
+                                            B), 0.0))
+
+# ------------------------------------------------------
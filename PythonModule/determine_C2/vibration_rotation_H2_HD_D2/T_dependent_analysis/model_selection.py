@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for selecting the degree of the sensitivity polynomial.
+
+Degrees are fitted in increasing order, each one starting from the
+optimum of the previous degree with the additional coefficient set to
+zero. For every degree the information criteria (AIC, BIC), the reduced
+chi-square of the weighted residual elements and the F-test against the
+previous degree are obtained. The chain stops as soon as a higher degree
+does not improve the chosen criterion."""
+
+import numpy as np
+from scipy import stats
+
+import warm_start
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# statistics(problem, param)
+#    AIC, BIC, reduced chi-square for the optimum of a problem
+
+# select_degree(gen_problem, param_init, max_degree=5, criterion='bic')
+#    Fit increasing degrees with warm starts until no improvement
+
+# ------------------------------------------------------
+
+
+def statistics(problem, param):
+    '''Statistics of the fit at param, from the weighted residual
+    elements r (see CalibrationProblem.residual_vector)
+
+    returns => dict with n (number of elements), k (number of param),
+               rss = sum(r**2), aic, bic and chi2_red = rss/(n-k) '''
+
+    r = problem.residual_vector(param)
+    n = r.shape[0]
+    k = np.asarray(param).shape[0]
+    rss = float(np.dot(r, r))
+
+    return {'n': n, 'k': k, 'rss': rss,
+            'aic': n * np.log(rss / n) + 2 * k,
+            'bic': n * np.log(rss / n) + k * np.log(n),
+            'chi2_red': rss / max(n - k, 1)}
+
+# ------------------------------------------------------
+
+
+def f_test(previous, present):
+    '''F-test for one additional coefficient, between the statistics of
+    two nested fits
+
+    returns => (F, p-value) '''
+
+    dof = max(present['n'] - present['k'], 1)
+    dk = present['k'] - previous['k']
+    F = ((previous['rss'] - present['rss']) / dk) / (present['rss'] / dof)
+    return F, float(stats.f.sf(F, dk, dof))
+
+# ------------------------------------------------------
+
+
+def select_degree(gen_problem, param_init, max_degree=5, criterion='bic',
+                  alpha=0.05, min_degree=None, fit_options=None):
+    '''Fit degrees in increasing order and select the degree
+
+    gen_problem = function returning the CalibrationProblem for a degree
+    param_init  = initial [T, c1, ...] for the lowest degree (its length
+                  sets the lowest degree, unless min_degree is given)
+    max_degree  = highest degree tried
+    criterion   = 'aic' or 'bic' : stop when the criterion increases
+                  'ftest'        : stop when the additional coefficient
+                                   is not significant (p-value > alpha)
+    fit_options = dict, passed to fit_utils.minimize
+
+    returns => dict with
+                 degree = selected degree
+                 param  = optimum of the selected degree
+                 table  = list of dict for every fitted degree (degree,
+                          param, residual, nit, rss, aic, bic, chi2_red,
+                          F, p_value) '''
+
+    if criterion not in ('aic', 'bic', 'ftest'):
+        raise ValueError("criterion should be 'aic', 'bic' or 'ftest'")
+
+    param = np.asarray(param_init, dtype=np.float64)
+    if min_degree is not None and min_degree > param.shape[0] - 1:
+        param = np.concatenate((param, np.zeros(min_degree + 1
+                                                - param.shape[0])))
+    degree = param.shape[0] - 1
+
+    table = []
+    best = None
+    first = True
+    while degree <= max_degree:
+        problem = gen_problem(degree)
+        options = dict(fit_options or {})
+        if not first:
+            options.setdefault('simplex_step', warm_start.default_step(param))
+        res = problem.fit(param, **options)
+
+        row = statistics(problem, res.x)
+        row.update({'degree': degree, 'param': res.x,
+                    'residual': float(res.fun), 'nit': int(res.nit),
+                    'F': np.nan, 'p_value': np.nan})
+        if table:
+            row['F'], row['p_value'] = f_test(table[-1], row)
+        table.append(row)
+
+        if best is None:
+            better = True
+        elif criterion == 'ftest':
+            better = row['p_value'] <= alpha
+        else:
+            better = row[criterion] < best[criterion]
+
+        if not better:
+            break
+        best = row
+
+        # next degree starts from this optimum, additional coef is zero
+        param = np.append(res.x, 0.0)
+        degree = degree + 1
+        first = False
+
+    return {'degree': best['degree'], 'param': best['param'],
+            'criterion': criterion, 'table': table}
+
+# ------------------------------------------------------
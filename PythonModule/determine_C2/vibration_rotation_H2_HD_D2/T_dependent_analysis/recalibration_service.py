@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module implementing the online recalibration of C2 from band areas
+measured continuously on a reference cell (H2, HD, D2).
+
+The CalibrationProblem is kept in memory. New band areas are averaged
+with the previous ones, using exponential forgetting or a sliding
+window, and only the experimental ratio matrices and weights are
+updated. A fit, warm started from the previous optimum, is run only
+when the averaged band areas have changed significantly since the
+last fit. Every new correction is published atomically : the result
+is replaced as a whole, and written to file via a temporary file."""
+
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+from collections import deque
+import numpy as np
+
+import warm_start
+
+log = logging.getLogger(__name__)
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS/CLASSES TO USER :
+
+# BandAreaAverage(n_bands, forgetting=None, window=None)
+#    Running average of the band areas of one species
+
+# RecalibrationService(problem, param, xaxis, forgetting=0.9, window=None,
+#                      threshold=2e-3, publish=None, output=None)
+#    update(H2=..., HD=..., D2=...)   : add measurement, refit if needed
+#    start() / submit(...) / stop()   : same, in a background thread
+#    current                          : last published result
+
+# ------------------------------------------------------
+
+
+class BandAreaAverage:
+    '''Running average of the band areas (and errors) of one species
+
+    n_bands    = number of bands
+    forgetting = factor (0 to 1) applied to the previous measurements
+                 for each new measurement (exponential forgetting)
+    window     = number of last measurements averaged (sliding window),
+                 used when forgetting is not given '''
+
+    def __init__(self, n_bands, forgetting=None, window=None):
+        if forgetting is None and window is None:
+            raise ValueError('Set either forgetting or window')
+        self.forgetting = forgetting
+        self.window = window
+        self.count = 0
+
+        self._sum = np.zeros(n_bands)
+        self._sum_err2 = np.zeros(n_bands)
+        self._weight = 0.0
+        self._weight2 = 0.0
+        self._items = deque()
+
+    # --------------------------------------------------
+
+    def add(self, areas, errors=None):
+        '''Add one measurement of the band areas (and errors)'''
+
+        areas = np.asarray(areas, dtype=np.float64)
+        err2 = np.zeros_like(areas) if errors is None else \
+            np.square(np.asarray(errors, dtype=np.float64))
+
+        if self.forgetting is not None:
+            f = self.forgetting
+            self._sum = f * self._sum + areas
+            self._sum_err2 = f * self._sum_err2 + err2
+            self._weight = f * self._weight + 1.0
+            self._weight2 = f * f * self._weight2 + 1.0
+        else:
+            self._items.append((areas, err2))
+            self._sum = self._sum + areas
+            self._sum_err2 = self._sum_err2 + err2
+            if len(self._items) > self.window:
+                old_areas, old_err2 = self._items.popleft()
+                self._sum = self._sum - old_areas
+                self._sum_err2 = self._sum_err2 - old_err2
+            self._weight = float(len(self._items))
+            self._weight2 = self._weight
+        self.count = self.count + 1
+
+    # --------------------------------------------------
+
+    def mean(self):
+        '''returns => 2D array, ( band area | error ) of the average '''
+
+        if self._weight == 0.0:
+            raise ValueError('No measurement added')
+        area = self._sum / self._weight
+        # error of the weighted mean, n_eff = weight**2/weight2
+        error = np.sqrt(np.maximum(self._sum_err2, 0.0) / self._weight
+                        * self._weight2 / self._weight**2)
+        return np.column_stack((area, error))
+
+# ------------------------------------------------------
+
+
+def _split(measurement):
+    '''areas and errors from a measurement : 2D ( area | error ) array,
+    or vector of areas'''
+    arr = np.asarray(measurement, dtype=np.float64)
+    if arr.ndim == 2:
+        return arr[:, 0], arr[:, 1]
+    return arr, None
+
+# ------------------------------------------------------
+
+
+def relative_change(old, new):
+    '''Largest change in the band areas, relative, after removing the
+    overall scale (only ratios of band areas enter the fit)'''
+    d = np.log(np.asarray(new)) - np.log(np.asarray(old))
+    return float(np.amax(np.abs(d - np.mean(d))))
+
+# ------------------------------------------------------
+
+
+class RecalibrationService:
+    '''Online recalibration of C2
+
+    problem    = CalibrationProblem, holding the present band areas
+    param      = present optimum [T, c1, ...] (for example,
+                 fit_results['cubic'].x from genC2_VR_T_dep_para)
+    xaxis      = x-axis on which the correction curve is published
+    forgetting = factor for exponential forgetting of previous band
+                 areas (set to None to use the sliding window)
+    window     = number of measurements in the sliding window
+    threshold  = relative change of the averaged band areas (see
+                 relative_change) above which the fit is repeated
+    publish    = function or list of functions, called with the result
+                 (dict) after every fit, for example
+                 lambda r: live.swap_correction(C0_C1, r['curve'])
+    output     = filename (npz) to which every result is written
+    fit_options = dict, passed to fit_utils.minimize '''
+
+    def __init__(self, problem, param, xaxis, forgetting=0.9, window=None,
+                 threshold=2e-3, publish=None, output=None,
+                 fit_options=None):
+
+        self.problem = problem
+        self.xaxis = np.asarray(xaxis, dtype=np.float64)
+        self.threshold = threshold
+        self.output = output
+        self.fit_options = dict(fit_options or {})
+        if publish is None:
+            publish = []
+        self.publish = publish if isinstance(publish, (list, tuple)) \
+            else [publish]
+
+        self.n_failed = 0
+        self.average = {}
+        for name in problem.species:
+            avg = BandAreaAverage(problem.data[name].shape[0],
+                                  forgetting=forgetting, window=window)
+            avg.add(*_split(problem.data[name]))
+            self.average[name] = avg
+
+        self._fitted_areas = {name: problem.data[name][:, 0].copy()
+                              for name in problem.species}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self.n_fits = 0
+
+        param = np.asarray(param, dtype=np.float64)
+        self._current = self._result(param, problem.residual(param))
+
+    # --------------------------------------------------
+
+    def _result(self, param, residual):
+        return {'param': param,
+                'residual': float(residual),
+                'curve': self.problem.curve(param, self.xaxis),
+                'time': time.time(),
+                'n_measurements': min(a.count for a in self.average.values()),
+                'version': self.n_fits}
+
+    @property
+    def current(self):
+        '''last published result, dict with param, residual, curve,
+        time, n_measurements and version'''
+        return self._current
+
+    # --------------------------------------------------
+
+    def change(self):
+        '''Largest relative change in the averaged band areas since
+        the last fit'''
+        return max(relative_change(self._fitted_areas[name],
+                                   self.average[name].mean()[:, 0])
+                   for name in self.problem.species)
+
+    # --------------------------------------------------
+
+    def _check(self, measurement):
+        '''raise KeyError for species which are not in the problem'''
+        unknown = sorted(set(measurement) - set(self.average))
+        if unknown:
+            raise KeyError('Species not in the problem : {0}, expected '
+                           'one of {1}'.format(', '.join(unknown),
+                                               ', '.join(self.average)))
+
+    def _add(self, measurement):
+        self._check(measurement)
+        for name, value in measurement.items():
+            self.average[name].add(*_split(value))
+
+    # --------------------------------------------------
+
+    def update(self, force=False, **measurement):
+        '''Add a measurement of band areas, for example
+        update(HD=array, D2=array), each a 2D array ( band area | error )
+        or a vector of band areas. The fit is repeated when the change
+        in band areas is above the threshold (or when force is True).
+        A fit which did not converge (res.success is False) is not
+        published, and is repeated with the next measurement.
+
+        raises  => KeyError for a species not in the problem
+        returns => True if a new correction was published '''
+
+        with self._lock:
+            self._add(measurement)
+
+            change = self.change()
+            if not force and change < self.threshold:
+                return False
+
+            self.problem.set_data(**{name: avg.mean() for name, avg
+                                     in self.average.items()})
+            param = self._current['param']
+            options = dict(self.fit_options)
+            options.setdefault('simplex_step', warm_start.default_step(param))
+            res = self.problem.fit(param, **options)
+
+            if not res.success:
+                self.n_failed = self.n_failed + 1
+                log.warning('Recalibration not published, the fit did not '
+                            'converge : %s (change = %.3e, T = %.4f, '
+                            'residual = %.6e, nit = %d)', res.message,
+                            change, res.x[0], res.fun, res.nit)
+                return False
+
+            self.n_fits = self.n_fits + 1
+            result = self._result(res.x, res.fun)
+            result['change'] = change
+            result['nit'] = res.nit
+            self._fitted_areas = {name: self.problem.data[name][:, 0].copy()
+                                  for name in self.problem.species}
+
+            self._write(result)
+            self._current = result        # atomic, reference assignment
+
+        log.info('Recalibration %d : change = %.3e, T = %.4f, residual = '
+                 '%.6e, nit = %d', self.n_fits, change, res.x[0], res.fun,
+                 res.nit)
+        for func in self.publish:
+            func(result)
+        return True
+
+    # --------------------------------------------------
+
+    def _write(self, result):
+        '''write the result to output (npz), via a temporary file'''
+
+        if self.output is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.output))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, param=result['param'],
+                         residual=result['residual'],
+                         curve=result['curve'], xaxis=self.xaxis,
+                         time=result['time'], version=result['version'])
+            os.replace(tmp, self.output)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # --------------------------------------------------
+    #     background thread
+    # --------------------------------------------------
+
+    def submit(self, **measurement):
+        '''Queue a measurement, processed by the background thread
+
+        raises => KeyError for a species not in the problem '''
+        self._check(measurement)
+        self._queue.put(measurement)
+
+    def start(self):
+        '''Start the background thread processing submitted
+        measurements'''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''Process the queued measurements and stop the thread'''
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            measurement = self._queue.get()
+            if measurement is None:
+                break
+            # when measurements accumulate, average all of them before
+            # deciding on a fit
+            pending = [measurement]
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                pending.append(item)
+            try:
+                for item in pending[:-1]:
+                    with self._lock:
+                        self._add(item)
+                self.update(**pending[-1])
+            except Exception:      # keep the service running
+                log.exception('Recalibration failed')
+
+# ------------------------------------------------------
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module with the bases for the polynomial describing the wavelength
+sensitivity, C2(x) = 1 + sum c_k * t_k(x).
+
+    monomial  : t_k = ((x-scenter)**k) / scale_k
+    chebyshev : t_k = T_k(u) - T_k(u_ref)
+    legendre  : t_k = P_k(u) - P_k(u_ref)
+
+For the orthogonal bases, u is x mapped from the domain (range of the
+band positions) to [-1, 1] and u_ref is scenter mapped the same way, so
+that C2(scenter) = 1 for every basis (normalization of the sensitivity,
+as for the monomials). The orthogonal bases do not need scale factors
+and remain well conditioned for higher degrees."""
+
+# The same module is in determine_C2/rotationalRaman_H2_HD_D2/t_dependent/
+# and determine_C2/vibration_rotation_H2_HD_D2/T_dependent_analysis/ (the
+# modules are copied in each directory, as utils.py), keep both copies
+# identical.
+
+import numpy as np
+from numpy.polynomial import chebyshev, legendre
+
+# ------------------------------------------------------
+
+bases = ('monomial', 'chebyshev', 'legendre')
+
+_vander = {'chebyshev': chebyshev.chebvander,
+           'legendre': legendre.legvander}
+
+# absolute step of the coefs in the initial simplex of Nelder-Mead, for
+# the orthogonal bases. The coefs are then of the order of the change of
+# the sensitivity over the domain, and a coef started at zero would
+# otherwise only get the very small default step of scipy
+coef_step = 0.05
+
+# ------------------------------------------------------
+
+
+def band_domain(*computed):
+    '''Domain (min, max) of the band positions, from computed spectra
+    (2D arrays, positions in column 1)'''
+
+    positions = np.concatenate([np.asarray(c)[:, 1] for c in computed])
+    return (float(np.amin(positions)), float(np.amax(positions)))
+
+# ------------------------------------------------------
+
+
+def to_unit(x, domain):
+    '''map x from domain to [-1, 1]'''
+    a, b = domain
+    return (2.0 * np.asarray(x, dtype=np.float64) - (a + b)) / (b - a)
+
+# ------------------------------------------------------
+
+
+def terms(x, degree, basis='monomial', scales=None, scenter=0.0,
+          domain=None):
+    '''Terms t_1 to t_degree of the sensitivity polynomial on x
+
+    scales = scale_1 to scale_degree (monomial only)
+    domain = (min, max) mapped to [-1, 1] (chebyshev and legendre)
+
+    returns => array (len(x), degree) '''
+
+    x = np.asarray(x, dtype=np.float64)
+
+    if basis == 'monomial':
+        xs = x - scenter
+        return xs[..., None]**np.arange(1, degree + 1) \
+            / np.asarray(scales, dtype=np.float64)[:degree]
+
+    if basis not in _vander:
+        raise ValueError('basis should be one of {0}'.format(bases))
+    if domain is None:
+        raise ValueError('domain is required for the {0} basis'
+                         .format(basis))
+
+    vander = _vander[basis]
+    t = vander(to_unit(x, domain), degree)[..., 1:]
+    t_ref = vander(to_unit(scenter, domain), degree)[..., 1:]
+    return t - t_ref
+
+# ------------------------------------------------------
+
+
+def curve(coefs, x, basis='monomial', scales=None, scenter=0.0,
+          domain=None):
+    '''Sensitivity curve, 1 + sum c_k * t_k(x)'''
+
+    coefs = np.asarray(coefs, dtype=np.float64)
+    return 1.0 + terms(x, coefs.shape[-1], basis, scales, scenter,
+                       domain) @ coefs
+
+# ------------------------------------------------------
+
+
+def simplex_step(param, basis, rel_step_T=0.05):
+    '''Step for the initial simplex of Nelder-Mead (see
+    fit_utils.minimize), param = [T, c1, ...]
+
+    returns => vector of steps, or None for the monomial basis (default
+               simplex of scipy) '''
+
+    if basis == 'monomial':
+        return None
+    param = np.asarray(param, dtype=np.float64)
+    step = np.full(param.shape[0], coef_step)
+    step[0] = rel_step_T * param[0]
+    return step
+
+# ------------------------------------------------------
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module generating synthetic (perturbed model) band areas, as in
+testing_with_model_data/generate_perturbed_model_data.ipynb, for many
+datasets at once.
+
+The true band areas are the intensities computed at the temperature T
+(compute_series_para or compute_series_perp, through
+calibration_problem.computed_spectra) multiplied by a known sensitivity
+polynomial (see sensitivity_basis) and by an amplitude. Each dataset
+adds noise drawn from the noise model :
+
+    relative : error = noise_level * area
+    absolute : error = noise_level * amplitude (same for all bands)
+    shot     : error = noise_level * sqrt(area)  (as in the notebook)
+
+and area = true area + error * N(0, 1), kept positive. All datasets of
+a species are drawn with a single call of the random generator. Every
+species has its own stream derived from the seed, so the datasets of a
+species do not change when other species are added."""
+
+import json
+import numpy as np
+
+import calibration_problem
+import sensitivity_basis
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# generate_datasets(n_datasets, coefs, T=299.0, species=('H2', 'HD', 'D2'),
+#                   J=None, polarization='para', noise='relative',
+#                   noise_level=None, seed=None, ...)
+#    Perturbed band areas ( area | error ), (n_datasets, n_bands, 2) for
+#    every species
+
+# dataset(sets, index)
+#    One dataset as dict of 2D arrays, for CalibrationProblem or set_data
+
+# save_datasets(sets, filename) / load_datasets(filename)
+#    All datasets in a .npz file
+
+# export_dataset(sets, index, filenames)
+#    One dataset as text files, as read by the genC2 modules
+
+# ------------------------------------------------------
+
+noise_models = ('relative', 'absolute', 'shot')
+
+# default noise_level of each noise model
+default_noise_level = {'relative': 0.0175, 'absolute': 0.01, 'shot': 0.25}
+
+# order of the species for the random streams
+_stream = {'H2': 0, 'HD': 1, 'D2': 2}
+
+# ------------------------------------------------------
+
+
+def true_areas(coefs, T=299.0, species=('H2', 'HD', 'D2'), J=None,
+               polarization='para', scenter=3316.3, scales=None,
+               basis='monomial', domain=None, amplitude=1000.0):
+    '''Band areas without noise : computed intensity at T times the
+    sensitivity 1 + sum c_k * t_k(position), times amplitude
+
+    scales = scale_1 to scale_degree of the monomial basis. When not
+             given, obtained as in CalibrationProblem from the band
+             positions
+    domain = (min, max) for the chebyshev and legendre bases (default :
+             range of the band positions)
+
+    returns => (dict with, per species, true (areas), positions, J
+               (column J of the computed spectra) and sensitivity,
+               scales, domain) '''
+
+    J = dict(calibration_problem.default_J, **(J or {}))
+    coefs = np.asarray(coefs, dtype=np.float64)
+    degree = coefs.shape[0]
+
+    spectra = {name: calibration_problem.computed_spectra(
+        name, T, J[name], polarization) for name in species}
+    positions = np.concatenate([spectra[n][:, 1] for n in species])
+
+    if scales is None and basis == 'monomial':
+        magn = np.floor(np.log10(np.amax(positions - scenter)))
+        scales = (10**magn)**np.arange(1, degree + 1)
+    if domain is None:
+        domain = (float(np.amin(positions)), float(np.amax(positions)))
+
+    out = {}
+    for name in species:
+        s = spectra[name]
+        sens = sensitivity_basis.curve(coefs, s[:, 1], basis, scales,
+                                       scenter, domain)
+        out[name] = {'true': amplitude * s[:, 2] * sens,
+                     'positions': s[:, 1],
+                     'J': s[:, 0],
+                     'sensitivity': sens}
+    return out, scales, domain
+
+# ------------------------------------------------------
+
+
+def generate_datasets(n_datasets, coefs, T=299.0, species=('H2', 'HD', 'D2'),
+                      J=None, polarization='para', noise='relative',
+                      noise_level=None, seed=None, scenter=3316.3,
+                      scales=None, basis='monomial', domain=None,
+                      amplitude=1000.0):
+    '''n_datasets perturbed sets of band areas
+
+    coefs       = coefs c1, ... of the true sensitivity polynomial
+    T           = temperature (K) of the computed intensities
+    species     = species generated ('H2', 'HD', 'D2')
+    J           = dict of (OJ, QJ) for H2 and (OJ, QJ, SJ) for HD and D2
+                  (default : calibration_problem.default_J)
+    polarization= 'para' or 'perp' (row of Q(J=0) removed, as in the
+                  genC2 modules)
+    noise       = 'relative', 'absolute' or 'shot' (see above)
+    noise_level = factor of the noise model (default :
+                  default_noise_level)
+    seed        = seed of the random numbers
+    amplitude   = factor of the computed intensities (fractions of the
+                  population) giving the band areas
+
+    returns => dict with
+                 data        = dict of (n_datasets, n_bands, 2) arrays,
+                               ( area | error ) for every species
+                 true        = dict of the band areas without noise
+                 positions, J, sensitivity = dict, per species
+                 param       = true [T, c1, ...]
+                 and the arguments : polarization, J_range, noise,
+                 noise_level, seed, scenter, scales, basis, domain '''
+
+    if noise not in noise_models:
+        raise ValueError('noise should be one of {0}'.format(noise_models))
+    if noise_level is None:
+        noise_level = default_noise_level[noise]
+    for name in species:
+        if name not in _stream:
+            raise ValueError('species should be H2, HD or D2')
+
+    model, scales, domain = true_areas(coefs, T, species, J, polarization,
+                                       scenter, scales, basis, domain,
+                                       amplitude)
+    streams = np.random.SeedSequence(seed).spawn(len(_stream))
+
+    data = {}
+    for name in species:
+        true = model[name]['true']
+        if noise == 'relative':
+            error = noise_level * np.abs(true)
+        elif noise == 'absolute':
+            error = np.full(true.shape, noise_level * amplitude)
+        else:
+            error = noise_level * np.sqrt(np.abs(true))
+
+        rng = np.random.default_rng(streams[_stream[name]])
+        draws = rng.standard_normal((n_datasets, true.shape[0]))
+        draws *= error
+        draws += true
+        # areas must remain positive
+        np.maximum(draws, 1e-3 * np.abs(true), out=draws)
+        out = np.empty((n_datasets, true.shape[0], 2))
+        out[:, :, 0] = draws
+        out[:, :, 1] = error
+        data[name] = out
+
+    return {'data': data,
+            'true': {n: model[n]['true'] for n in species},
+            'positions': {n: model[n]['positions'] for n in species},
+            'J': {n: model[n]['J'] for n in species},
+            'sensitivity': {n: model[n]['sensitivity'] for n in species},
+            'param': np.concatenate(([float(T)],
+                                     np.asarray(coefs, dtype=np.float64))),
+            'polarization': polarization,
+            'J_range': dict(calibration_problem.default_J, **(J or {})),
+            'noise': noise, 'noise_level': noise_level, 'seed': seed,
+            'scenter': scenter,
+            'scales': None if scales is None else np.asarray(scales),
+            'basis': basis, 'domain': domain}
+
+# ------------------------------------------------------
+
+
+def dataset(sets, index):
+    '''Dataset index of the output of generate_datasets
+
+    returns => dict of 2D arrays ( area | error ), for example
+               CalibrationProblem(dataset(sets, 0), degree) or
+               problem.set_data(**dataset(sets, 1)) '''
+
+    return {name: arr[index] for name, arr in sets['data'].items()}
+
+# ------------------------------------------------------
+
+
+def save_datasets(sets, filename):
+    '''Save the output of generate_datasets as .npz'''
+
+    arrays = {}
+    for key in ('data', 'true', 'positions', 'J', 'sensitivity'):
+        for name, arr in sets[key].items():
+            arrays['{0}_{1}'.format(key, name)] = arr
+    arrays['param'] = sets['param']
+    arrays['domain'] = np.asarray(sets['domain'])
+    if sets['scales'] is not None:
+        arrays['scales'] = sets['scales']
+    for key in ('polarization', 'noise', 'basis'):
+        arrays[key] = np.array(sets[key])
+    arrays['noise_level'] = np.array(sets['noise_level'])
+    arrays['scenter'] = np.array(sets['scenter'])
+    arrays['seed'] = np.array(-1 if sets['seed'] is None else sets['seed'])
+    arrays['J_range'] = np.array(json.dumps(sets['J_range']))
+    np.savez_compressed(filename, **arrays)
+
+
+def load_datasets(filename):
+    '''Read a file written by save_datasets'''
+
+    out = {'data': {}, 'true': {}, 'positions': {}, 'J': {},
+           'sensitivity': {}}
+    with np.load(filename) as f:
+        for key in f.files:
+            head, _, name = key.rpartition('_')
+            if head in out and name in _stream:
+                out[head][name] = f[key]
+        out['param'] = f['param']
+        out['domain'] = tuple(f['domain'])
+        out['scales'] = f['scales'] if 'scales' in f.files else None
+        for key in ('polarization', 'noise', 'basis'):
+            out[key] = str(f[key])
+        out['noise_level'] = float(f['noise_level'])
+        out['scenter'] = float(f['scenter'])
+        seed = int(f['seed'])
+        out['seed'] = None if seed < 0 else seed
+        out['J_range'] = {name: tuple(value) for name, value in
+                          json.loads(str(f['J_range'])).items()}
+    return out
+
+
+def export_dataset(sets, index, filenames):
+    '''Write dataset index as text files ( area | error ), the format
+    read by the genC2 modules
+
+    filenames = dict, for example {'H2': 'BA_H2_1', 'HD': 'BA_HD_1',
+                                   'D2': 'BA_D2_1'} '''
+
+    for name, filename in filenames.items():
+        np.savetxt(filename, sets['data'][name][index])
+
+# ------------------------------------------------------
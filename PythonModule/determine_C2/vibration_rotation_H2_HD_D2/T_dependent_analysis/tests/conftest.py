@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""Fixtures for the tests of T_dependent_analysis.
+
+The fit modules load the band areas from the working directory when
+imported (the energy levels are read relative to the modules), and the
+fits write their output files there. The tests are therefore run in a
+temporary directory holding the example band areas. Modules reading
+files at import are imported through the fixtures."""
+
+import os
+import sys
+import shutil
+import importlib
+import contextlib
+import io
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_DIR = os.path.dirname(HERE)
+
+if MODULE_DIR not in sys.path:
+    sys.path.insert(0, MODULE_DIR)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def workdir(tmp_path_factory):
+    '''temporary working directory with the example data'''
+
+    path = tmp_path_factory.mktemp('T_dependent_analysis')
+    example = os.path.join(MODULE_DIR, 'example')
+    for name in os.listdir(example):
+        src = os.path.join(example, name)
+        if os.path.isfile(src):
+            shutil.copy(src, str(path))
+
+    cwd = os.getcwd()
+    os.chdir(str(path))
+    yield path
+    os.chdir(cwd)
+
+
+def _import(name):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return importlib.import_module(name)
+
+
+@pytest.fixture(scope='session')
+def para(workdir):
+    '''genC2_VR_T_dep_para, imported with the example band areas'''
+    return _import('genC2_VR_T_dep_para')
+
+
+@pytest.fixture(scope='session')
+def calibration_problem(workdir):
+    return _import('calibration_problem')
+
+
+@pytest.fixture(scope='session')
+def example_data(para):
+    '''example band areas (parallel polarization)'''
+    return {'H2': para.dataH2, 'HD': para.dataHD, 'D2': para.dataD2}
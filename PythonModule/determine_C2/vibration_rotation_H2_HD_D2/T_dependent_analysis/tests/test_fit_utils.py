@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import fit_utils
+
+x = np.linspace(-1.0, 1.0, 50)
+
+
+def quadratic(param):
+    '''residual with its minimum at [300, 0.1, -0.2]'''
+    d = np.asarray(param) - [300.0, 0.1, -0.2]
+    return float(d[0]**2 * 1e-2 + d[1]**2 + d[2]**2)
+
+
+def test_initial_simplex():
+    simplex = fit_utils.initial_simplex([300.0, 0.0], [5.0, 0.1])
+    np.testing.assert_array_equal(simplex, [[300.0, 0.0], [305.0, 0.0],
+                                            [300.0, 0.1]])
+
+
+def test_converged_fit():
+    res = fit_utils.minimize(quadratic, [290.0, 0.0, 0.0],
+                             simplex_step=[5.0, 0.05, 0.05])
+    assert res.success
+    np.testing.assert_allclose(res.x, [300.0, 0.1, -0.2], atol=1e-3)
+    # best residual per iteration
+    assert res.trace.shape[1] == 4
+    assert np.all(np.diff(res.trace[:, 3]) <= 0.0)
+
+
+def test_deadline():
+    res = fit_utils.minimize(quadratic, [290.0, 0.0, 0.0], deadline=0.0)
+    assert not res.success
+    assert res.message == fit_utils.deadline_message
+    np.testing.assert_array_equal(res.x, [290.0, 0.0, 0.0])
+
+
+def test_maxfev_returns_best_so_far():
+    init = [290.0, 0.0, 0.0]
+    res = fit_utils.minimize(quadratic, init, maxfev=30,
+                             simplex_step=[5.0, 0.05, 0.05])
+    assert not res.success
+    assert res.nfev <= 32
+    assert quadratic(res.x) == res.fun
+    assert res.fun < quadratic(init)
+
+
+def test_curve_tol_stops_early():
+    def curve(param):
+        return 1.0 + param[1] * x + param[2] * x**2
+
+    init = [290.0, 0.0, 0.0]
+    step = [5.0, 0.05, 0.05]
+    full = fit_utils.minimize(quadratic, init, simplex_step=step)
+    res = fit_utils.minimize(quadratic, init, simplex_step=step,
+                             curve=curve, curve_tol=1e-4, T_tol=0.5)
+    assert res.success
+    assert res.message == fit_utils.curve_message
+    assert res.nfev < full.nfev
+    assert np.amax(np.abs(curve(res.x) - curve(full.x))) < 1e-3
+    assert abs(res.x[0] - 300.0) < 0.5
+
+
+def test_curve_tol_requires_curve():
+    with pytest.raises(ValueError):
+        fit_utils.minimize(quadratic, [290.0, 0.0, 0.0], curve_tol=1e-4)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import joint_fit
+import synthetic_data
+
+coefs = [-0.05, 0.01]
+
+
+@pytest.fixture(scope='module')
+def joint(workdir):
+    out = synthetic_data.generate_datasets(4, coefs, T=299.0, seed=3)
+    return joint_fit.JointCalibrationProblem(out['data'], 2)
+
+
+def test_residual_vector_matches_single_problems(joint, calibration_problem):
+    param = np.array([298.0, 301.0, 299.5, 300.0, -0.04, 0.012])
+    r = joint.residual_vector(param)
+    assert r.shape == (4, joint.n_pairs)
+    for k, ds in enumerate(joint.datasets):
+        single = calibration_problem.CalibrationProblem(
+            ds, 2, norm='frobenius_square')
+        np.testing.assert_allclose(r[k], single.residual_vector(
+            joint.param(param, k)[None, :])[0], rtol=1e-10, atol=1e-14)
+    assert joint.residual(param) == pytest.approx(np.sum(r * r))
+
+
+def test_jacobian_matches_finite_differences(joint):
+    param = np.array([298.0, 301.0, 299.5, 300.0, -0.04, 0.012])
+    J = joint.jacobian(param).toarray()
+    h = 1e-6 * np.maximum(np.abs(param), 1e-3)
+    for i in range(param.shape[0]):
+        up = param.copy()
+        down = param.copy()
+        up[i] += h[i]
+        down[i] -= h[i]
+        fd = (joint.residual_vector(up) - joint.residual_vector(down)) \
+            .ravel() / (2 * h[i])
+        np.testing.assert_allclose(J[:, i], fd, rtol=1e-5, atol=1e-9)
+
+
+def test_fit_and_covariance(joint):
+    res = joint.fit(300.0, [0.0, 0.0])
+    assert res.success
+    np.testing.assert_allclose(res.T, 299.0, atol=1.0)
+    np.testing.assert_allclose(res.coefs, coefs, atol=5e-3)
+
+    # Schur complement against the dense covariance
+    J = joint.jacobian(res.x).toarray()
+    cov = res.cov['s2'] * np.linalg.pinv(J.T @ J)
+    np.testing.assert_allclose(res.T_std, np.sqrt(np.diag(cov)[:4]),
+                               rtol=1e-6)
+    np.testing.assert_allclose(res.cov['coefs'], cov[4:, 4:], rtol=1e-6,
+                               atol=1e-20)
+    np.testing.assert_allclose(res.cov['T_coefs'], cov[:4, 4:], rtol=1e-6,
+                               atol=1e-20)
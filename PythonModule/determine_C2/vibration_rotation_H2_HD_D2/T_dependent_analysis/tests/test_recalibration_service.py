@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import recalibration_service
+
+
+@pytest.fixture
+def service(calibration_problem, example_data, para, tmp_path):
+    problem = calibration_problem.CalibrationProblem(
+        dict(example_data), 1, polarization='para', xaxis=para.xaxis)
+    published = []
+    svc = recalibration_service.RecalibrationService(
+        problem, [299.0, -0.045], para.xaxis, forgetting=0.5,
+        publish=published.append, output=str(tmp_path / 'C2_live.npz'),
+        fit_options={'maxiter': 2000})
+    svc.published = published
+    return svc
+
+
+def test_band_area_average_window():
+    avg = recalibration_service.BandAreaAverage(2, window=2)
+    avg.add([1.0, 2.0], [0.1, 0.1])
+    avg.add([3.0, 4.0], [0.1, 0.1])
+    avg.add([5.0, 6.0], [0.1, 0.1])
+    np.testing.assert_allclose(avg.mean()[:, 0], [4.0, 5.0])
+    np.testing.assert_allclose(avg.mean()[:, 1], 0.1 / np.sqrt(2.0))
+
+
+def test_unknown_species(service):
+    with pytest.raises(KeyError):
+        service.update(D2x=np.ones(3))
+    with pytest.raises(KeyError):
+        service.submit(H3=np.ones(3))
+
+
+def test_publish_only_converged(service, example_data):
+    D2 = example_data['D2'].copy()
+    D2[:, 0] = D2[:, 0] * np.linspace(1.0, 1.02, D2.shape[0])
+
+    # stopped by the deadline : not published, nor written
+    service.fit_options['deadline'] = 0.0
+    assert not service.update(D2=D2)
+    assert service.n_failed == 1
+    assert service.published == []
+    assert service.current['version'] == 0
+
+    # repeated with the next measurement
+    del service.fit_options['deadline']
+    assert service.update(D2=D2)
+    assert len(service.published) == 1
+    assert service.current['version'] == 1
+    saved = np.load(service.output)
+    np.testing.assert_array_equal(saved['param'], service.current['param'])
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import sensitivity_basis
+
+scales = np.array([1e4, 1e7, 1e9])
+scenter = 3316.3
+domain = (2300.0, 4200.0)
+x = np.linspace(2300.0, 4200.0, 120)
+
+
+@pytest.mark.parametrize('basis', sensitivity_basis.bases)
+def test_curve_is_one_at_center(basis):
+    out = sensitivity_basis.curve([0.3, -0.1, 0.05], np.array([scenter]),
+                                  basis, scales, scenter, domain)
+    assert out[0] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize('basis', ('chebyshev', 'legendre'))
+def test_orthogonal_spans_monomials(basis):
+    '''a monomial curve of degree 3 is represented exactly'''
+    mono = sensitivity_basis.curve([-0.05, 0.01, 0.002], x,
+                                   scales=scales, scenter=scenter)
+    t = sensitivity_basis.terms(x, 3, basis, scenter=scenter, domain=domain)
+    coefs = np.linalg.lstsq(t, mono - 1.0, rcond=None)[0]
+    np.testing.assert_allclose(
+        sensitivity_basis.curve(coefs, x, basis, scenter=scenter,
+                                domain=domain), mono, rtol=1e-10)
+
+
+def test_orthogonal_basis_requires_domain():
+    with pytest.raises(ValueError):
+        sensitivity_basis.terms(x, 2, 'chebyshev', scenter=scenter)
+    with pytest.raises(ValueError):
+        sensitivity_basis.terms(x, 2, 'hermite', domain=domain)
+
+
+def test_fit_does_not_depend_on_basis(calibration_problem, example_data,
+                                      para):
+    '''the bases span the same polynomials, so the fits agree'''
+
+    out = {}
+    for basis in sensitivity_basis.bases:
+        problem = calibration_problem.CalibrationProblem(
+            dict(example_data), 2, polarization='para', xaxis=para.xaxis,
+            basis=basis)
+        res = problem.fit([299.0, 0.0, 0.0], maxiter=20000)
+        out[basis] = (res.x[0], res.fun, problem.curve(res.x, para.xaxis))
+
+    T, fun, curve = out['monomial']
+    for basis in ('chebyshev', 'legendre'):
+        assert out[basis][0] == pytest.approx(T, abs=1e-3)
+        assert out[basis][1] == pytest.approx(fun, rel=1e-9)
+        np.testing.assert_allclose(out[basis][2], curve, rtol=1e-5)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import uncertainty
+
+
+@pytest.fixture(scope='module')
+def problem(calibration_problem, example_data):
+    return calibration_problem.CalibrationProblem(example_data, 1)
+
+
+@pytest.fixture(scope='module')
+def optimum(problem, para):
+    return problem.fit(np.array(para.param_linear)).x
+
+
+def test_accepted_refits():
+    params = np.array([[295.0, -0.05], [3.4e15, 1.0], [150.0, -0.05],
+                       [300.0, np.nan], [301.0, -0.06]])
+    fun = np.array([1.0, 2.0, 1.0, 1.0, np.inf])
+    success = np.array([True, True, True, True, True])
+    np.testing.assert_array_equal(
+        uncertainty.accepted_refits(params, fun, success),
+        [True, False, False, False, False])
+    success[0] = False
+    assert not np.any(uncertainty.accepted_refits(params, fun, success))
+
+
+def test_bootstrap_studentized(problem, optimum):
+    draws = uncertainty.draw_band_areas(problem, optimum, 500, 'bootstrap',
+                                        seed=1)
+    for name in problem.species:
+        areas = np.array([d[name][:, 0] for d in draws])
+        error = problem.data[name][:, 1]
+        # the spread of every band follows its error
+        ratio = np.std(areas, axis=0) / error
+        assert np.amax(ratio) / np.amin(ratio) < 3.0
+
+
+def test_parametric_zero_errors(problem, optimum, example_data):
+    data = {name: value.copy() for name, value in example_data.items()}
+    data['D2'][:, 1] = 0.0
+    problem.set_data(**data)
+    try:
+        with pytest.raises(ValueError):
+            uncertainty.draw_band_areas(problem, optimum, 5, 'parametric')
+        data['D2'][0, 1] = 1.0
+        problem.set_data(**data)
+        with pytest.raises(ValueError):
+            uncertainty.draw_band_areas(problem, optimum, 5, 'bootstrap')
+    finally:
+        problem.set_data(**example_data)
+
+
+def test_run_uncertainty_rejects(problem, optimum):
+    xaxis = np.linspace(2300.0, 4200.0, 20)
+    out = uncertainty.run_uncertainty(problem, optimum, xaxis, n_draws=12,
+                                      n_jobs=1, seed=2)
+    assert out['accepted'].shape == (12,)
+    assert out['n_rejected'] == 12 - np.count_nonzero(out['accepted'])
+    T = out['params'][out['accepted'], 0]
+    assert np.all((T >= 200.0) & (T <= 500.0))
+    assert out['curve_percentiles'].shape == (5, 20)
+
+    # nothing is accepted in an empty range of T
+    with pytest.raises(RuntimeError):
+        uncertainty.run_uncertainty(problem, optimum, xaxis, n_draws=4,
+                                    n_jobs=1, seed=2, T_bounds=(0.0, 1.0))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+import warm_start
+
+scales = np.array([1e4, 1e7, 1e9, 1e12, 1e14])
+scenter = 3316.3
+xaxis = np.linspace(2300.0, 4200.0, 400)
+
+
+def test_map_coefs_upward_is_exact():
+    out = warm_start.map_coefs([-0.04, 0.01], scales[:2], scenter, 4, scales,
+                               scenter, xaxis)
+    np.testing.assert_array_equal(out, [-0.04, 0.01, 0.0, 0.0])
+
+
+def test_map_coefs_downward_projects_curve():
+    coefs = np.array([-0.05, 0.002, 0.0])
+    out = warm_start.map_coefs(coefs, scales[:3], scenter, 1, scales,
+                               scenter, xaxis)
+    assert out.shape == (1,)
+    # the quadratic term is small, the linear term is kept
+    assert out[0] == pytest.approx(-0.05, rel=0.05)
+
+
+def test_prior_param_more_coefs_than_degree():
+    prior = [295.0, -0.05, 0.002, 0.001]
+    param = warm_start.prior_param(prior, 1, xaxis, scales, scenter)
+    assert param.shape == (2,)
+    assert param[0] == 295.0
+
+
+def test_prior_param_without_temperature():
+    class Model:
+        temperature = None
+        coefs = [-0.04]
+        scales = [1e4]
+        scenter = 3316.3
+
+    with pytest.raises(ValueError):
+        warm_start.prior_param(Model(), 2, xaxis, scales, scenter)
+    param = warm_start.prior_param(Model(), 2, xaxis, scales, scenter,
+                                   T_init=299.0)
+    np.testing.assert_allclose(param, [299.0, -0.04, 0.0])
+    out = warm_start.drift(Model(), [300.0, -0.04, 0.0], xaxis, scales,
+                           scenter)
+    assert np.isnan(out['dT'])
+
+
+def test_run_fit_warm_between_degrees(para):
+    with contextlib.redirect_stdout(io.StringIO()):
+        para.run_fit_cubic(*para.param_cubic)
+        down = para.run_fit_warm(1, prior=para.fit_results['cubic'])
+        up = para.run_fit_warm(4, prior=para.fit_results['linear'])
+
+    assert down['prior'].shape == (2,)
+    assert down['prior'][0] == para.fit_results['cubic'].x[0]
+    assert np.isfinite(down['residual'])
+
+    # mapping upward copies the coefs and pads with zeros
+    np.testing.assert_allclose(up['prior'][:2], down['param'])
+    np.testing.assert_array_equal(up['prior'][2:], 0.0)
+    assert np.isfinite(up['max_rel_curve'])
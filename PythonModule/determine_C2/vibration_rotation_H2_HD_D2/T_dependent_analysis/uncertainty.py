@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for the uncertainty of the temperature and of the C2 curve
+from perturbed sets of band areas (Monte Carlo / bootstrap).
+
+Sets of band areas are drawn either from the errors of the band areas
+(parametric) or by resampling the residuals of the nominal fit
+(bootstrap). Every set is refitted, warm started from the nominal
+optimum, using the CalibrationProblem. Refits are distributed over a
+pool of processes. Refits which did not converge, or with T outside a
+physical range, are rejected and not included in the statistics."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import warm_start
+
+# ------------------------------------------------------
+
+# AVAILABLE FUNCTIONS TO USER :
+
+# draw_band_areas(problem, param, n_draws, method='parametric', seed=None)
+#    Perturbed sets of band areas
+
+# run_uncertainty(problem, param, xaxis, n_draws=1000,
+#                 method='parametric', n_jobs=None, seed=None,
+#                 T_bounds=(200.0, 500.0))
+#    Refit each set, returns percentile bands of C2 and T statistics
+#    of the accepted refits
+
+# ------------------------------------------------------
+
+# percentiles reported for the C2 curve and T
+percentiles = (2.5, 16.0, 50.0, 84.0, 97.5)
+
+# default range (K) of T for a refit to be accepted
+T_bounds = (200.0, 500.0)
+
+# problem used by the worker processes
+_problem = None
+
+# ------------------------------------------------------
+
+
+def draw_band_areas(problem, param, n_draws, method='parametric', seed=None):
+    '''Perturbed sets of band areas for the species of the problem
+
+    method = 'parametric' : area + error * N(0, 1), using the errors of
+                            the band areas (column 1)
+             'bootstrap'  : studentized residuals of the nominal fit
+                            (observed minus predicted band areas,
+                            divided by their errors) are resampled with
+                            replacement and scaled by the error of the
+                            band they are added to. When all errors of
+                            a species are zero, the residuals are
+                            resampled as they are (equal errors)
+
+    Raises ValueError for 'parametric' when all errors of a species are
+    zero (the draws would be the nominal areas), and for 'bootstrap'
+    when only some of them are zero.
+
+    returns => list (n_draws) of dict of band areas ( area | error ) '''
+
+    rng = np.random.default_rng(seed)
+    out = [{} for i in range(n_draws)]
+
+    for name in problem.species:
+        data = problem.data[name]
+        area = data[:, 0]
+        error = np.abs(data[:, 1])
+        n = area.shape[0]
+
+        if method == 'parametric':
+            if not np.any(error > 0):
+                raise ValueError('All errors of the band areas of {0} are '
+                                 'zero, use the bootstrap'.format(name))
+            draws = area + error * rng.standard_normal((n_draws, n))
+        elif method == 'bootstrap':
+            if not np.any(error > 0):
+                error = np.ones(n)
+            elif not np.all(error > 0):
+                raise ValueError('Some errors of the band areas of {0} are '
+                                 'zero, the residuals cannot be '
+                                 'studentized'.format(name))
+            # the common factor of the predicted areas is obtained by
+            # least squares (the sensitivity curve may change sign)
+            model = problem.predicted_areas(name, param)
+            model = model * np.dot(area, model) / np.dot(model, model)
+            resid = (area - model) / error
+            idx = rng.integers(0, n, size=(n_draws, n))
+            draws = model + resid[idx] * error
+        else:
+            raise ValueError("method should be 'parametric' or 'bootstrap'")
+
+        # areas must remain positive
+        draws = np.maximum(draws, 1e-3 * np.abs(area))
+
+        for i in range(n_draws):
+            out[i][name] = np.column_stack((draws[i], data[:, 1]))
+
+    return out
+
+# ------------------------------------------------------
+
+
+def _init_worker(problem):
+    global _problem
+    _problem = problem
+
+
+def _refit(datasets, param, fit_options):
+    '''refit each set of band areas, returns (param, residual, nit,
+    success)'''
+
+    problem = _problem
+    nominal = {name: problem.data[name] for name in problem.species}
+    params = np.zeros((len(datasets), param.shape[0]))
+    fun = np.zeros(len(datasets))
+    nit = np.zeros(len(datasets), dtype=int)
+    success = np.zeros(len(datasets), dtype=bool)
+
+    for i, data in enumerate(datasets):
+        problem.set_data(**data)
+        res = problem.fit(param, **fit_options)
+        params[i] = res.x
+        fun[i] = res.fun
+        nit[i] = res.nit
+        success[i] = res.success
+
+    problem.set_data(**nominal)
+    return params, fun, nit, success
+
+
+def accepted_refits(params, fun, success, T_bounds=T_bounds):
+    '''Mask of the refits which converged, with finite param and
+    residual, and T within T_bounds (K)'''
+
+    params = np.asarray(params, dtype=np.float64)
+    T = params[:, 0]
+    return (np.asarray(success, dtype=bool) & np.isfinite(fun)
+            & np.all(np.isfinite(params), axis=1)
+            & (T >= T_bounds[0]) & (T <= T_bounds[1]))
+
+# ------------------------------------------------------
+
+
+def run_uncertainty(problem, param, xaxis, n_draws=1000, method='parametric',
+                    n_jobs=None, seed=None, chunk=None, fit_options=None,
+                    T_bounds=T_bounds):
+    '''Uncertainty of T and of the C2 curve from n_draws refits
+
+    problem     = CalibrationProblem holding the nominal band areas
+    param       = nominal optimum [T, c1, ...], starting point of the
+                  refits
+    xaxis       = x-axis for the C2 curve
+    method      = 'parametric' or 'bootstrap' (see draw_band_areas)
+    n_jobs      = number of processes (default : number of CPUs).
+                  With n_jobs=1 the refits are run in this process
+    seed        = seed of the random numbers, the result does not
+                  depend on n_jobs
+    chunk       = number of refits per task
+    fit_options = dict, passed to fit_utils.minimize (the default
+                  initial simplex is small, see warm_start.default_step)
+    T_bounds    = (min, max) of T (K) for a refit to be accepted. Refits
+                  which did not converge (res.success False) are also
+                  rejected, see accepted_refits
+
+    Raises RuntimeError when fewer than two refits are accepted.
+
+    returns => dict with
+                 params      = all optimized param, (n_draws, n)
+                 residual    = residual of every refit
+                 nit         = iterations of every refit
+                 accepted    = mask of the accepted refits (n_draws)
+                 n_rejected  = number of rejected refits
+                 T_mean, T_std, T_percentiles, of the accepted refits
+                 curve       = nominal C2 curve on xaxis
+                 curve_std   = standard deviation of C2 on xaxis, of the
+                               accepted refits (as the percentiles)
+                 curve_percentiles = (len(percentiles), len(xaxis))
+                 percentiles '''
+
+    param = np.asarray(param, dtype=np.float64)
+    options = dict(fit_options or {})
+    options.setdefault('simplex_step', warm_start.default_step(param))
+
+    datasets = draw_band_areas(problem, param, n_draws, method, seed)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if chunk is None:
+        chunk = max(1, int(np.ceil(n_draws / (4 * n_jobs))))
+    tasks = [datasets[i:i + chunk] for i in range(0, n_draws, chunk)]
+
+    if n_jobs == 1:
+        _init_worker(problem)
+        results = [_refit(task, param, options) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(problem,)) as pool:
+            results = list(pool.map(_refit, tasks, [param] * len(tasks),
+                                    [options] * len(tasks)))
+
+    params = np.concatenate([r[0] for r in results])
+    fun = np.concatenate([r[1] for r in results])
+    nit = np.concatenate([r[2] for r in results])
+    success = np.concatenate([r[3] for r in results])
+
+    accepted = accepted_refits(params, fun, success, T_bounds)
+    if np.count_nonzero(accepted) < 2:
+        raise RuntimeError('{0} of {1} refits were rejected (not converged '
+                           'or T outside {2})'.format(
+                               n_draws - np.count_nonzero(accepted),
+                               n_draws, T_bounds))
+    T = params[accepted, 0]
+    C2 = problem.curve(params[accepted], xaxis)
+
+    return {'params': params,
+            'residual': fun,
+            'nit': nit,
+            'accepted': accepted,
+            'n_rejected': int(n_draws - np.count_nonzero(accepted)),
+            'T_mean': float(np.mean(T)),
+            'T_std': float(np.std(T, ddof=1)),
+            'T_percentiles': np.percentile(T, percentiles),
+            'curve': problem.curve(param, xaxis),
+            'curve_std': np.std(C2, axis=0, ddof=1),
+            'curve_percentiles': np.percentile(C2, percentiles, axis=0),
+            'percentiles': np.array(percentiles)}
+
+# ------------------------------------------------------
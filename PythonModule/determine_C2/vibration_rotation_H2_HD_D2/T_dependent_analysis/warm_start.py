@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module for starting the fit from a previous calibration of the same
+instrument (warm start), and for reporting the drift of the new result
+from the previous one"""
+
+import numpy as np
+
+import sensitivity_basis
+
+# ------------------------------------------------------
+
+degree_names = {1: 'linear', 2: 'quadratic', 3: 'cubic', 4: 'quartic',
+                5: 'quintuple'}
+
+# ------------------------------------------------------
+
+
+def polynomial_curve(coefs, scales, scenter, x, basis='monomial',
+                     domain=None):
+    '''Sensitivity curve, 1 + sum c_k * t_k(x), for example
+    1 + sum (c_k/scale_k) * (x-scenter)**k for the monomial basis
+
+    coefs   = c1 to cn
+    scales  = scale1 to scalen
+    scenter = center of the x-axis
+    x       = x-axis
+    basis, domain = see sensitivity_basis '''
+
+    return sensitivity_basis.curve(coefs, x, basis, scales, scenter, domain)
+
+# ------------------------------------------------------
+
+
+def _spec(scales, scenter, basis='monomial', domain=None):
+    return {'scales': np.asarray(scales, dtype=np.float64),
+            'scenter': float(scenter), 'basis': basis,
+            'domain': None if domain is None else tuple(np.ravel(domain))}
+
+
+def _same_basis(a, b, n):
+    '''True when coefs in spec a and spec b describe the same terms
+    (for the first n terms)'''
+
+    if a['basis'] != b['basis'] or a['scenter'] != b['scenter']:
+        return False
+    if a['basis'] == 'monomial':
+        return np.allclose(a['scales'][:n], b['scales'][:n])
+    return np.allclose(a['domain'], b['domain'])
+
+# ------------------------------------------------------
+
+
+def _temperature(T):
+    return None if T is None else float(T)
+
+
+def _unpack(prior, spec):
+    '''Returns T (None when the prior has no temperature), coefs and the
+    basis (spec) of a prior result. spec['scales'] holds the scales of
+    all degrees (scale1 to scale5), the prior takes as many as it has
+    coefs when they are not stored with it
+
+    prior may be
+        - vector [T, c1, c2, ...] or OptimizeResult (res.x), with the
+          present basis (spec)
+        - record (dict) from the calibration store, with keys
+          'temperature', 'coefs' and optionally 'scales', 'scenter',
+          'basis' and 'domain' in record['extra']
+        - CorrectionModel (or any object with temperature, coefs,
+          scales, scenter and optionally basis and domain) '''
+
+    if hasattr(prior, 'x'):
+        prior = prior.x
+
+    if isinstance(prior, dict):
+        extra = prior.get('extra') or {}
+        coefs = np.asarray(prior['coefs'], dtype=np.float64)
+        return (_temperature(prior.get('temperature')), coefs,
+                _spec(extra.get('scales', spec['scales'][:coefs.shape[0]]),
+                      extra.get('scenter', spec['scenter']),
+                      extra.get('basis', 'monomial'),
+                      extra.get('domain', spec['domain'])))
+
+    if hasattr(prior, 'coefs') and hasattr(prior, 'scales'):
+        return (_temperature(getattr(prior, 'temperature', None)),
+                np.asarray(prior.coefs),
+                _spec(prior.scales, prior.scenter,
+                      getattr(prior, 'basis', 'monomial'),
+                      getattr(prior, 'domain', None)))
+
+    prior = np.asarray(prior, dtype=np.float64).ravel()
+    return (float(prior[0]), prior[1:],
+            dict(spec, scales=spec['scales'][:prior.shape[0]-1]))
+
+# ------------------------------------------------------
+
+
+def map_coefs(coefs, prior_scales, prior_scenter, degree, scales, scenter,
+              xaxis, prior_basis='monomial', prior_domain=None,
+              basis='monomial', domain=None):
+    '''Map coefs of a previous fit to a polynomial of the given degree
+    with the present basis, scales and scenter.
+
+    When the basis is the same and the degree is not lower, the coefs
+    are copied and padded with zeros (exact). Otherwise the previous
+    curve is projected onto the new polynomial by linear least squares
+    over xaxis.
+
+    returns => coefs, c1 to c_degree '''
+
+    coefs = np.asarray(coefs, dtype=np.float64)
+    prior = _spec(prior_scales, prior_scenter, prior_basis, prior_domain)
+    present = _spec(np.asarray(scales)[:degree], scenter, basis, domain)
+
+    n = coefs.shape[0]
+    if n <= degree and _same_basis(prior, present, n):
+        out = np.zeros(degree)
+        out[:n] = coefs
+        return out
+
+    curve = polynomial_curve(coefs, prior['scales'], prior['scenter'], xaxis,
+                             prior['basis'], prior['domain'])
+    terms = sensitivity_basis.terms(xaxis, degree, basis, present['scales'],
+                                    scenter, domain)
+    out, _, _, _ = np.linalg.lstsq(terms, curve - 1.0, rcond=None)
+    return out
+
+# ------------------------------------------------------
+
+
+def _map_prior(prior, degree, xaxis, spec):
+    T, coefs, prior_spec = _unpack(prior, spec)
+    mapped = map_coefs(coefs, prior_spec['scales'], prior_spec['scenter'],
+                       degree, spec['scales'], spec['scenter'], xaxis,
+                       prior_spec['basis'], prior_spec['domain'],
+                       spec['basis'], spec['domain'])
+    return T, coefs, prior_spec, mapped
+
+
+def prior_param(prior, degree, xaxis, scales, scenter, basis='monomial',
+                domain=None, T_init=None):
+    '''Initial param [T, c1, ..., c_degree] from a previous result
+    (see _unpack for the accepted types of prior)
+
+    scales = scale1 to scale5 (all degrees, the prior may have more
+             coefs than degree)
+    T_init = temperature used when the prior has none '''
+
+    spec = _spec(scales, scenter, basis, domain)
+    T, coefs, prior_spec, mapped = _map_prior(prior, degree, xaxis, spec)
+    if T is None:
+        if T_init is None:
+            raise ValueError('The prior has no temperature, T_init is '
+                             'required')
+        T = float(T_init)
+    return np.concatenate(([T], mapped))
+
+# ------------------------------------------------------
+
+
+def default_step(param, step_T=1.0, rel_step=0.02, abs_step=1e-3):
+    '''Step for the initial simplex of a warm start, small compared to
+    the default simplex of Nelder-Mead (5 % of each parameter) since
+    the start is expected to be close to the optimum'''
+
+    param = np.asarray(param, dtype=np.float64)
+    step = rel_step * np.abs(param) + abs_step
+    step[0] = step_T
+    return step
+
+# ------------------------------------------------------
+
+
+def drift(prior, param, xaxis, scales, scenter, basis='monomial',
+          domain=None):
+    '''Drift of the new result from the previous one
+
+    prior  = previous result (see _unpack)
+    param  = optimized [T, c1, ...]
+    scales = scale1 to scale5 (see prior_param)
+
+    returns => dict with
+                 dT            = change in temperature (nan when the
+                                 prior has no temperature)
+                 dcoefs        = change in coefs (after mapping the
+                                 previous coefs to the same degree)
+                 max_rel_curve = maximum change of the sensitivity
+                                 curve over xaxis, relative to the
+                                 maximum of the previous curve '''
+
+    param = np.asarray(param, dtype=np.float64)
+    degree = param.shape[0] - 1
+
+    spec = _spec(scales, scenter, basis, domain)
+    T, coefs, prior_spec, mapped = _map_prior(prior, degree, xaxis, spec)
+
+    old_curve = polynomial_curve(coefs, prior_spec['scales'],
+                                 prior_spec['scenter'], xaxis,
+                                 prior_spec['basis'], prior_spec['domain'])
+    new_curve = polynomial_curve(param[1:], scales, scenter, xaxis, basis,
+                                 domain)
+
+    return {'dT': np.nan if T is None else param[0] - T,
+            'dcoefs': param[1:] - mapped,
+            'max_rel_curve': float(np.max(np.abs(new_curve - old_curve))
+                                   / np.max(np.abs(old_curve)))}
+
+# ------------------------------------------------------
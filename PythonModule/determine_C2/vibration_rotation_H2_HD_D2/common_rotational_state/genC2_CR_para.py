@@ -271,6 +271,7 @@ log.info('\t\t Norm:\t %s', norm)
 #   np array of residuals to be passed for plot of residuals
 
 # ------------------------------------------------------
+@utils.profiled
 def run_all_fit():
     '''
     Runs the fitting from linear to quartic polynomial
@@ -832,6 +833,7 @@ def residual_quartic(param):
 # *******************************************************************
 
 
+@utils.profiled
 def run_fit_linear(init_k1):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -871,6 +873,7 @@ def run_fit_linear(init_k1):
 # *******************************************************************
 # *******************************************************************
 
+@utils.profiled
 def run_fit_quadratic ( init_k1, init_k2 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -915,6 +918,7 @@ def run_fit_quadratic ( init_k1, init_k2 ):
 # *******************************************************************
 # *******************************************************************
 
+@utils.profiled
 def run_fit_cubic ( init_k1, init_k2, init_k3 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -961,6 +965,7 @@ def run_fit_cubic ( init_k1, init_k2, init_k3 ):
 # *******************************************************************
 # *******************************************************************
 
+@utils.profiled
 def run_fit_quartic ( init_k1, init_k2, init_k3, init_k4 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
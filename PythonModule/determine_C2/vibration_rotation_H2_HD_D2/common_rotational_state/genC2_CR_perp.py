@@ -249,6 +249,7 @@ log.info('\t\t Norm:\t %s', norm)
 #############################################################################
 
 # ------------------------------------------------------
+@utils.profiled
 def run_all_fit():
     '''
     Runs the fitting from linear to quartic polynomial
@@ -869,6 +870,7 @@ def residual_quartic(param):
 # *******************************************************************
 
 
+@utils.profiled
 def run_fit_linear(init_k1):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -908,6 +910,7 @@ def run_fit_linear(init_k1):
 # *******************************************************************
 # *******************************************************************
 
+@utils.profiled
 def run_fit_quadratic ( init_k1, init_k2 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -952,6 +955,7 @@ def run_fit_quadratic ( init_k1, init_k2 ):
 # *******************************************************************
 # *******************************************************************
 
+@utils.profiled
 def run_fit_cubic ( init_k1, init_k2, init_k3 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -998,6 +1002,7 @@ def run_fit_cubic ( init_k1, init_k2, init_k3 ):
 # *******************************************************************
 # *******************************************************************
 
+@utils.profiled
 def run_fit_quartic ( init_k1, init_k2, init_k3, init_k4 ):
     '''Function performing the actual fit using the residual_linear function
     defined earlier '''
@@ -255,7 +255,9 @@ def gen_diff(data_expt):
 
         index = np.where(np.isclose(data_expt[:,0] , np.abs(v)))
 
-        IntStokes = data_expt[index[0], 1]
+        # scalar (first match), numpy >= 2 does not convert the array of
+        # one element when assigned to output[i]
+        IntStokes = data_expt[index[0][0], 1]
 
         diff = int_ratio_as_s( np.abs(v), IntStokes, IntAStokes,\
                               refT, laser_wavenum)